@@ -0,0 +1,248 @@
+"""
+准入控制 - 限制同时进行的千帆调用数，并按用户、按 IP 限速，超出时尽快返回 429
+
+原先 /chat 不做任何限制：高峰期并发调用超出千帆的 QPS 配额，所有人一起报错；
+等待千帆的请求占满 Worker，连 /conversations 这种轻量路由也排不上队。这里分三层：
+1. ConcurrencyLimiter：全局信号量限制同时进行的生成请求；名额用完时最多再排 max_queue 个，
+   排队超过 queue_timeout 或队列已满时直接拒绝，而不是让请求堆在 60 秒的读超时后面
+2. RateLimiter：按用户、按 IP 的令牌桶，状态存在 Redis 中，多个 Worker 共享同一个桶
+3. 被拒绝时由调用方返回 429 并带上 Retry-After，前端按这个时间暂停发送
+
+令牌桶用 WATCH / MULTI 乐观事务更新（同一个桶很少被并发修改）；Redis 不可用时放行，只记录日志。
+"""
+import asyncio
+import logging
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager, asynccontextmanager
+
+import redis
+
+from telemetry import ADMISSION_REJECTED, observe_stage
+
+logger = logging.getLogger(__name__)
+
+
+class Overloaded(Exception):
+    """请求被准入控制拒绝"""
+
+    def __init__(self, reason: str, retry_after: float):
+        super().__init__(f'{reason}, retry after {retry_after:.1f}s')
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class ConcurrencyLimiter:
+    def __init__(self, max_concurrent: int = 16, max_queue: int = 32, queue_timeout: float = 10,
+                 retry_after: float = 2, enabled: bool = True):
+        """
+        :param max_concurrent: 同时进行的生成请求上限
+        :param max_queue: 名额用完后最多排队等待的请求数，超出的直接拒绝
+        :param queue_timeout: 排队的最长时间（秒）
+        :param retry_after: 拒绝时建议客户端等待的时间（秒）
+        """
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.retry_after = retry_after
+        self.enabled = enabled
+        self._cond = threading.Condition()
+        self._active = 0
+        self._waiting = 0
+        self._stats = {'admitted': 0, 'queued': 0, 'rejected_queue_full': 0, 'rejected_timeout': 0}
+
+    @classmethod
+    def from_env(cls) -> "ConcurrencyLimiter":
+        env = os.environ
+        return cls(
+            max_concurrent=int(env.get('UPSTREAM_MAX_CONCURRENCY', 16)),
+            max_queue=int(env.get('UPSTREAM_MAX_QUEUE', 32)),
+            queue_timeout=float(env.get('UPSTREAM_QUEUE_TIMEOUT', 10)),
+            retry_after=float(env.get('UPSTREAM_RETRY_AFTER', 2)),
+            enabled=env.get('ADMISSION_ENABLED', '1').lower() not in ('0', 'false', 'no')
+        )
+
+    def acquire(self):
+        """占用一个名额，需要时排队；被拒绝时抛出 Overloaded"""
+        if not self.enabled:
+            return
+        start = time.monotonic()
+        with self._cond:
+            if self._active < self.max_concurrent:
+                self._active += 1
+                self._stats['admitted'] += 1
+                return
+            if self._waiting >= self.max_queue:
+                self._stats['rejected_queue_full'] += 1
+                self._reject('queue_full')
+            self._waiting += 1
+            self._stats['queued'] += 1
+            try:
+                admitted = self._cond.wait_for(lambda: self._active < self.max_concurrent, self.queue_timeout)
+                if not admitted:
+                    self._stats['rejected_timeout'] += 1
+                    self._reject('queue_timeout')
+                self._active += 1
+                self._stats['admitted'] += 1
+            finally:
+                self._waiting -= 1
+        observe_stage('queue_wait', time.monotonic() - start)
+
+    def release(self):
+        if not self.enabled:
+            return
+        with self._cond:
+            self._active -= 1
+            self._cond.notify()
+
+    @contextmanager
+    def slot(self):
+        self.acquire()
+        try:
+            yield
+        finally:
+            self.release()
+
+    def stats(self) -> dict:
+        with self._cond:
+            stats = dict(self._stats)
+            stats['active'] = self._active
+            stats['waiting'] = self._waiting
+        stats['max_concurrent'] = self.max_concurrent
+        stats['max_queue'] = self.max_queue
+        stats['enabled'] = self.enabled
+        return stats
+
+    def _reject(self, reason):
+        ADMISSION_REJECTED.inc(reason=reason)
+        raise Overloaded(reason, self.retry_after)
+
+
+class AsyncConcurrencyLimiter(ConcurrencyLimiter):
+    """ConcurrencyLimiter 的 asyncio 版本，供 ASGI 入口使用（只在同一个事件循环内使用）"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._sem = asyncio.Semaphore(self.max_concurrent)
+
+    async def acquire(self):
+        if not self.enabled:
+            return
+        if not self._sem.locked():
+            await self._sem.acquire()
+        else:
+            if self._waiting >= self.max_queue:
+                self._stats['rejected_queue_full'] += 1
+                self._reject('queue_full')
+            start = time.monotonic()
+            self._waiting += 1
+            self._stats['queued'] += 1
+            try:
+                await asyncio.wait_for(self._sem.acquire(), self.queue_timeout)
+            except asyncio.TimeoutError:
+                self._stats['rejected_timeout'] += 1
+                self._reject('queue_timeout')
+            finally:
+                self._waiting -= 1
+            observe_stage('queue_wait', time.monotonic() - start)
+        self._active += 1
+        self._stats['admitted'] += 1
+
+    def release(self):
+        if not self.enabled:
+            return
+        self._active -= 1
+        self._sem.release()
+
+    @asynccontextmanager
+    async def slot(self):
+        await self.acquire()
+        try:
+            yield
+        finally:
+            self.release()
+
+    def stats(self) -> dict:
+        stats = dict(self._stats)
+        stats.update(active=self._active, waiting=self._waiting, max_concurrent=self.max_concurrent,
+                     max_queue=self.max_queue, enabled=self.enabled)
+        return stats
+
+
+class RateLimiter:
+    def __init__(self, redis_client, prefix: str = 'food_bot:rate:', user_rate: float = 0.5,
+                 user_burst: int = 10, ip_rate: float = 2, ip_burst: int = 30, enabled: bool = True):
+        """
+        :param redis_client: redis.Redis 实例
+        :param user_rate: 每个用户每秒补充的令牌数（长期平均的请求速率）
+        :param user_burst: 每个用户的桶容量（允许的突发请求数）
+        :param ip_rate: 每个 IP 每秒补充的令牌数；同一出口 IP 后面可能有很多用户，默认放宽
+        :param ip_burst: 每个 IP 的桶容量
+        """
+        self.redis = redis_client
+        self.prefix = prefix
+        self.user_rate = user_rate
+        self.user_burst = user_burst
+        self.ip_rate = ip_rate
+        self.ip_burst = ip_burst
+        self.enabled = enabled
+
+    @classmethod
+    def from_env(cls, redis_client) -> "RateLimiter":
+        env = os.environ
+        return cls(
+            redis_client,
+            user_rate=float(env.get('RATE_LIMIT_USER_RATE', 0.5)),
+            user_burst=int(env.get('RATE_LIMIT_USER_BURST', 10)),
+            ip_rate=float(env.get('RATE_LIMIT_IP_RATE', 2)),
+            ip_burst=int(env.get('RATE_LIMIT_IP_BURST', 30)),
+            enabled=env.get('ADMISSION_ENABLED', '1').lower() not in ('0', 'false', 'no')
+        )
+
+    def check(self, user_id: str = None, ip: str = None):
+        """在同一个事务里检查用户桶和 IP 桶，两个桶都有令牌时才一起扣减，否则抛出 Overloaded"""
+        if not self.enabled:
+            return
+        buckets = [(kind, f'{self.prefix}{kind}:{key}', rate, burst)
+                   for kind, key, rate, burst in (('user', user_id, self.user_rate, self.user_burst),
+                                                  ('ip', ip, self.ip_rate, self.ip_burst))
+                   if key and rate > 0]
+        if not buckets:
+            return
+        rejected = self._take(buckets)
+        if rejected:
+            kind, wait = rejected
+            ADMISSION_REJECTED.inc(reason=f'{kind}_rate')
+            raise Overloaded(f'{kind}_rate', wait)
+
+    def _take(self, buckets):
+        """从所有桶各取一个令牌；全部成功返回 None，否则不扣任何令牌，返回 (第一个不足的桶, 还需等待的秒数)"""
+        def update(pipe):
+            now = time.time()
+            levels = []
+            for kind, key, rate, burst in buckets:
+                tokens, stamp = pipe.hmget(key, 'tokens', 'ts')
+                if tokens is None or stamp is None:
+                    tokens = float(burst)
+                else:
+                    tokens = min(float(burst), float(tokens) + max(0.0, now - float(stamp)) * rate)
+                if tokens < 1:
+                    # 只要有一个桶不够就整体拒绝，其它桶的令牌不动，避免 IP 被限时白白耗掉用户配额
+                    pipe.multi()
+                    return kind, (1 - tokens) / rate
+                levels.append(tokens)
+            pipe.multi()
+            for (kind, key, rate, burst), tokens in zip(buckets, levels):
+                pipe.hset(key, mapping={'tokens': tokens - 1, 'ts': now})
+                # 桶回满之后状态就没有意义了
+                pipe.expire(key, math.ceil(burst / rate) + 1)
+            return None
+
+        try:
+            return self.redis.transaction(update, *(key for _, key, _, _ in buckets),
+                                          value_from_callable=True)
+        except redis.RedisError as e:
+            logger.warning("[限流] Redis 访问失败，放行请求: %s", e)
+            return None
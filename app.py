@@ -1,6 +1,6 @@
 """
 Flask Web 版美食聊天机器人（Redis 后端 Session，彻底解决 4 KB Cookie 问题）
-运行：python app.py
+运行：python app.py（gunicorn 多进程，配置见 gunicorn.conf.py；WEB_SERVER=flask 或 FLASK_DEBUG=1 时为原来的 Flask 开发服务器）
 访问：http://localhost:5000
 """
 # =====================  新增：Redis 后端  =====================
@@ -8,18 +8,44 @@ from flask_session import Session      # pip install Flask-Session
 import redis                            # pip install redis
 # ============================================================
 
-from flask import Flask, render_template, request, jsonify, session, send_from_directory
+from flask import Flask, render_template, request, jsonify, session, send_from_directory, Response, g, url_for
 from datetime import timedelta, datetime
+import importlib.util
 import os
+import sys
+import json
+import logging
+import math
+import time
 import uuid
+import zlib
 from dotenv import load_dotenv
 from food_bot import SimpleFoodBot
-import traceback
+from response_cache import ResponseCache
+from conversation_store import ConversationStore
+from conversation_archive import ConversationArchive
+from knowledge_index import KnowledgeIndex
+from static_assets import StaticAssets
+from single_flight import SingleFlight
+from health_monitor import HealthMonitor, SharedProbe
+from admission import ConcurrencyLimiter, RateLimiter, Overloaded
+from chat_jobs import ChatJobQueue, JobFailed, FINAL_STATUSES, STATUS_QUEUED, STATUS_DONE, STATUS_FAILED
+from model_router import ModelRouter
+from session_access import (LazySessionInterface, session_access, mark_bootstrap,
+                            SESSION_NONE, SESSION_READ)
+from session_cache import SessionNearCache
+from session_codec import SessionCodec
+from telemetry import REGISTRY, HTTP_REQUEST_SECONDS, configure_logging, stop_logging, stage, observe_stage
+import threading
 
 # 加载 .env
 load_dotenv()
+configure_logging()
+logger = logging.getLogger(__name__)
 
-app = Flask(__name__, static_folder='static', template_folder='templates')
+# 不注册 Flask 内置的 static 路由（它与下面的 serve_static 规则相同且先匹配），/static 统一由 serve_static 发送
+app = Flask(__name__, static_folder=None, template_folder='templates')
+app.static_folder = 'static'
 
 # ================  Redis Session 配置（替换原 Cookie 配置）  ================
 app.config['SECRET_KEY'] = 'food_bot_secret_key_2024'
@@ -29,51 +55,219 @@ app.config['PERMANENT_SESSION_LIFETIME'] = timedelta(hours=24)
 app.config['SESSION_USE_SIGNER'] = True
 app.config['SESSION_KEY_PREFIX'] = 'food_bot:'
 # 本地默认端口 6379，无密码；生产改成 redis://:pwd@host:6379/1
-app.config['SESSION_REDIS'] = redis.from_url('redis://localhost:6379/0')
+REDIS_URL = os.getenv('REDIS_URL', 'redis://localhost:6379/0')
+app.config['SESSION_REDIS'] = redis.from_url(REDIS_URL)
 Session(app)                          # 初始化扩展
+# 用紧凑编码 + 压缩替换默认的 pickle；旧的 pickle Session 读取后按新格式写回（见 session_codec.py）
+session_codec = SessionCodec.from_env()
+app.session_interface.serializer = session_codec
+# 进程内近端缓存：Session 未变化（版本号相同）时不再从 Redis 取回整个 Session（见 session_cache.py）
+session_cache = SessionNearCache.from_env(app.config['SESSION_REDIS'])
+app.session_interface.redis = session_cache
 # ============================================================================
 
+
+# 按路由声明的访问方式读写 Session：用到时才加载，只读路由不写回，没有改动时不写（见 session_access.py）
+app.session_interface = LazySessionInterface(app.session_interface,
+                                             refresh_interval=int(os.getenv('SESSION_REFRESH_INTERVAL', 3600)))
+
 API_KEY = os.getenv('BAIDU_API_KEY', '')
 if not API_KEY or not API_KEY.startswith('bce-'):
-    print("⚠️  未找到有效 API Key，请在 .env 文件写入 BAIDU_API_KEY=your_bce_key")
+    logger.warning("⚠️  未找到有效 API Key，请在 .env 文件写入 BAIDU_API_KEY=your_bce_key")
+
+# 回复缓存：与 Session 共用同一个 Redis 连接
+response_cache = ResponseCache.from_env(app.config['SESSION_REDIS'])
+
+# 请求合并：相同问题并发到达时只调用一次千帆（SINGLE_FLIGHT_REDIS=1 时跨 Worker 合并）
+single_flight = SingleFlight.from_env(app.config['SESSION_REDIS'])
+
+# 模型路由：简单问题交给 fast 模型，慢请求对冲到 hedge 模型；延迟统计在进程内共享
+model_router = ModelRouter.from_env()
+
+# 本地知识库：菜品、菜系、城市的事实问题直接作答，其余问题附上相关资料（见 knowledge_index.py）
+knowledge_index = KnowledgeIndex.from_env()
+
+# 静态资源：带内容指纹的预压缩构建产物，长期缓存（见 static_assets.py）
+static_assets = StaticAssets.from_env(app.static_folder)
+
+# 对话存储：每个对话独立存放，Session 中只保留 user_id 和 current_conversation_id
+# 存储中保留的消息条数；实际发送多少由机器人按 token 预算决定，更早的折叠成摘要
+MAX_HISTORY_MESSAGES = int(os.getenv('HISTORY_MAX_MESSAGES', 40))
+conversation_store = ConversationStore(app.config['SESSION_REDIS'],
+                                       ttl=int(app.permanent_session_lifetime.total_seconds()),
+                                       max_messages=MAX_HISTORY_MESSAGES,
+                                       codec=session_codec,
+                                       archive=ConversationArchive.from_env())
+CONVERSATION_PAGE_SIZE = 50       # /conversations 默认每页条数
+MAX_CONVERSATION_PAGE_SIZE = 200
+MESSAGE_PAGE_SIZE = 20            # 切换对话与 /conversations/<id>/messages 每页的消息条数
+MAX_MESSAGE_PAGE_SIZE = 100
+
+# 准入控制：限制同时进行的生成请求数（有界排队），并按用户、按 IP 限速（令牌桶存在 Redis 中）
+upstream_limiter = ConcurrencyLimiter.from_env()
+rate_limiter = RateLimiter.from_env(app.config['SESSION_REDIS'])
+# 部署在反向代理后面时设为 1，限流按 X-Forwarded-For 中的客户端地址计算
+TRUST_FORWARDED_FOR = os.getenv('TRUST_FORWARDED_FOR', '').lower() in ('1', 'true', 'yes')
+
+# 任务模式（CHAT_JOBS_ENABLED=1）：/chat 与 /chat/stream 只把问题放进 Redis 队列，由 python chat_jobs.py worker
+# 生成回复，客户端通过 /chat/jobs/<id> 或 /chat/jobs/<id>/events 取回结果（见 chat_jobs.py）。
+# 这里的 Flask 路由不等待，立即返回任务的当前状态；长轮询与 SSE 推送由 asgi.py 在事件循环中完成
+chat_jobs = ChatJobQueue.from_env(app.config['SESSION_REDIS'])
+CHAT_JOB_MAX_WAIT = float(os.getenv('CHAT_JOBS_MAX_WAIT', 25))          # 长轮询单次最多等待的秒数（asgi.py）
+CHAT_JOB_STREAM_TIMEOUT = float(os.getenv('CHAT_JOBS_STREAM_TIMEOUT', 120))  # SSE 连接最多保持的秒数（asgi.py）
+# 这些兜底原因稍后重试可能成功；其余（代理配置错误、内部错误）直接作为结果返回
+RETRYABLE_FALLBACKS = ('timeout', 'connection', 'http_error', 'parse_error', 'flight')
+
+# 健康监控：后台线程探测 Redis 与千帆，请求路径只读缓存的结果
+health_monitor = HealthMonitor()
+health_monitor.add_check('redis', app.config['SESSION_REDIS'].ping,
+                         interval=int(os.getenv('HEALTH_REDIS_INTERVAL', 10)),
+                         max_backoff=int(os.getenv('HEALTH_MAX_BACKOFF', 60)))
+
+# /metrics 抓取时才读取的状态：缓存、请求合并与健康检查
+REGISTRY.add_collector(
+    'foodbot_reply_cache_total', 'counter', '回复缓存的命中、未命中、写入与错误次数',
+    lambda: [({'event': k}, v) for k, v in response_cache.stats().items()
+             if k in ('l1_hits', 'l2_hits', 'misses', 'stores', 'errors')])
+REGISTRY.add_collector(
+    'foodbot_session_cache_total', 'counter', 'Session 近端缓存的命中、过期、未命中、写入与淘汰次数',
+    lambda: [({'event': k}, v) for k, v in session_cache.stats().items()
+             if k in ('hits', 'unchecked_hits', 'stale', 'misses', 'writes', 'evictions')])
+REGISTRY.add_collector(
+    'foodbot_session_cache_hit_ratio', 'gauge', 'Session 近端缓存的累计命中率',
+    lambda: [({}, session_cache.stats()['hit_rate'])])
+REGISTRY.add_collector(
+    'foodbot_single_flight_total', 'counter', '请求合并的 leader、被合并请求、超时等次数',
+    lambda: [({'event': k}, v) for k, v in single_flight.stats().items()
+             if k not in ('in_flight', 'enabled', 'cross_worker')])
+REGISTRY.add_collector(
+    'foodbot_upstream_slots', 'gauge', '正在生成（active）与排队等待（waiting）的请求数',
+    lambda: [({'state': k}, upstream_limiter.stats()[k]) for k in ('active', 'waiting')])
+REGISTRY.add_collector(
+    'foodbot_model_requests_total', 'counter', '各模型的非流式调用次数（outcome=ok/error）',
+    lambda: [sample for name, m in model_router.stats()['models'].items()
+             for sample in (({'model': name, 'outcome': 'ok'}, m['requests'] - m['errors']),
+                            ({'model': name, 'outcome': 'error'}, m['errors']))])
+REGISTRY.add_collector(
+    'foodbot_model_latency_seconds', 'gauge', '各模型最近调用的延迟分位数（秒）',
+    lambda: [({'model': name, 'quantile': q}, m[field] / 1000)
+             for name, m in model_router.stats()['models'].items() if m['samples']
+             for q, field in (('0.5', 'p50_ms'), ('0.95', 'p95_ms'))])
+REGISTRY.add_collector(
+    'foodbot_router_events_total', 'counter', '分流到 fast 模型、发出对冲请求、对冲请求胜出、因名额已满未对冲的次数',
+    lambda: [({'event': k}, model_router.stats()[k])
+             for k in ('routed_fast', 'hedges_fired', 'hedges_won', 'hedges_skipped')])
+REGISTRY.add_collector(
+    'foodbot_router_pool', 'gauge', '对冲线程池中正在执行的调用数（busy）与其中的对冲请求数（hedging）',
+    lambda: [({'state': 'busy'}, model_router.stats()['pool_busy']),
+             ({'state': 'hedging'}, model_router.stats()['hedges_in_flight'])])
+if chat_jobs.enabled:
+    REGISTRY.add_collector(
+        'foodbot_chat_job_queue', 'gauge', '生成任务队列中排队、等待重试、执行中与死信的任务数',
+        lambda: [({'queue': k}, v) for k, v in chat_jobs.stats().items() if k != 'enabled'])
+REGISTRY.add_collector(
+    'foodbot_health_up', 'gauge', '检查项最近一次探测是否成功（1 成功，0 失败或尚未探测）',
+    lambda: [({'check': name}, int(bool(c['healthy']))) for name, c in health_monitor.snapshot()['checks'].items()])
 
-# 机器人单例
+# 机器人单例（多线程下只创建一次）
 bot_instance = None
+bot_lock = threading.Lock()
 def get_bot():
+    """返回机器人单例，不会阻塞：构造时不测试连接，千帆的可用性由 health_monitor 在后台探测；
+    连续 HEALTH_FAILURE_THRESHOLD 次探测失败后返回 None，首次探测完成前照常返回机器人
+    """
     global bot_instance
     if bot_instance is None and API_KEY:
-        try:
-            bot_instance = SimpleFoodBot(API_KEY)
-            print("✓ 机器人初始化成功")
-        except Exception as e:
-            print(f"✗ 机器人初始化失败: {e}")
-            bot_instance = None
+        with bot_lock:
+            if bot_instance is None:
+                bot = SimpleFoodBot(API_KEY, cache=response_cache, flight=single_flight, router=model_router,
+                                    knowledge=knowledge_index, check_connection=False)
+                # 探测是一次真实的对话补全：所有进程共用一个探测结果，每个间隔只探测一次
+                interval = int(os.getenv('HEALTH_PROBE_INTERVAL', 60))
+                probe = SharedProbe(app.config['SESSION_REDIS'], 'food_bot:health:qianfan', bot.ping, ttl=interval)
+                health_monitor.add_check('qianfan', probe, interval=interval,
+                                         max_backoff=int(os.getenv('HEALTH_MAX_BACKOFF', 60)),
+                                         failure_threshold=int(os.getenv('HEALTH_FAILURE_THRESHOLD', 3)))
+                bot_instance = bot
+                logger.info("✓ 机器人初始化成功，后台探测千帆连接")
+    health_monitor.start()
+    if health_monitor.status('qianfan') is False:
+        return None
     return bot_instance
 
-# ---------- 以下为原业务代码，未做任何改动 ----------
+# ---------- 多进程部署：Worker 进程的初始化与退出（由 gunicorn.conf.py 中的钩子调用） ----------
+def reset_after_fork():
+    """预加载模式下应用在 master 中导入：fork 后丢弃继承来的 Redis 连接、千帆连接、归档连接与机器人，由本进程重新创建"""
+    global bot_instance
+    app.config['SESSION_REDIS'].connection_pool.reset()
+    if bot_instance is not None:
+        bot_instance.transport.reset()
+        bot_instance = None
+    if conversation_store.archive is not None:
+        conversation_store.archive.reset()
+
+def init_worker():
+    """Worker 开始处理请求前调用：创建本进程的机器人（千帆连接池），启动健康检查线程"""
+    get_bot()
+    logger.info("[Worker %d] 已就绪", os.getpid())
+
+def shutdown_worker():
+    """Worker 退出时调用（进行中的请求已处理完或已超过 graceful_timeout）"""
+    health_monitor.stop()
+    if bot_instance is not None:
+        bot_instance.transport.close()
+    logger.info("[Worker %d] 已退出", os.getpid())
+    stop_logging()
+
+# ---------- 以下为原业务代码，对话数据改存 ConversationStore ----------
 @app.before_request
-def before_request():
-    if 'conversations' not in session:
-        session['conversations'] = {}
+def start_timer():
+    g.request_start = time.perf_counter()
+
+@app.after_request
+def record_request_time(response):
+    # 流式响应只统计到响应头返回为止，整轮耗时见 turn_total
+    if 'request_start' in g:
+        HTTP_REQUEST_SECONDS.observe(time.perf_counter() - g.request_start, route=request.endpoint or 'unknown')
+    return response
+
+def ensure_user():
+    """返回当前用户 ID；新访客在这里分配用户 ID 并创建默认对话，旧版 Session 中的对话在这里迁移
+    只在需要用户和当前对话的路由中调用，静态文件、探针等请求不会因此读写 Session
+    """
+    changed = False
+    if 'user_id' not in session:
+        session['user_id'] = str(uuid.uuid4())
+        changed = True
+    uid = session['user_id']
+    # 旧版 Session 把全部对话整块存在 session['conversations'] 里，首次访问时迁移出来
+    if 'conversations' in session:
+        conversation_store.import_conversations(uid, session.pop('conversations'))
+        changed = True
     if 'current_conversation_id' not in session:
-        default_id = str(uuid.uuid4())
-        session['current_conversation_id'] = default_id
-        session['conversations'][default_id] = {
-            'name': '新对话',
-            'history': [],
-            'starred': False,
-            'created_at': datetime.now().isoformat(),
-            'last_updated': datetime.now().isoformat(),
-            'last_message': '您好！欢迎使用食探AI'
-        }
+        session['current_conversation_id'] = conversation_store.create(uid, last_message='您好！欢迎使用食探AI')
+        changed = True
+    if changed:
+        mark_bootstrap(session)
+    return uid
+
+@app.template_global()
+def asset_url(filename):
+    """模板中引用静态文件：构建清单中有时返回带指纹的地址（可长期缓存），否则返回原地址"""
+    if static_assets is not None:
+        filename = static_assets.url(filename) or filename
+    return url_for('static', filename=filename)
 
 @app.route('/')
+@session_access(SESSION_NONE)
 def index():
     return render_template('index.html')
 
 @app.route('/chat', methods=['POST'])
 def chat():
+    started = time.perf_counter()
     try:
+        uid = ensure_user()
         current_id = session.get('current_conversation_id')
         if not current_id:
             return jsonify({'success': False, 'reply': '请先创建对话'})
@@ -84,63 +278,170 @@ def chat():
             return jsonify({'success': False, 'reply': '请输入内容'})
 
         # 特殊指令
-        if user_input.lower() in ['清空', '清除', 'clear', 'reset']:
-            if current_id in session['conversations']:
-                session['conversations'][current_id]['history'] = []
-                session['conversations'][current_id]['last_message'] = '对话已清空'
-                session['conversations'][current_id]['last_updated'] = datetime.now().isoformat()
-                session.modified = True
-            return jsonify({'success': True, 'reply': '当前对话历史已清空！'})
-
-        if user_input.lower() in ['帮助', 'help', '?']:
-            return jsonify({'success': True, 'reply': get_help_message()})
+        command_reply = handle_command(user_input, uid, current_id)
+        if command_reply:
+            return jsonify({'success': True, 'reply': command_reply})
 
+        rate_limiter.check(uid, client_ip())
         bot = get_bot()
         if not bot:
             return jsonify({'success': False, 'reply': '机器人服务暂不可用'})
 
-        conversation = session['conversations'][current_id]
-        history = conversation['history']
-        # 最多 4 轮
-        if len(history) > 8:
-            history = history[-8:]
-
-        reply = bot.ask(user_input, conversation_history=history)
-
-        user_msg = {'role': 'user', 'content': user_input, 'timestamp': get_current_time()}
-        ai_msg = {'role': 'assistant', 'content': reply, 'timestamp': get_current_time()}
-        history.extend([user_msg, ai_msg])
-        if len(history) > 8:
-            history = history[-8:]
-        conversation['history'] = history
-        conversation['last_message'] = user_input[:30] + ('...' if len(user_input) > 30 else '')
-        conversation['last_updated'] = datetime.now().isoformat()
-        if len(history) == 2:  # 第一条
-            conversation['name'] = user_input[:20] + ('...' if len(user_input) > 20 else '')
-        session['conversations'][current_id] = conversation
-        session.modified = True
-        return jsonify({'success': True, 'reply': reply, 'conversation_id': current_id})
+        lookup, version = answer_locally(bot, uid, current_id, user_input)
+        if lookup and lookup.answer:
+            observe_stage('turn_total', time.perf_counter() - started)
+            return jsonify({'success': True, 'reply': lookup.answer, 'conversation_id': current_id,
+                            'version': version})
+
+        # 任务模式：交给生成 Worker，立即返回任务 ID
+        if chat_jobs.enabled:
+            return jsonify(enqueue_chat_job(uid, current_id, user_input, data.get('no_cache', False))), 202
 
+        # 打包上下文时可能要调用千帆生成摘要，一并占用生成名额
+        with upstream_limiter.slot():
+            history, packed, summary = pack_context(bot, uid, current_id, user_input)
+
+            # 请求体带 no_cache: true 时跳过回复缓存
+            reply = bot.ask(user_input, conversation_history=packed, summary=summary,
+                            use_cache=not data.get('no_cache', False), lookup=lookup)
+
+        version = record_turn(uid, current_id, history, user_input, reply)
+        observe_stage('turn_total', time.perf_counter() - started)
+        return jsonify({'success': True, 'reply': reply, 'conversation_id': current_id, 'version': version})
+
+    except Overloaded as e:
+        return too_many_requests(e)
     except Exception as e:
-        traceback.print_exc()
+        logger.exception("[/chat] 处理请求失败")
         return jsonify({'success': False, 'reply': f'内部错误：{type(e).__name__}'})
 
-# ---------------- 其余路由原封不动 ----------------
+@app.route('/chat/stream', methods=['POST'])
+def chat_stream():
+    """流式对话：以 SSE 逐块转发千帆的生成结果，生成结束后才写入对话历史"""
+    started = time.perf_counter()
+    uid = ensure_user()
+    current_id = session.get('current_conversation_id')
+    if not current_id:
+        return sse_response('error', {'reply': '请先创建对话'})
+
+    data = request.json or {}
+    user_input = data.get('message', '').strip()
+    if not user_input:
+        return sse_response('error', {'reply': '请输入内容'})
+
+    command_reply = handle_command(user_input, uid, current_id)
+    if command_reply:
+        return sse_response('done', {'reply': command_reply, 'conversation_id': current_id})
+
+    try:
+        rate_limiter.check(uid, client_ip())
+        bot = get_bot()
+        if not bot:
+            return sse_response('error', {'reply': '机器人服务暂不可用'})
+        lookup, version = answer_locally(bot, uid, current_id, user_input)
+        if lookup and lookup.answer:
+            observe_stage('turn_total', time.perf_counter() - started)
+            return sse_response('done', {'reply': lookup.answer, 'conversation_id': current_id,
+                                         'version': version})
+        # 任务模式：交给生成 Worker；这里不等待结果，只发送 job 事件，客户端随后查询 /chat/jobs/<id>
+        if chat_jobs.enabled:
+            return sse_response('job', enqueue_chat_job(uid, current_id, user_input, data.get('no_cache', False)))
+        upstream_limiter.acquire()
+    except Overloaded as e:
+        return too_many_requests(e)
+    except Exception as e:
+        logger.exception("[/chat/stream] 处理请求失败")
+        return sse_response('error', {'reply': f'内部错误：{type(e).__name__}'})
+
+    try:
+        history, packed, summary = pack_context(bot, uid, current_id, user_input)
+    except Exception as e:
+        # 客户端只认 SSE 事件，出错时同样以 error 事件告知，不能落到 Flask 的 HTML 500 页面
+        upstream_limiter.release()
+        logger.exception("[/chat/stream] 打包上下文失败")
+        return sse_response('error', {'reply': f'内部错误：{type(e).__name__}'})
+
+    def generate():
+        for event in bot.ask_stream(user_input, conversation_history=packed, summary=summary,
+                                    use_cache=not data.get('no_cache', False), lookup=lookup):
+            if event['type'] == 'delta':
+                yield sse_event('delta', {'content': event['content']})
+            elif event['type'] == 'done':
+                version = record_turn(uid, current_id, history, user_input, event['reply'])
+                observe_stage('turn_total', time.perf_counter() - started)
+                yield sse_event('done', {'reply': event['reply'], 'conversation_id': current_id,
+                                         'version': version})
+            else:
+                yield sse_event('error', {'reply': event['reply']})
+
+    response = Response(generate(), mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+    # 响应发送完（或客户端断开）时归还生成名额
+    response.call_on_close(upstream_limiter.release)
+    return response
+
+# ---------------- 生成任务（任务模式） ----------------
+@app.route('/chat/jobs/<job_id>', methods=['GET'])
+@session_access(SESSION_READ)
+def chat_job(job_id):
+    """取回生成任务的结果：立即返回当前状态，未结束时 status 为 queued / running，客户端按退避间隔再次请求
+    （长轮询参数 wait 只在 asgi.py 中生效，这里忽略，不让等待占用 Web Worker 的线程）
+    """
+    job = find_job(job_id)
+    if job is None:
+        return jsonify({'success': False, 'reply': '任务不存在或已过期'}), 404
+    return jsonify(job_payload(job))
+
+@app.route('/chat/jobs/<job_id>/events', methods=['GET'])
+@session_access(SESSION_READ)
+def chat_job_events(job_id):
+    """以 SSE 返回生成任务的结果：结束时发送 done 或 error，未结束时发送一条 status 事件后关闭，
+    客户端稍后重新订阅（持续推送直到任务结束的版本见 asgi.py）
+    """
+    job = find_job(job_id)
+    if job is None:
+        return sse_response('error', {'reply': '任务不存在或已过期'})
+    return sse_response(job_event(job), job_payload(job))
+
+# ---------------- 对话管理路由 ----------------
 @app.route('/conversations', methods=['GET'])
+@session_access(SESSION_READ)
 def get_conversations():
+    """分页返回对话列表（星标在前，其余按最近更新倒序）
+    参数：limit 每页条数；cursor 上一页返回的 next_cursor；
+          since 上次响应中的 version，只返回此后变化的对话（delta 为 true）与已删除的对话 ID（removed），
+          无法增量同步时返回完整的第一页（delta 为 false）
+    响应带 ETag，用户的版本号没有变化时对 If-None-Match 返回 304
+    """
     try:
-        conversations = session.get('conversations', {})
+        uid = ensure_user()
         current_id = session.get('current_conversation_id', '')
-        lst = []
-        for cid, c in conversations.items():
-            lst.append({
-                'id': cid, 'name': c.get('name', '未命名'),
-                'last_message': c.get('last_message', ''), 'starred': c.get('starred', False),
-                'created_at': c.get('created_at'), 'last_updated': c.get('last_updated'),
-                'message_count': len(c.get('history', [])) // 2, 'is_current': cid == current_id
-            })
-        lst.sort(key=lambda x: (not x['starred'], x['last_updated']), reverse=True)
-        return jsonify({'success': True, 'conversations': lst, 'current_conversation_id': current_id})
+        limit = max(1, min(request.args.get('limit', CONVERSATION_PAGE_SIZE, type=int), MAX_CONVERSATION_PAGE_SIZE))
+        cursor = request.args.get('cursor')
+        since = request.args.get('since', type=int)
+        version, _ = conversation_store.version(uid)
+        etag = make_etag(version, current_id, limit, cursor, since)
+        cached = not_modified(etag)
+        if cached:
+            return cached
+
+        changes = conversation_store.changes_since(uid, since) if since is not None and not cursor else None
+        if changes is not None:
+            lst, removed = changes
+            for c in lst:
+                c['is_current'] = c['id'] == current_id
+            return with_etag(jsonify({'success': True, 'delta': True, 'version': version, 'conversations': lst,
+                                      'removed': removed, 'total': conversation_store.count(uid),
+                                      'current_conversation_id': current_id}), etag)
+
+        lst, next_cursor = conversation_store.list_page(uid, limit, cursor)
+        for c in lst:
+            c['is_current'] = c['id'] == current_id
+        result = {'success': True, 'delta': False, 'version': version, 'conversations': lst,
+                  'next_cursor': next_cursor, 'current_conversation_id': current_id}
+        if not cursor:
+            result['total'] = conversation_store.count(uid)
+        return with_etag(jsonify(result), etag)
     except Exception as e:
         return jsonify({'success': False, 'message': str(e)})
 
@@ -148,14 +449,8 @@ def get_conversations():
 def new_conversation():
     data = request.json or {}
     name = data.get('name', '新对话')
-    new_id = str(uuid.uuid4())
-    session['conversations'][new_id] = {
-        'name': name, 'history': [], 'starred': False,
-        'created_at': datetime.now().isoformat(), 'last_updated': datetime.now().isoformat(),
-        'last_message': '新对话开始'
-    }
+    new_id = conversation_store.create(ensure_user(), name=name)
     session['current_conversation_id'] = new_id
-    session.modified = True
     return jsonify({'success': True, 'conversation_id': new_id, 'message': '新对话创建成功'})
 
 @app.route('/conversations/switch', methods=['POST'])
@@ -164,39 +459,74 @@ def switch_conversation():
     cid = data.get('conversation_id')
     if not cid:
         return jsonify({'success': False, 'message': '缺少对话ID'})
-    if cid not in session['conversations']:
-        session['conversations'][cid] = {
-            'name': '新对话', 'history': [], 'starred': False,
-            'created_at': datetime.now().isoformat(), 'last_updated': datetime.now().isoformat(),
-            'last_message': '新对话开始'
-        }
+    uid = ensure_user()
+    meta = conversation_store.get_meta(uid, cid)
+    if meta is None:
+        conversation_store.create(uid, cid=cid)
+        meta = conversation_store.get_meta(uid, cid) or {'name': '新对话', 'version': 0}
     session['current_conversation_id'] = cid
-    session.modified = True
-    c = session['conversations'][cid]
-    return jsonify({'success': True, 'conversation_id': cid, 'history': c.get('history', []),
-                    'conversation_name': c.get('name', '未命名')})
+    result = {'success': True, 'conversation_id': cid, 'version': meta['version'],
+              'conversation_name': meta.get('name', '未命名')}
+
+    # 前端缓存了这个对话（since 为缓存时对话的 version）：只返回此后新增的消息
+    since = data.get('since')
+    # JSON 里的 true/false 解析出来也是 int 的子类，要单独排除
+    if isinstance(since, int) and not isinstance(since, bool):
+        delta = conversation_store.messages_since(uid, cid, since)
+        if delta is not None:
+            return jsonify({**result, 'delta': True, 'history': delta})
+
+    # 只返回最后一页，更早的消息由前端滚动到顶部时通过 /conversations/<id>/messages 加载
+    history, history_cursor = conversation_store.history_page(uid, cid, limit=MESSAGE_PAGE_SIZE)
+    return jsonify({**result, 'delta': False, 'history': history, 'history_cursor': history_cursor})
+
+@app.route('/conversations/<cid>/messages', methods=['GET'])
+@session_access(SESSION_READ)
+def conversation_messages(cid):
+    """分页返回对话消息（按时间正序）
+    参数：limit 每页条数；before 上一页返回的 next_cursor，取更早的消息；
+          since 对话的 version，只返回此后新增的消息（delta 为 true），无法增量时返回最后一页
+    响应带 ETag，对话的版本号没有变化时对 If-None-Match 返回 304
+    """
+    uid = ensure_user()
+    try:
+        before = request.args.get('before', type=int)
+        limit = max(1, min(request.args.get('limit', MESSAGE_PAGE_SIZE, type=int), MAX_MESSAGE_PAGE_SIZE))
+        since = request.args.get('since', type=int)
+        version = conversation_store.conversation_version(uid, cid)
+        etag = make_etag(version, cid, before, limit, since)
+        cached = not_modified(etag)
+        if cached:
+            return cached
+
+        result = {'success': True, 'conversation_id': cid, 'version': version}
+        if since is not None and before is None:
+            delta = conversation_store.messages_since(uid, cid, since)
+            if delta is not None:
+                return with_etag(jsonify({**result, 'delta': True, 'messages': delta, 'next_cursor': None}), etag)
+
+        messages, next_cursor = conversation_store.history_page(uid, cid, before, limit)
+        if not messages and before is None and not conversation_store.exists(uid, cid):
+            return jsonify({'success': False, 'message': '对话不存在'})
+        return with_etag(jsonify({**result, 'delta': False, 'messages': messages, 'next_cursor': next_cursor}),
+                         etag)
+    except Exception as e:
+        return jsonify({'success': False, 'message': str(e)})
 
 @app.route('/conversations/delete', methods=['POST'])
 def delete_conversation():
     data = request.json or {}
     cid = data.get('conversation_id')
-    conversations = session.get('conversations', {})
-    if cid not in conversations:
+    uid = ensure_user()
+    if not conversation_store.exists(uid, cid):
         return jsonify({'success': False, 'message': '对话不存在'})
     if session.get('current_conversation_id') == cid:
-        others = [k for k in conversations.keys() if k != cid]
+        others = [k for k in conversation_store.ids(uid, limit=2) if k != cid]
         if others:
             session['current_conversation_id'] = others[0]
         else:
-            new_id = str(uuid.uuid4())
-            session['current_conversation_id'] = new_id
-            session['conversations'][new_id] = {
-                'name': '新对话', 'history': [], 'starred': False,
-                'created_at': datetime.now().isoformat(), 'last_updated': datetime.now().isoformat(),
-                'last_message': '新对话开始'
-            }
-    conversations.pop(cid, None)
-    session.modified = True
+            session['current_conversation_id'] = conversation_store.create(uid)
+    conversation_store.delete(uid, cid)
     return jsonify({'success': True, 'message': '对话已删除',
                     'current_conversation_id': session.get('current_conversation_id', '')})
 
@@ -204,44 +534,214 @@ def delete_conversation():
 def star_conversation():
     data = request.json or {}
     cid = data.get('conversation_id')
-    conversations = session.get('conversations', {})
-    if cid not in conversations:
+    starred = conversation_store.toggle_star(ensure_user(), cid) if cid else None
+    if starred is None:
         return jsonify({'success': False, 'message': '对话不存在'})
-    conv = conversations[cid]
-    starred = not conv.get('starred', False)
-    conv['starred'] = starred
-    conv['last_updated'] = datetime.now().isoformat()
-    session.modified = True
     return jsonify({'success': True, 'starred': starred,
                     'message': '已标记' if starred else '已取消标记'})
 
 @app.route('/clear', methods=['POST'])
 def clear_current_history():
+    uid = ensure_user()
     cid = session.get('current_conversation_id')
-    if cid and cid in session.get('conversations', {}):
-        session['conversations'][cid]['history'] = []
-        session['conversations'][cid]['last_message'] = '对话已清空'
-        session['conversations'][cid]['last_updated'] = datetime.now().isoformat()
-        session.modified = True
+    if conversation_store.exists(uid, cid):
+        conversation_store.clear_history(uid, cid)
         return jsonify({'success': True, 'message': '历史记录已清空'})
     return jsonify({'success': False, 'message': '没有可清空的对话'})
 
 @app.route('/status', methods=['GET'])
+@session_access(SESSION_READ)
 def get_status():
-    bot = get_bot()
-    conversations = session.get('conversations', {})
-    return jsonify({'success': True, 'status': 'active' if bot else 'inactive',
-                    'conversation_count': len(conversations),
-                    'current_conversation_id': session.get('current_conversation_id', '')})
+    # 只读取后台探测的结果，不发起任何网络请求；新访客不在这里创建用户
+    get_bot()
+    uid = session.get('user_id')
+    upstream = health_monitor.status('qianfan')
+    status = 'active' if upstream else ('starting' if upstream is None and API_KEY else 'inactive')
+    return jsonify({'success': True, 'status': status,
+                    'health': health_monitor.snapshot(),
+                    'conversation_count': conversation_store.count(uid) if uid else 0,
+                    'current_conversation_id': session.get('current_conversation_id', ''),
+                    'cache': response_cache.stats(),
+                    'session_cache': session_cache.stats(),
+                    'session_access': app.session_interface.stats(),
+                    'single_flight': single_flight.stats(),
+                    'admission': upstream_limiter.stats(),
+                    'router': model_router.stats(),
+                    'knowledge': knowledge_index.stats() if knowledge_index else {'enabled': False},
+                    'static_assets': static_assets.stats() if static_assets else {'enabled': False},
+                    'chat_jobs': chat_jobs.stats() if chat_jobs.enabled else {'enabled': False}})
+
+@app.route('/healthz')
+@session_access(SESSION_NONE)
+def healthz():
+    """存活探针：进程能处理请求即可"""
+    return jsonify({'status': 'ok'})
 
-@app.route('/static/<path:filename>')
+@app.route('/readyz')
+@session_access(SESSION_NONE)
+def readyz():
+    """就绪探针：Redis 与千帆最近一次探测都成功时返回 200，否则 503"""
+    get_bot()
+    health = health_monitor.snapshot()
+    ready = bool(API_KEY) and health['ready'] and 'qianfan' in health['checks']
+    return jsonify({'ready': ready, **health}), 200 if ready else 503
+
+@app.route('/metrics')
+@session_access(SESSION_NONE)
+def metrics():
+    """Prometheus 抓取端点：各阶段耗时直方图与计数器（按进程统计）"""
+    return Response(REGISTRY.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+@app.route('/static/<path:filename>', endpoint='static')
+@session_access(SESSION_NONE)
 def serve_static(filename):
-    return send_from_directory(app.static_folder, filename)
+    """带指纹的地址按 Accept-Encoding 发送预压缩版本并长期缓存，支持 Range（见 static_assets.py）"""
+    if static_assets is None:
+        return send_from_directory(app.static_folder, filename)
+    return static_assets.send(filename, request)
 
 # 辅助函数
 def get_current_time():
     return datetime.now().strftime('%H:%M')
 
+def handle_command(user_input, uid, cid):
+    """处理“清空”“帮助”等特殊指令，返回回复文本；普通问题返回 None"""
+    if user_input.lower() in ['清空', '清除', 'clear', 'reset']:
+        if conversation_store.exists(uid, cid):
+            conversation_store.clear_history(uid, cid)
+        return '当前对话历史已清空！'
+    if user_input.lower() in ['帮助', 'help', '?']:
+        return get_help_message()
+    return None
+
+def pack_context(bot, uid, cid, user_input):
+    """读取对话上下文并按 token 预算打包，摘要有更新时写回存储
+    :return: (存储中的完整历史, 要发送的历史, 摘要)
+    """
+    with stage('history_prep'):
+        ctx = conversation_store.get_context(uid, cid)
+        packed, summary, summary_upto = bot.prepare_context(user_input, ctx['history'], ctx['offset'],
+                                                            ctx['summary'], ctx['summary_upto'])
+        if summary_upto != ctx['summary_upto']:
+            conversation_store.set_summary(uid, cid, summary, summary_upto)
+    return ctx['history'], packed, summary
+
+def answer_locally(bot, uid, cid, user_input):
+    """查询本地知识库；能直接作答时记录这一轮（不占用生成名额，也不打包上下文）
+    :return: (知识库的查询结果, 直接作答时这一轮的版本号)；没有知识库时查询结果为 None，
+             没有直接作答时把查询结果传给 bot.ask / ask_stream，避免重复查询
+    """
+    lookup = bot.lookup_knowledge(user_input)
+    if lookup and lookup.answer:
+        return lookup, record_turn(uid, cid, conversation_store.get_history(uid, cid), user_input, lookup.answer)
+    return lookup, None
+
+def enqueue_chat_job(uid, cid, user_input, no_cache=False):
+    """任务模式下的 /chat：放入生成任务，返回 202 响应的内容；队列积压过多时抛出 Overloaded"""
+    job_id = chat_jobs.enqueue(uid, cid, user_input, no_cache=no_cache)
+    return {'success': True, 'job_id': job_id, 'status': STATUS_QUEUED, 'conversation_id': cid,
+            'poll_url': f'/chat/jobs/{job_id}', 'events_url': f'/chat/jobs/{job_id}/events'}
+
+def find_job(job_id):
+    """当前用户的生成任务；不存在、已过期或属于其他用户时返回 None"""
+    uid = session.get('user_id')
+    job = chat_jobs.get(job_id) if uid else None
+    if job is None or job['uid'] != uid:
+        return None
+    return job
+
+def job_event(job):
+    """任务状态对应的 SSE 事件名"""
+    if job['status'] not in FINAL_STATUSES:
+        return 'status'
+    return 'done' if job['status'] == STATUS_DONE else 'error'
+
+def job_payload(job):
+    """生成任务的对外状态：done 时带回复与对话版本号，failed 时带兜底提示语"""
+    payload = {'success': job['status'] != STATUS_FAILED, 'job_id': job['id'], 'status': job['status'],
+               'conversation_id': job['cid']}
+    if job['status'] == STATUS_DONE:
+        payload.update(reply=job['reply'], version=job['version'])
+    elif job['status'] == STATUS_FAILED:
+        payload.update(reply=job.get('reply') or '抱歉，这次没能生成回复，请稍后重试。', error=job.get('error'))
+    return payload
+
+def run_chat_job(job):
+    """生成 Worker 处理一个任务：与同步的 /chat 相同地打包上下文、调用千帆并写入对话
+    :return: 保存到任务中的结果；千帆暂不可用或返回兜底提示语时抛出 JobFailed，由队列决定重试或进入死信
+    """
+    bot = get_bot()
+    if not bot:
+        raise JobFailed('unavailable', '机器人服务暂不可用')
+    uid, cid, user_input = job['uid'], job['cid'], job['message']
+    with upstream_limiter.slot():
+        history, packed, summary = pack_context(bot, uid, cid, user_input)
+        reply = bot.ask(user_input, conversation_history=packed, summary=summary, use_cache=not job['no_cache'])
+    reason = getattr(reply, 'reason', None)
+    if reason is not None:
+        raise JobFailed(reason, str(reply), retryable=reason in RETRYABLE_FALLBACKS)
+    return {'reply': reply, 'version': record_turn(uid, cid, history, user_input, reply)}
+
+def make_etag(version, *parts):
+    """ETag：用户或对话的版本号，加上影响响应内容的参数"""
+    return f"{version}-{zlib.crc32('|'.join(map(str, parts)).encode('utf-8')):08x}"
+
+def not_modified(etag):
+    """请求的 If-None-Match 与 ETag 相同时返回 304 响应，否则返回 None"""
+    if request.if_none_match.contains(etag):
+        return with_etag(Response(status=304), etag)
+    return None
+
+def with_etag(response, etag):
+    response.set_etag(etag)
+    # 浏览器可以缓存，但每次使用前都要带 If-None-Match 向服务端确认
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+def record_turn(uid, cid, history, user_input, reply):
+    """把一问一答追加到对话历史，并更新对话的元信息，返回新的版本号
+    :param history: 本轮提问前的历史，用于判断是否是对话的第一条消息
+    """
+    user_msg = {'role': 'user', 'content': user_input, 'timestamp': get_current_time()}
+    ai_msg = {'role': 'assistant', 'content': reply, 'timestamp': get_current_time()}
+    meta = {
+        'last_message': user_input[:30] + ('...' if len(user_input) > 30 else ''),
+        'last_updated': datetime.now().isoformat()
+    }
+    if not history:  # 第一条
+        meta['name'] = user_input[:20] + ('...' if len(user_input) > 20 else '')
+    with stage('history_save'):
+        return conversation_store.append_turn(uid, cid, user_msg, ai_msg, meta)
+
+def client_ip():
+    """限流使用的客户端地址"""
+    if TRUST_FORWARDED_FOR and request.access_route:
+        return request.access_route[0]
+    return request.remote_addr
+
+def overload_reply(error):
+    """被准入控制拒绝时的提示语与建议等待的秒数"""
+    retry_after = max(1, math.ceil(error.retry_after))
+    if error.reason.endswith('_rate'):
+        reply = f'发送太频繁啦，请 {retry_after} 秒后再试'
+    else:
+        reply = f'当前咨询的人太多了，请 {retry_after} 秒后再试'
+    return {'success': False, 'reply': reply, 'retry_after': retry_after}, retry_after
+
+def too_many_requests(error):
+    """429 响应，带 Retry-After"""
+    payload, retry_after = overload_reply(error)
+    return jsonify(payload), 429, {'Retry-After': str(retry_after)}
+
+def sse_event(event, data):
+    """编码一条 Server-Sent Events 消息"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+def sse_response(event, data):
+    """只包含一条事件的 SSE 响应（指令回复、参数错误等）"""
+    return Response(sse_event(event, data), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache'})
+
 def get_help_message():
     return """🤖 食探机器人命令：
 输入“帮助”显示此信息；
@@ -251,17 +751,11 @@ def get_help_message():
 # ---------- 可选：一键清 Session 路由 ----------
 @app.route('/clear_all')
 def clear_all_session():
+    if 'user_id' in session:
+        conversation_store.delete_all(session['user_id'])
     session.clear()
-    # 重建默认对话
-    default_id = str(uuid.uuid4())
-    session['conversations'] = {}
-    session['current_conversation_id'] = default_id
-    session['conversations'][default_id] = {
-        'name': '新对话', 'history': [], 'starred': False,
-        'created_at': datetime.now().isoformat(), 'last_updated': datetime.now().isoformat(),
-        'last_message': '您好！欢迎使用食探AI'
-    }
-    session.modified = True
+    # 重建用户和默认对话
+    ensure_user()
     return """
     <html><head><title>Session 已清理</title></head><body>
     <h1>✅ Session 已成功清理！</h1>
@@ -274,10 +768,26 @@ def clear_all_session():
 if __name__ == '__main__':
     for d in ['static', 'static/css', 'static/js', 'static/videos', 'templates', 'uploads']:
         os.makedirs(d, exist_ok=True)
-    if API_KEY and API_KEY.startswith('bce-'):
-        get_bot()
-        print("✓ 服务器准备就绪")
-    else:
+    if not (API_KEY and API_KEY.startswith('bce-')):
         print("⚠️  未配置有效 API Key，部分功能受限")
-    print("🌐 服务器启动中... \n👉 请访问：http://localhost:5000")
-    app.run(host='0.0.0.0', port=5000, debug=True)
\ No newline at end of file
+    host, port = os.getenv('HOST', '0.0.0.0'), int(os.getenv('PORT', 5000))
+    print(f"🌐 服务器启动中... \n👉 请访问：http://localhost:{port}")
+
+    debug = os.getenv('FLASK_DEBUG', '').lower() in ('1', 'true', 'yes')
+    if debug or os.getenv('WEB_SERVER', 'gunicorn').lower() == 'flask':
+        # 原来的 Flask 开发服务器：单进程；调试模式下改代码后自动重载，
+        # 重载器的父进程只负责监视文件，机器人只在子进程中初始化
+        if not debug or os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+            init_worker()
+        app.run(host=host, port=port, debug=debug, threaded=True)
+    elif importlib.util.find_spec('gunicorn') is None:
+        # Windows 上没有 gunicorn
+        print("⚠️  未安装 gunicorn，以单进程模式运行（pip install gunicorn）")
+        init_worker()
+        app.run(host=host, port=port, threaded=True)
+    else:
+        # 换成 gunicorn 进程（配置见 gunicorn.conf.py），Worker 中重新导入本模块
+        here = os.path.dirname(os.path.abspath(__file__))
+        os.chdir(here)
+        os.execv(sys.executable, [sys.executable, '-m', 'gunicorn', '-c', os.path.join(here, 'gunicorn.conf.py'),
+                                  'app:app'])
\ No newline at end of file
@@ -0,0 +1,363 @@
+"""
+ASGI 版入口（asyncio 原生，等待千帆回复时不占用线程/Worker）
+运行：uvicorn asgi:application --host 0.0.0.0 --port 5000
+访问：http://localhost:5000
+
+/chat 与 /chat/stream 由 AsyncFoodBot 异步处理，一个进程即可同时挂起成千上万个等待中的对话；
+任务模式下 /chat/stream 入队后直接转发任务的结果，/chat/jobs/<id> 的长轮询与 /chat/jobs/<id>/events 的推送
+也在这里以异步方式等待（Flask 版的这两个路由立即返回）；
+/conversations*、/status、页面和静态资源这些只读写 Redis 的轻量路由直接复用 app.py 里的
+Flask 应用（经 WSGI 适配层在线程池中执行）。两种模式共用同一份 Redis Session 和对话存储，可以混合部署。
+"""
+import logging
+import time
+from contextlib import asynccontextmanager
+
+import redis.asyncio as aioredis
+from a2wsgi import WSGIMiddleware
+from itsdangerous import Signer, BadSignature, want_bytes
+from starlette.applications import Starlette
+from starlette.concurrency import run_in_threadpool
+from starlette.responses import JSONResponse, StreamingResponse
+from starlette.routing import Route, Mount
+
+from app import (app as flask_app, get_bot as flask_get_bot, API_KEY, REDIS_URL, TRUST_FORWARDED_FOR,
+                 conversation_store, rate_limiter, model_router, knowledge_index, response_cache, handle_command,
+                 record_turn, answer_locally, sse_event, overload_reply, chat_jobs, enqueue_chat_job,
+                 job_event, job_payload, CHAT_JOB_MAX_WAIT, CHAT_JOB_STREAM_TIMEOUT)
+from admission import AsyncConcurrencyLimiter, Overloaded
+from chat_jobs import AsyncJobWatcher, FINAL_STATUSES
+from food_bot import AsyncFoodBot
+from single_flight import AsyncSingleFlight
+from telemetry import REGISTRY, stage, observe_stage
+
+logger = logging.getLogger(__name__)
+
+
+class RedisSessionBridge:
+    """按 Flask-Session（RedisSessionInterface）的格式异步读取 Session，保证与 Flask 路由互通
+
+    Session 中只有 user_id 和 current_conversation_id，对话路由不会修改它，因此这里只读不写。
+    """
+
+    def __init__(self, app, redis_client):
+        self.redis = redis_client
+        self.cookie_name = app.config['SESSION_COOKIE_NAME']
+        self.key_prefix = app.config['SESSION_KEY_PREFIX']
+        # 与 Flask-Session 使用同一个序列化器，避免两边格式不一致
+        self.serializer = app.session_interface.serializer
+        self.signer = None
+        if app.config['SESSION_USE_SIGNER']:
+            self.signer = Signer(app.secret_key, salt='flask-session', key_derivation='hmac')
+
+    def session_id(self, request):
+        """从 Cookie 中取出（并校验）Session ID，无效时返回 None"""
+        sid = request.cookies.get(self.cookie_name)
+        if not sid or self.signer is None:
+            return sid
+        try:
+            return self.signer.unsign(want_bytes(sid)).decode()
+        except BadSignature:
+            return None
+
+    async def load(self, sid):
+        val = await self.redis.get(self.key_prefix + sid)
+        if val is None:
+            return {}
+        try:
+            return self.serializer.loads(val)
+        except Exception:
+            return {}
+
+
+redis_client = aioredis.from_url(REDIS_URL)
+sessions = RedisSessionBridge(flask_app, redis_client)
+job_watcher = AsyncJobWatcher(chat_jobs, redis_client)
+
+# 异步机器人单例
+bot_instance = None
+single_flight = AsyncSingleFlight.from_env()
+# 与 Flask 版相同的准入控制；生成名额按事件循环计数，限流令牌桶与 Flask 版共用
+upstream_limiter = AsyncConcurrencyLimiter.from_env()
+REGISTRY.add_collector(
+    'foodbot_async_single_flight_total', 'counter', '异步入口请求合并的 leader、被合并请求与超时次数',
+    lambda: [({'event': k}, v) for k, v in single_flight.stats().items() if k not in ('in_flight', 'enabled')])
+
+async def get_bot():
+    """与 app.get_bot 相同：构造时不测试连接，千帆是否可用沿用 app 中 health_monitor 的后台探测结果"""
+    global bot_instance
+    if not API_KEY:
+        return None
+    if bot_instance is None:
+        # 构造过程没有 await，事件循环内不会被并发重复创建
+        bot_instance = AsyncFoodBot(API_KEY, flight=single_flight, router=model_router, knowledge=knowledge_index,
+                                    cache=response_cache)
+        logger.info("✓ 异步机器人初始化成功，后台探测千帆连接")
+    if flask_get_bot() is None:
+        return None
+    return bot_instance
+
+
+async def read_message(request):
+    """返回 (用户输入, 是否跳过回复缓存)，与 Flask 版一样读取请求体中的 message 与 no_cache"""
+    try:
+        data = await request.json()
+    except ValueError:
+        data = {}
+    data = data or {}
+    return data.get('message', '').strip(), bool(data.get('no_cache', False))
+
+
+async def load_conversation(request):
+    """返回 (user_id, current_conversation_id)，Session 无效时均为 None"""
+    with stage('session_load'):
+        sid = sessions.session_id(request)
+        data = await sessions.load(sid) if sid else {}
+    return data.get('user_id'), data.get('current_conversation_id')
+
+
+def client_ip(request):
+    """限流使用的客户端地址（与 app.client_ip 相同）"""
+    forwarded = request.headers.get('x-forwarded-for')
+    if TRUST_FORWARDED_FOR and forwarded:
+        return forwarded.split(',')[0].strip()
+    return request.client.host if request.client else None
+
+
+def too_many_requests(error):
+    payload, retry_after = overload_reply(error)
+    return JSONResponse(payload, status_code=429, headers={'Retry-After': str(retry_after)})
+
+
+async def pack_context(bot, uid, current_id, user_input):
+    """与 app.pack_context 相同：返回 (存储中的完整历史, 要发送的历史, 摘要)"""
+    with stage('history_prep'):
+        ctx = await run_in_threadpool(conversation_store.get_context, uid, current_id)
+        packed, summary, summary_upto = await bot.prepare_context(user_input, ctx['history'], ctx['offset'],
+                                                                  ctx['summary'], ctx['summary_upto'])
+        if summary_upto != ctx['summary_upto']:
+            await run_in_threadpool(conversation_store.set_summary, uid, current_id, summary, summary_upto)
+    return ctx['history'], packed, summary
+
+
+async def chat(request):
+    started = time.perf_counter()
+    try:
+        uid, current_id = await load_conversation(request)
+        if not uid or not current_id:
+            return JSONResponse({'success': False, 'reply': '请先创建对话'})
+
+        user_input, no_cache = await read_message(request)
+        if not user_input:
+            return JSONResponse({'success': False, 'reply': '请输入内容'})
+
+        # 特殊指令
+        command_reply = await run_in_threadpool(handle_command, user_input, uid, current_id)
+        if command_reply:
+            return JSONResponse({'success': True, 'reply': command_reply})
+
+        await run_in_threadpool(rate_limiter.check, uid, client_ip(request))
+        bot = await get_bot()
+        if not bot:
+            return JSONResponse({'success': False, 'reply': '机器人服务暂不可用'})
+
+        lookup, version = await run_in_threadpool(answer_locally, bot, uid, current_id, user_input)
+        if lookup and lookup.answer:
+            observe_stage('turn_total', time.perf_counter() - started)
+            return JSONResponse({'success': True, 'reply': lookup.answer, 'conversation_id': current_id,
+                                 'version': version})
+
+        # 任务模式：交给生成 Worker，立即返回任务 ID；结果由 /chat/jobs/<id> 取回
+        if chat_jobs.enabled:
+            payload = await run_in_threadpool(enqueue_chat_job, uid, current_id, user_input, no_cache)
+            return JSONResponse(payload, status_code=202)
+
+        async with upstream_limiter.slot():
+            history, packed, summary = await pack_context(bot, uid, current_id, user_input)
+            reply = await bot.ask(user_input, conversation_history=packed, use_cache=not no_cache,
+                                  summary=summary, lookup=lookup)
+
+        version = await run_in_threadpool(record_turn, uid, current_id, history, user_input, reply)
+        observe_stage('turn_total', time.perf_counter() - started)
+        return JSONResponse({'success': True, 'reply': reply, 'conversation_id': current_id, 'version': version})
+
+    except Overloaded as e:
+        return too_many_requests(e)
+    except Exception as e:
+        logger.exception("[/chat] 处理请求失败")
+        return JSONResponse({'success': False, 'reply': f'内部错误：{type(e).__name__}'})
+
+
+class SlotStreamingResponse(StreamingResponse):
+    """占用生成名额的流式响应：响应结束时归还名额
+
+    不能放在生成器的 finally 中归还：客户端在响应体开始发送前断开时生成器根本不会运行，名额就永远不会归还。
+    """
+
+    def __init__(self, content, release, **kwargs):
+        super().__init__(content, **kwargs)
+        self.release = release
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            self.release()
+
+
+def sse_response(event, payload):
+    """只包含一条事件的 SSE 响应（指令回复、参数错误等）"""
+    return StreamingResponse(iter([sse_event(event, payload)]), media_type='text/event-stream',
+                             headers={'Cache-Control': 'no-cache'})
+
+
+async def chat_stream(request):
+    """流式对话：与 Flask 版 /chat/stream 的事件格式一致"""
+    started = time.perf_counter()
+    uid, current_id = await load_conversation(request)
+    if not uid or not current_id:
+        return sse_response('error', {'reply': '请先创建对话'})
+
+    user_input, no_cache = await read_message(request)
+    if not user_input:
+        return sse_response('error', {'reply': '请输入内容'})
+
+    command_reply = await run_in_threadpool(handle_command, user_input, uid, current_id)
+    if command_reply:
+        return sse_response('done', {'reply': command_reply, 'conversation_id': current_id})
+
+    try:
+        await run_in_threadpool(rate_limiter.check, uid, client_ip(request))
+        bot = await get_bot()
+        if not bot:
+            return sse_response('error', {'reply': '机器人服务暂不可用'})
+        lookup, version = await run_in_threadpool(answer_locally, bot, uid, current_id, user_input)
+        if lookup and lookup.answer:
+            observe_stage('turn_total', time.perf_counter() - started)
+            return sse_response('done', {'reply': lookup.answer, 'conversation_id': current_id,
+                                         'version': version})
+        if chat_jobs.enabled:
+            payload = await run_in_threadpool(enqueue_chat_job, uid, current_id, user_input, no_cache)
+            return StreamingResponse(relay_job(payload), media_type='text/event-stream',
+                                     headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+        await upstream_limiter.acquire()
+    except Overloaded as e:
+        return too_many_requests(e)
+    except Exception as e:
+        logger.exception("[/chat/stream] 处理请求失败")
+        return sse_response('error', {'reply': f'内部错误：{type(e).__name__}'})
+
+    try:
+        history, packed, summary = await pack_context(bot, uid, current_id, user_input)
+    except BaseException as e:
+        upstream_limiter.release()
+        if not isinstance(e, Exception):
+            raise
+        # 与 Flask 版相同：客户端只认 SSE 事件，出错时以 error 事件告知
+        logger.exception("[/chat/stream] 打包上下文失败")
+        return sse_response('error', {'reply': f'内部错误：{type(e).__name__}'})
+
+    async def generate():
+        async for event in bot.ask_stream(user_input, conversation_history=packed, use_cache=not no_cache,
+                                          summary=summary, lookup=lookup):
+            if event['type'] == 'delta':
+                yield sse_event('delta', {'content': event['content']})
+            elif event['type'] == 'done':
+                version = await run_in_threadpool(record_turn, uid, current_id, history, user_input,
+                                                  event['reply'])
+                observe_stage('turn_total', time.perf_counter() - started)
+                yield sse_event('done', {'reply': event['reply'], 'conversation_id': current_id,
+                                         'version': version})
+            else:
+                yield sse_event('error', {'reply': event['reply']})
+
+    return SlotStreamingResponse(generate(), upstream_limiter.release, media_type='text/event-stream',
+                                 headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
+# ---------------- 生成任务（任务模式） ----------------
+async def relay_job(payload):
+    """任务模式下的 /chat/stream：先发送 job 事件（与 Flask 版相同），再等待并转发任务的结果"""
+    yield sse_event('job', payload)
+    job_id = payload['job_id']
+    async for chunk in job_events(job_id, await job_watcher.get(job_id)):
+        yield chunk
+
+
+async def job_events(job_id, current):
+    """未结束时定期发送 status 事件（兼作心跳），结束时发送 done 或 error；
+    超过 CHAT_JOBS_STREAM_TIMEOUT 仍未结束时发送 timeout 事件并关闭，客户端改为查询 /chat/jobs/<id>
+    """
+    deadline = time.monotonic() + CHAT_JOB_STREAM_TIMEOUT
+    while True:
+        if current is None:
+            yield sse_event('error', {'reply': '任务不存在或已过期'})
+            return
+        event = job_event(current)
+        if event != 'status':
+            yield sse_event(event, job_payload(current))
+            return
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            yield sse_event('timeout', job_payload(current))
+            return
+        yield sse_event('status', job_payload(current))
+        current = await job_watcher.wait(job_id, min(remaining, 15))
+
+
+async def find_job(request):
+    """与 app.find_job 相同：当前用户的生成任务，不存在、已过期或属于其他用户时返回 None"""
+    uid, _ = await load_conversation(request)
+    job = await job_watcher.get(request.path_params['job_id']) if uid else None
+    if job is None or job['uid'] != uid:
+        return None
+    return job
+
+
+async def chat_job(request):
+    """取回生成任务的结果（长轮询）
+    参数：wait 任务未结束时最多等待的秒数（默认 0 立即返回，最大 CHAT_JOBS_MAX_WAIT）；
+          仍未结束时 status 为 queued / running，客户端再次请求即可
+    """
+    job = await find_job(request)
+    if job is None:
+        return JSONResponse({'success': False, 'reply': '任务不存在或已过期'}, status_code=404)
+    try:
+        wait = max(0.0, min(float(request.query_params.get('wait', 0)), CHAT_JOB_MAX_WAIT))
+    except ValueError:
+        wait = 0.0
+    if wait and job['status'] not in FINAL_STATUSES:
+        job = await job_watcher.wait(job['id'], wait) or job
+    return JSONResponse(job_payload(job))
+
+
+async def chat_job_events(request):
+    """以 SSE 推送生成任务的结果，事件见 job_events"""
+    job = await find_job(request)
+    if job is None:
+        return sse_response('error', {'reply': '任务不存在或已过期'})
+    return StreamingResponse(job_events(job['id'], job), media_type='text/event-stream',
+                             headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
+@asynccontextmanager
+async def lifespan(app):
+    if API_KEY and API_KEY.startswith('bce-'):
+        await get_bot()
+    yield
+    if bot_instance is not None:
+        await bot_instance.aclose()
+    await redis_client.aclose()
+
+
+application = Starlette(
+    routes=[
+        Route('/chat', chat, methods=['POST']),
+        Route('/chat/stream', chat_stream, methods=['POST']),
+        Route('/chat/jobs/{job_id}', chat_job, methods=['GET']),
+        Route('/chat/jobs/{job_id}/events', chat_job_events, methods=['GET']),
+        # 其余路由（/conversations*、/status、/、/static 等）交给 Flask 应用
+        Mount('/', app=WSGIMiddleware(flask_app)),
+    ],
+    lifespan=lifespan
+)
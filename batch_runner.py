@@ -0,0 +1,162 @@
+"""
+批量问答 - 并发地把 JSONL 中的问题交给机器人，逐条写出 JSONL 结果（food_bot.py batch 子命令）
+
+输入每行一个 JSON 对象：
+    {"id": "q001", "question": "成都火锅推荐", "history": [...]}
+- id 可省略，默认用行号；question 也可以写成 message
+- history 可选，格式与 SimpleFoodBot.ask 的 conversation_history 相同
+
+输出每行一个结果，处理完一条写一条：
+    {"id": "q001", "question": "...", "reply": "...", "ok": true, "fallback": null,
+     "latency_ms": 1234.5, "finished_at": "2024-..."}
+- 走的是与线上相同的 SimpleFoodBot.ask（含格式化与回复缓存），结果与线上一致
+- fallback 为兜底提示语的原因（timeout / connection 等），此时 ok 为 false
+
+中断后用同样的参数重新运行即可续跑：输出文件中已经成功的 id 会被跳过，失败的重新处理。
+输入按行流式读取，同时在途的问题不超过 workers 的两倍，几万行的文件也不会一次读进内存。
+"""
+import json
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+
+class _Pacer:
+    """把请求均匀地分散开，整体不超过 rate 个/秒（rate 为 0 时不限速）"""
+
+    def __init__(self, rate: float):
+        self.interval = 1.0 / rate if rate > 0 else 0.0
+        self._next = 0.0
+        self._lock = threading.Lock()
+
+    def wait(self):
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next)
+            self._next = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+def read_items(path: str):
+    """逐行读取输入文件，产出 (id, 问题, 历史)；空行和无法解析的行跳过"""
+    with open(path, encoding='utf-8') as f:
+        for lineno, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                item = json.loads(line)
+            except json.JSONDecodeError:
+                print(f"⚠️  第 {lineno} 行不是合法的 JSON，已跳过", file=sys.stderr)
+                continue
+            question = (item.get('question') or item.get('message') or '').strip()
+            if not question:
+                print(f"⚠️  第 {lineno} 行没有问题内容，已跳过", file=sys.stderr)
+                continue
+            yield str(item.get('id', lineno)), question, item.get('history')
+
+
+def completed_ids(path: str) -> set:
+    """输出文件中已经成功处理的 id（文件不存在时为空）"""
+    done = set()
+    try:
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                try:
+                    result = json.loads(line)
+                except json.JSONDecodeError:
+                    continue  # 上次中断时写了一半的行
+                if result.get('ok'):
+                    done.add(str(result.get('id')))
+    except FileNotFoundError:
+        pass
+    return done
+
+
+def _percentile(sorted_values, p):
+    if not sorted_values:
+        return None
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * p / 100))]
+
+
+def run_batch(bot, input_path: str, output_path: str, workers: int = 8, rate: float = 0,
+              resume: bool = True, use_cache: bool = True) -> dict:
+    """并发处理 input_path 中的问题，结果追加写入 output_path，返回汇总统计
+    :param bot: SimpleFoodBot 实例（线程安全，多个 worker 共用）
+    :param workers: 并发数
+    :param rate: 每秒最多发出的问题数，0 表示不限
+    :param resume: 跳过输出文件中已经成功的 id；为 False 时清空输出文件重新开始
+    :param use_cache: 为 False 时跳过回复缓存
+    """
+    skip = completed_ids(output_path) if resume else set()
+    pacer = _Pacer(rate)
+    in_flight = threading.BoundedSemaphore(workers * 2)
+    write_lock = threading.Lock()
+    latencies = []
+    counts = {'ok': 0, 'failed': 0, 'skipped': 0}
+    started = time.monotonic()
+
+    def process(item_id, question, history, out):
+        try:
+            pacer.wait()
+            start = time.perf_counter()
+            error = None
+            try:
+                reply = bot.ask(question, conversation_history=history, use_cache=use_cache)
+            except Exception as e:
+                reply, error = None, f'{type(e).__name__}: {e}'
+            latency = time.perf_counter() - start
+            fallback = getattr(reply, 'reason', None)
+            ok = error is None and fallback is None
+            result = {
+                'id': item_id,
+                'question': question,
+                'reply': None if reply is None else str(reply),
+                'ok': ok,
+                'fallback': fallback,
+                'error': error,
+                'latency_ms': round(latency * 1000, 1),
+                'finished_at': datetime.now().isoformat(timespec='seconds')
+            }
+            with write_lock:
+                out.write(json.dumps(result, ensure_ascii=False) + '\n')
+                out.flush()
+                latencies.append(latency)
+                counts['ok' if ok else 'failed'] += 1
+                finished = counts['ok'] + counts['failed']
+                if finished % 20 == 0:
+                    elapsed = time.monotonic() - started
+                    print(f"… 已完成 {finished} 条（失败 {counts['failed']}），{finished / elapsed:.1f} 条/秒",
+                          file=sys.stderr)
+        finally:
+            in_flight.release()
+
+    with open(output_path, 'a' if resume else 'w', encoding='utf-8') as out, \
+            ThreadPoolExecutor(max_workers=workers, thread_name_prefix='batch') as pool:
+        try:
+            for item_id, question, history in read_items(input_path):
+                if item_id in skip:
+                    counts['skipped'] += 1
+                    continue
+                in_flight.acquire()
+                pool.submit(process, item_id, question, history, out)
+        except KeyboardInterrupt:
+            # 不再提交新问题；已经在处理的写完后退出，下次运行从这里续上
+            print("\n中断：等待进行中的问题完成……", file=sys.stderr)
+            pool.shutdown(wait=True, cancel_futures=True)
+
+    latencies.sort()
+    elapsed = time.monotonic() - started
+    summary = {
+        **counts,
+        'elapsed_s': round(elapsed, 1),
+        'throughput': round((counts['ok'] + counts['failed']) / elapsed, 2) if elapsed else 0.0,
+        'p50_ms': None if not latencies else round(_percentile(latencies, 50) * 1000, 1),
+        'p95_ms': None if not latencies else round(_percentile(latencies, 95) * 1000, 1)
+    }
+    return summary
@@ -0,0 +1,3 @@
+"""
+性能基准测试 - 在仓库根目录下以模块方式运行，例如：python -m benchmarks.bench_formatter
+"""
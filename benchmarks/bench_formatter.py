@@ -0,0 +1,148 @@
+"""
+回复格式化基准测试：新单趟格式化引擎 vs 原四趟实现
+
+运行：python -m benchmarks.bench_formatter [--json 结果文件]
+
+1. 一致性校验：黄金语料（golden_replies.jsonl）上新旧实现输出必须完全相同，
+   流式增量格式化（随机切块）的结果也必须与一次性格式化相同
+2. 吞吐对比：用语料拼出 1 KB ~ 100 KB 的回复，分别测量两种实现的 MB/s
+3. 已知差异：原实现重复加粗价格的几个例子，仅打印供对照
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import timeit
+
+from benchmarks.legacy_formatter import LegacyFormatter
+from reply_formatter import format_reply, StreamingReplyFormatter
+
+CORPUS_PATH = os.path.join(os.path.dirname(__file__), 'golden_replies.jsonl')
+SIZES_KB = (1, 4, 16, 64, 100)
+PRICE_QUESTION = '成都火锅人均多少钱'
+
+# 原实现用 str.replace 逐个替换造成的重复加粗，新实现按位置只加粗一次
+KNOWN_DIFFERENCES = [
+    ('两人200元，三人200元', PRICE_QUESTION),
+    ('**人均150元**，性价比高', PRICE_QUESTION),
+    ('套餐20元，单点120元', PRICE_QUESTION),
+]
+
+
+def load_corpus():
+    with open(CORPUS_PATH, encoding='utf-8') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def stream_format(reply, user_input, rng):
+    """按随机大小切块喂给流式格式化器"""
+    formatter = StreamingReplyFormatter(user_input)
+    parts = []
+    pos = 0
+    while pos < len(reply):
+        size = rng.randint(1, 12)
+        parts.append(formatter.feed(reply[pos:pos + size]))
+        pos += size
+    parts.append(formatter.finish())
+    return ''.join(parts)
+
+
+def check_golden(corpus, legacy):
+    rng = random.Random(42)
+    failures = 0
+    for i, item in enumerate(corpus):
+        expected = legacy._format_reply(item['reply'], item['user_input'])
+        actual = format_reply(item['reply'], item['user_input'])
+        streamed = stream_format(item['reply'], item['user_input'], rng)
+        if actual != expected:
+            failures += 1
+            print(f"✗ 第 {i + 1} 条输出不一致\n  原实现: {expected!r}\n  新实现: {actual!r}")
+        if streamed != actual:
+            failures += 1
+            print(f"✗ 第 {i + 1} 条流式输出不一致\n  一次性: {actual!r}\n  流式:   {streamed!r}")
+    print(f"一致性校验：{len(corpus)} 条语料，{failures} 处不一致")
+    return failures
+
+
+def build_reply(corpus, size_kb):
+    """把语料拼接成指定大小（UTF-8 字节数）的回复"""
+    target = size_kb * 1024
+    parts = []
+    size = 0
+    while size < target:
+        for item in corpus:
+            parts.append(item['reply'])
+            size += len(item['reply'].encode('utf-8')) + 2
+            if size >= target:
+                break
+    return '\n\n'.join(parts)
+
+
+def measure(func, number):
+    """取 3 次中最快的一次，返回单次耗时（秒）"""
+    return min(timeit.repeat(func, number=number, repeat=3)) / number
+
+
+def run_throughput(corpus, legacy):
+    results = []
+    print(f"\n{'大小':>8} {'原实现 MB/s':>14} {'新实现 MB/s':>14} {'流式 MB/s':>12} {'加速比':>8}")
+    for size_kb in SIZES_KB:
+        reply = build_reply(corpus, size_kb)
+        mb = len(reply.encode('utf-8')) / 1024 / 1024
+        number = max(1, 200 // size_kb)
+        chunks = [reply[i:i + 8] for i in range(0, len(reply), 8)]
+
+        def run_stream():
+            formatter = StreamingReplyFormatter(PRICE_QUESTION)
+            for chunk in chunks:
+                formatter.feed(chunk)
+            formatter.finish()
+
+        legacy_time = measure(lambda: legacy._format_reply(reply, PRICE_QUESTION), number)
+        new_time = measure(lambda: format_reply(reply, PRICE_QUESTION), number)
+        stream_time = measure(run_stream, number)
+
+        row = {
+            'size_kb': size_kb,
+            'legacy_mb_s': round(mb / legacy_time, 2),
+            'new_mb_s': round(mb / new_time, 2),
+            'stream_mb_s': round(mb / stream_time, 2),
+            'speedup': round(legacy_time / new_time, 2)
+        }
+        results.append(row)
+        print(f"{size_kb:>6}KB {row['legacy_mb_s']:>14} {row['new_mb_s']:>14} "
+              f"{row['stream_mb_s']:>12} {row['speedup']:>7}x")
+    return results
+
+
+def show_known_differences(legacy):
+    print("\n已知差异（原实现的重复加粗问题）：")
+    for reply, user_input in KNOWN_DIFFERENCES:
+        print(f"  输入:   {reply}")
+        print(f"  原实现: {legacy._format_price_info(reply)}")
+        print(f"  新实现: {format_reply(reply, user_input)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='回复格式化基准测试')
+    parser.add_argument('--json', help='把吞吐结果写入该 JSON 文件，便于跨提交对比')
+    args = parser.parse_args()
+
+    corpus = load_corpus()
+    legacy = LegacyFormatter()
+
+    failures = check_golden(corpus, legacy)
+    results = run_throughput(corpus, legacy)
+    show_known_differences(legacy)
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump({'golden_failures': failures, 'throughput': results}, f, ensure_ascii=False, indent=2)
+        print(f"\n结果已保存到 {args.json}")
+
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,113 @@
+"""
+本地知识库基准测试：索引构建、加载与查询延迟
+
+运行：python -m benchmarks.bench_knowledge [--json 结果文件]
+
+1. 构建：数据源（knowledge/dishes.jsonl）建成索引文件的耗时与体积，以及启动时加载的耗时
+2. 查询延迟：按数据源生成三类问题，分别统计 lookup（匹配名称 + BM25 + 拼接回答）的 p50 / p95 / p99（微秒）
+   - fact：“X是哪里的菜”“X属于什么菜系”“某城市有什么好吃的”，应当直接作答
+   - open：“推荐一家X店”“X怎么做”，只能补充资料，不能直接作答
+   - corpus：黄金语料（golden_replies.jsonl）中的真实问题
+3. 校验：fact 问题必须直接作答且回答中包含正确的地区，open 问题不能直接作答
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+from knowledge_index import KnowledgeIndex, DEFAULT_SOURCE
+
+CORPUS_PATH = os.path.join(os.path.dirname(__file__), 'golden_replies.jsonl')
+
+
+def load_corpus():
+    with open(CORPUS_PATH, encoding='utf-8') as f:
+        return [json.loads(line)['user_input'] for line in f if line.strip()]
+
+
+def build_queries(docs, corpus):
+    """返回 {类别: [(问题, 直接作答时回答中应包含的文字), ...]}"""
+    fact, open_ = [], []
+    for doc in docs:
+        if doc['type'] == 'dish':
+            fact += [(f"{doc['name']}是哪里的菜", doc['region']), (f"{doc['name']}属于什么菜系", doc['cuisine'])]
+            open_ += [(f"推荐一家{doc['name']}店", None), (f"{doc['name']}怎么做", None)]
+        elif doc['type'] == 'city':
+            fact.append((f"{doc['name']}有什么好吃的", doc['dishes'][0]))
+    return {'fact': fact, 'open': open_, 'corpus': [(q, None) for q in corpus]}
+
+
+def percentile(samples, p):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * p / 100))]
+
+
+def measure_build(source):
+    docs = KnowledgeIndex.load_source(source)
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'index.bin')
+        start = time.perf_counter()
+        size = KnowledgeIndex.write(docs, path)
+        build_ms = (time.perf_counter() - start) * 1000
+        start = time.perf_counter()
+        index = KnowledgeIndex.load(path)
+        load_ms = (time.perf_counter() - start) * 1000
+    result = {'docs': len(docs), 'terms': index.term_count, 'source_bytes': os.path.getsize(source),
+              'index_bytes': size, 'build_ms': round(build_ms, 2), 'load_ms': round(load_ms, 2)}
+    print(f"构建：{result['docs']} 个条目，{result['terms']} 个词；数据源 {result['source_bytes']} 字节 → "
+          f"索引 {result['index_bytes']} 字节；构建 {result['build_ms']} ms，加载 {result['load_ms']} ms")
+    return index, docs, result
+
+
+def measure_lookups(index, queries, rounds):
+    results = {}
+    failures = 0
+    print(f"\n{'类别':<8} {'问题数':>6} {'直接作答':>8} {'补充资料':>8} {'p50 µs':>8} {'p95 µs':>8} {'p99 µs':>8}")
+    for category, items in queries.items():
+        samples = []
+        outcomes = {'direct': 0, 'grounded': 0, 'miss': 0}
+        for query, expected in items:
+            result = index.lookup(query)
+            outcomes[result.outcome] += 1
+            if category == 'fact' and not (result.answer and expected in result.answer):
+                failures += 1
+                print(f"✗ 应当直接作答：{query} → {result.answer!r}")
+            if category == 'open' and result.answer:
+                failures += 1
+                print(f"✗ 不应直接作答：{query}")
+            for _ in range(rounds):
+                start = time.perf_counter()
+                index.lookup(query)
+                samples.append((time.perf_counter() - start) * 1e6)
+        row = {'queries': len(items), **outcomes,
+               'p50_us': round(percentile(samples, 50), 1), 'p95_us': round(percentile(samples, 95), 1),
+               'p99_us': round(percentile(samples, 99), 1)}
+        results[category] = row
+        print(f"{category:<8} {row['queries']:>6} {row['direct']:>8} {row['grounded']:>8} "
+              f"{row['p50_us']:>8} {row['p95_us']:>8} {row['p99_us']:>8}")
+    return results, failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description='本地知识库基准测试')
+    parser.add_argument('--source', default=DEFAULT_SOURCE, help='知识条目 JSONL')
+    parser.add_argument('--rounds', type=int, default=200, help='每个问题重复查询的次数')
+    parser.add_argument('--json', help='把结果写入该 JSON 文件，便于跨提交对比')
+    args = parser.parse_args()
+
+    index, docs, build = measure_build(args.source)
+    lookups, failures = measure_lookups(index, build_queries(docs, load_corpus()), args.rounds)
+    print(f"\n校验：{failures} 处失败")
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump({'failures': failures, 'build': build, 'lookups': lookups}, f, ensure_ascii=False, indent=2)
+        print(f"\n结果已保存到 {args.json}")
+
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
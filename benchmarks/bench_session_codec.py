@@ -0,0 +1,140 @@
+"""
+Session 编解码基准测试：pickle vs SessionCodec（不压缩 / zlib / 不打标签的 zlib / zstd）
+
+运行：python -m benchmarks.bench_session_codec [--json 结果文件]
+
+样本（回复取自 golden_replies.jsonl）：
+- session：当前的 Session，只有 user_id、current_conversation_id
+- legacy_session：旧版本把所有对话塞进 Session 时的样子（5 个对话，每个 8 条消息），
+  用来估计迁移前的体积
+- short_message / long_message：对话存储中的一条消息（短问题、长回复）
+
+每种样本输出编码后的字节数与编码、解码的单次耗时（微秒），并校验解码结果与原数据相同；
+另外校验 SessionCodec 能读取 pickle 写入的旧 Session。
+"""
+import argparse
+import json
+import os
+import pickle
+import sys
+import timeit
+import uuid
+from datetime import datetime
+
+from session_codec import SessionCodec, zstandard
+
+CORPUS_PATH = os.path.join(os.path.dirname(__file__), 'golden_replies.jsonl')
+
+
+def load_corpus():
+    with open(CORPUS_PATH, encoding='utf-8') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def message(role, content):
+    return {'role': role, 'content': content, 'timestamp': datetime.now().isoformat()}
+
+
+def build_samples(corpus):
+    conversations = {}
+    for c in range(5):
+        history = []
+        for i in range(4):
+            item = corpus[(c * 4 + i) % len(corpus)]
+            # 语料只有十几条，加上编号避免重复的字符串被 pickle 按引用复用，低估旧格式的体积
+            history += [message('user', f"{item['user_input']}（{c}）"),
+                        message('assistant', f"{item['reply']}（{c}）")]
+        cid = str(uuid.uuid4())
+        conversations[cid] = {
+            'id': cid,
+            'name': history[0]['content'][:20],
+            'history': history,
+            'starred': c == 0,
+            'created_at': datetime.now().isoformat(),
+            'last_updated': datetime.now().isoformat()
+        }
+    longest = max(corpus, key=lambda item: len(item['reply']))
+    return {
+        'session': {'_permanent': True, 'user_id': str(uuid.uuid4()), 'current_conversation_id': str(uuid.uuid4())},
+        'legacy_session': {'_permanent': True, 'user_id': str(uuid.uuid4()),
+                           'current_conversation_id': next(iter(conversations)), 'conversations': conversations},
+        'short_message': message('user', corpus[0]['user_input']),
+        'long_message': message('assistant', longest['reply'])
+    }
+
+
+def build_codecs():
+    codecs = {'pickle': pickle, 'codec-none': SessionCodec('none'), 'codec-zlib': SessionCodec('zlib'),
+              # 对话消息使用的配置：只含 JSON 类型，不打标签
+              'codec-plain': SessionCodec('zlib', tagged=False)}
+    if zstandard is not None:
+        codecs['codec-zstd'] = SessionCodec('zstd')
+    else:
+        print("（未安装 zstandard，跳过 codec-zstd）")
+    return codecs
+
+
+def measure(func, number):
+    """取 3 次中最快的一次，返回单次耗时（微秒）"""
+    return min(timeit.repeat(func, number=number, repeat=3)) / number * 1e6
+
+
+def run(samples, codecs, number):
+    results = []
+    failures = 0
+    print(f"\n{'样本':<16} {'编码器':<12} {'字节数':>8} {'相对 pickle':>12} {'编码 µs':>10} {'解码 µs':>10}")
+    for sample_name, value in samples.items():
+        baseline = None
+        for codec_name, codec in codecs.items():
+            data = codec.dumps(value)
+            if codec.loads(data) != value:
+                failures += 1
+                print(f"✗ {sample_name} / {codec_name} 解码结果与原数据不同")
+            baseline = baseline or len(data)
+            row = {
+                'sample': sample_name,
+                'codec': codec_name,
+                'bytes': len(data),
+                'ratio': round(len(data) / baseline, 3),
+                'encode_us': round(measure(lambda: codec.dumps(value), number), 2),
+                'decode_us': round(measure(lambda: codec.loads(data), number), 2)
+            }
+            results.append(row)
+            print(f"{sample_name:<16} {codec_name:<12} {row['bytes']:>8} {row['ratio']:>12} "
+                  f"{row['encode_us']:>10} {row['decode_us']:>10}")
+    return results, failures
+
+
+def check_migration(samples):
+    """pickle 写入的旧 Session 必须能被 SessionCodec 读出"""
+    codec = SessionCodec()
+    failures = 0
+    for name in ('session', 'legacy_session'):
+        value = samples[name]
+        if codec.loads(pickle.dumps(value)) != value:
+            failures += 1
+            print(f"✗ 无法读取 pickle 格式的 {name}")
+    print(f"\n迁移校验：{failures} 处失败")
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Session 编解码基准测试')
+    parser.add_argument('--number', type=int, default=2000, help='每项测量的循环次数')
+    parser.add_argument('--json', help='把结果写入该 JSON 文件，便于跨提交对比')
+    args = parser.parse_args()
+
+    samples = build_samples(load_corpus())
+    results, failures = run(samples, build_codecs(), args.number)
+    failures += check_migration(samples)
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump({'failures': failures, 'results': results}, f, ensure_ascii=False, indent=2)
+        print(f"\n结果已保存到 {args.json}")
+
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,174 @@
+"""
+本地千帆替身 - 模拟 /v2/chat/completions，用于压测时不消耗真实配额
+
+运行：python -m benchmarks.fake_qianfan --port 8765 --latency lognormal:800,0.5 --error-rate 0.01
+然后让应用指向它：QIANFAN_BASE_URL=http://127.0.0.1:8765 BAIDU_API_KEY=bce-fake python app.py
+
+- 延迟分布（毫秒）：fixed:200 / uniform:100,400 / lognormal:中位数,sigma；
+  --model-latency 可以给个别模型单独指定分布，用于测试模型路由与对冲请求
+- 非流式请求整段延迟后一次返回；流式请求先等待首包延迟，再按 --chunk-interval 逐块返回
+- 按 --error-rate 随机返回 429 / 500 / 503，用于观察重试与错误处理
+- 回复内容取自 golden_replies.jsonl，--reply-chars 可把回复重复拼接到指定长度
+"""
+import argparse
+import json
+import math
+import os
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+CORPUS_PATH = os.path.join(os.path.dirname(__file__), 'golden_replies.jsonl')
+ERROR_STATUSES = (429, 500, 503)
+
+
+class LatencyDistribution:
+    """按规格字符串采样延迟（秒）"""
+
+    def __init__(self, spec: str):
+        kind, _, args = spec.partition(':')
+        params = [float(x) for x in args.split(',') if x]
+        if kind == 'fixed' and len(params) == 1:
+            self._sample = lambda: params[0]
+        elif kind == 'uniform' and len(params) == 2:
+            self._sample = lambda: random.uniform(params[0], params[1])
+        elif kind == 'lognormal' and len(params) == 2:
+            mu = math.log(params[0])
+            self._sample = lambda: random.lognormvariate(mu, params[1])
+        else:
+            raise ValueError(f'无法识别的延迟分布: {spec}')
+        self.spec = spec
+
+    def sample(self) -> float:
+        return max(0.0, self._sample()) / 1000
+
+
+class FakeQianfanHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    server_version = 'FakeQianfan/1.0'
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        config = self.server.config
+        body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+        self.server.count('requests')
+
+        if random.random() < config['error_rate']:
+            self.server.count('errors')
+            self._send_json(random.choice(ERROR_STATUSES),
+                            {'error': {'code': 'fake_error', 'message': '模拟的上游错误'}})
+            return
+
+        reply = self.server.pick_reply()
+        latency = config['model_latency'].get(body.get('model'), config['latency'])
+        if body.get('stream'):
+            self._stream(reply, config, latency)
+        else:
+            time.sleep(latency.sample())
+            self._send_json(200, {
+                'id': 'as-fake',
+                'object': 'chat.completion',
+                'model': body.get('model'),
+                'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': reply},
+                             'finish_reason': 'stop'}],
+                'usage': {'prompt_tokens': 0, 'completion_tokens': len(reply), 'total_tokens': len(reply)}
+            })
+
+    def _send_json(self, status, payload):
+        data = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _stream(self, reply, config, latency):
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+
+        time.sleep(latency.sample())
+        size = config['chunk_chars']
+        for i in range(0, len(reply), size):
+            event = {'choices': [{'index': 0, 'delta': {'content': reply[i:i + size]}}]}
+            self._write_chunk(f"data: {json.dumps(event, ensure_ascii=False)}\n\n")
+            time.sleep(config['chunk_interval'])
+        self._write_chunk('data: [DONE]\n\n')
+        self.wfile.write(b'0\r\n\r\n')
+
+    def _write_chunk(self, text):
+        data = text.encode('utf-8')
+        self.wfile.write(b'%x\r\n%s\r\n' % (len(data), data))
+        self.wfile.flush()
+
+
+class FakeQianfanServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, latency='lognormal:800,0.5', error_rate=0.0, chunk_chars=8,
+                 chunk_interval=0.02, reply_chars=0, model_latency=None):
+        super().__init__(address, FakeQianfanHandler)
+        self.config = {
+            'latency': LatencyDistribution(latency),
+            'model_latency': {model: LatencyDistribution(spec) for model, spec in (model_latency or {}).items()},
+            'error_rate': error_rate,
+            'chunk_chars': chunk_chars,
+            'chunk_interval': chunk_interval
+        }
+        with open(CORPUS_PATH, encoding='utf-8') as f:
+            replies = [json.loads(line)['reply'] for line in f if line.strip()]
+        if reply_chars:
+            replies = [(r * (reply_chars // len(r) + 1))[:reply_chars] for r in replies]
+        self.replies = replies
+        self.stats = {'requests': 0, 'errors': 0}
+        self._lock = threading.Lock()
+
+    def pick_reply(self) -> str:
+        return random.choice(self.replies)
+
+    def count(self, name):
+        with self._lock:
+            self.stats[name] += 1
+
+
+def start_server(host='127.0.0.1', port=8765, **kwargs) -> FakeQianfanServer:
+    """在后台线程中启动替身服务器（供其他基准脚本直接调用）"""
+    server = FakeQianfanServer((host, port), **kwargs)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description='本地千帆替身服务器')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--latency', default='lognormal:800,0.5',
+                        help='延迟分布（毫秒）：fixed:200 / uniform:100,400 / lognormal:中位数,sigma')
+    parser.add_argument('--model-latency', action='append', default=[], metavar='MODEL=SPEC',
+                        help='为指定模型单独设置延迟分布，可重复，例如 ernie-3.5-8k=lognormal:800,1.0')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='随机返回 429/500/503 的比例')
+    parser.add_argument('--chunk-chars', type=int, default=8, help='流式每块的字符数')
+    parser.add_argument('--chunk-interval', type=float, default=0.02, help='流式两块之间的间隔（秒）')
+    parser.add_argument('--reply-chars', type=int, default=0, help='把回复拼接到指定长度，0 表示使用原文')
+    args = parser.parse_args()
+
+    server = FakeQianfanServer((args.host, args.port), latency=args.latency, error_rate=args.error_rate,
+                               chunk_chars=args.chunk_chars, chunk_interval=args.chunk_interval,
+                               reply_chars=args.reply_chars,
+                               model_latency=dict(item.split('=', 1) for item in args.model_latency))
+    print(f"千帆替身已启动：http://{args.host}:{args.port}/v2/chat/completions（Ctrl+C 退出）")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        print(f"\n共处理 {server.stats['requests']} 个请求，其中模拟错误 {server.stats['errors']} 个")
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
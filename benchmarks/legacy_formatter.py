@@ -0,0 +1,151 @@
+"""
+原 SimpleFoodBot 的四趟格式化实现（原样保留），仅用于基准测试和输出一致性对比
+"""
+
+
+class LegacyFormatter:
+    def _format_reply(self, reply: str, user_input: str) -> str:
+        """格式化AI回复，使其更易读"""
+        if not reply:
+            return reply
+        
+        # 1. 确保回复包含适当的换行
+        formatted = reply
+        
+        # 2. 根据用户输入的关键词进行特殊格式化
+        user_input_lower = user_input.lower()
+        
+        # 如果用户询问价格预算，特别格式化价格信息
+        if any(keyword in user_input_lower for keyword in ['价格', '预算', '多少钱', '人均', '消费']):
+            formatted = self._format_price_info(formatted)
+        
+        # 3. 确保列表项有适当的格式
+        formatted = self._format_list_items(formatted)
+        
+        # 4. 确保段落之间有适当的间距
+        formatted = self._format_paragraphs(formatted)
+        
+        # 5. 处理常见的Markdown格式
+        formatted = self._format_markdown(formatted)
+        
+        return formatted
+    
+    def _format_price_info(self, text: str) -> str:
+        """格式化价格信息"""
+        lines = text.split('\n')
+        formatted_lines = []
+        
+        for line in lines:
+            # 查找并格式化价格信息
+            import re
+            # 匹配人民币符号和数字
+            price_patterns = [
+                r'(\d+)\s*元',
+                r'¥\s*(\d+)',
+                r'RMB\s*(\d+)',
+                r'人均\s*(\d+)',
+                r'预算\s*(\d+)'
+            ]
+            
+            for pattern in price_patterns:
+                matches = re.finditer(pattern, line)
+                for match in matches:
+                    # 在价格信息前后添加强调标记
+                    price_text = match.group(0)
+                    line = line.replace(price_text, f"**{price_text}**")
+            
+            formatted_lines.append(line)
+        
+        return '\n'.join(formatted_lines)
+    
+    def _format_list_items(self, text: str) -> str:
+        """格式化列表项"""
+        lines = text.split('\n')
+        formatted_lines = []
+        
+        for i, line in enumerate(lines):
+            stripped = line.strip()
+            
+            # 检查是否是列表项
+            if (stripped.startswith('•') or 
+                stripped.startswith('-') or 
+                stripped.startswith('*') or
+                stripped.startswith('1.') or
+                stripped.startswith('2.') or
+                stripped.startswith('3.') or
+                stripped.startswith('4.') or
+                stripped.startswith('5.')):
+                # 确保列表项前面有适当的缩进
+                if i > 0 and not formatted_lines[-1].endswith('\n\n'):
+                    formatted_lines.append('')
+                formatted_lines.append(line)
+                # 确保列表项后面有适当的间距
+                if i < len(lines) - 1 and not lines[i+1].strip().startswith(('•', '-', '*', '1.', '2.', '3.', '4.', '5.')):
+                    formatted_lines.append('')
+            else:
+                formatted_lines.append(line)
+        
+        return '\n'.join(formatted_lines)
+    
+    def _format_paragraphs(self, text: str) -> str:
+        """确保段落之间有适当的间距"""
+        # 将多个换行符替换为两个换行符
+        import re
+        text = re.sub(r'\n{3,}', '\n\n', text)
+        
+        # 确保句子之间有适当的间距
+        lines = text.split('\n')
+        formatted_lines = []
+        
+        for line in lines:
+            if line.strip():  # 如果不是空行
+                # 在中文句子后添加适当的间距
+                sentences = re.split(r'([。！？])', line)
+                formatted_sentences = []
+                
+                for j in range(0, len(sentences), 2):
+                    if j < len(sentences) - 1:
+                        formatted_sentences.append(sentences[j] + sentences[j+1])
+                    else:
+                        formatted_sentences.append(sentences[j])
+                
+                line = ''.join(formatted_sentences)
+            
+            formatted_lines.append(line)
+        
+        return '\n'.join(formatted_lines)
+    
+    def _format_markdown(self, text: str) -> str:
+        """处理Markdown格式"""
+        # 将**加粗**转换为HTML格式（前端会处理）
+        # 这里我们只确保格式正确
+        import re
+        
+        # 确保加粗格式正确
+        text = re.sub(r'\*\*(.+?)\*\*', r'**\1**', text)
+        
+        # 确保标题格式正确
+        lines = text.split('\n')
+        formatted_lines = []
+        
+        for line in lines:
+            # 检测标题格式
+            if line.strip().startswith('###'):
+                if formatted_lines and formatted_lines[-1] != '':
+                    formatted_lines.append('')
+                formatted_lines.append(line)
+                formatted_lines.append('')
+            elif line.strip().startswith('##'):
+                if formatted_lines and formatted_lines[-1] != '':
+                    formatted_lines.append('')
+                formatted_lines.append(line)
+                formatted_lines.append('')
+            elif line.strip().startswith('#'):
+                if formatted_lines and formatted_lines[-1] != '':
+                    formatted_lines.append('')
+                formatted_lines.append(line)
+                formatted_lines.append('')
+            else:
+                formatted_lines.append(line)
+        
+        return '\n'.join(formatted_lines)
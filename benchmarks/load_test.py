@@ -0,0 +1,229 @@
+"""
+压测脚本 - 模拟多个用户在多个对话间聊天、切换，统计各路由的吞吐与延迟
+
+准备（三个终端，均在仓库根目录）：
+1. python -m benchmarks.fake_qianfan --port 8765
+2. QIANFAN_BASE_URL=http://127.0.0.1:8765 BAIDU_API_KEY=bce-fake python app.py
+3. python -m benchmarks.load_test --users 20 --duration 60 --json results.json
+
+每个虚拟用户有自己的 Cookie（即自己的 Session），行为如下：
+- 开始时拉取对话列表，新建若干对话
+- 循环：偶尔切换到另一个对话（/conversations/switch），发一条消息（/chat），
+  然后像前端一样刷新侧边栏（/conversations）
+- 问题一部分来自一小组热门问题（观察缓存与请求合并），其余随机组合
+
+结果包括每个路由的请求数、错误数、吞吐、p50/p95/p99 延迟，以及 Redis 每个请求读写的字节数
+（由 INFO stats 的 total_net_input_bytes / total_net_output_bytes 前后相减得到，
+是整个 Redis 实例的流量，压测时请避免其他客户端同时使用）。
+--json 保存结果，--baseline 与之前保存的结果对比。
+"""
+import argparse
+import json
+import math
+import os
+import random
+import subprocess
+import threading
+import time
+from datetime import datetime
+
+import redis
+import requests
+
+CITIES = ['北京', '上海', '成都', '重庆', '广州', '西安', '长沙', '杭州', '武汉', '南京']
+DISHES = ['火锅', '烤鸭', '小笼包', '肠粉', '串串', '米粉', '面馆', '烧烤', '早茶', '本帮菜']
+TEMPLATES = ['{city}有什么好吃的{dish}？', '{city}{dish}人均多少钱', '推荐几家{city}的{dish}',
+             '{city}{dish}哪家最正宗', '预算100元在{city}吃{dish}']
+HOT_QUESTIONS = ['北京烤鸭哪家好？', '成都火锅推荐', '上海有什么必吃的小吃', '广州早茶去哪里']
+ROUTES = ('/chat', '/conversations', '/conversations/switch', '/conversations/new')
+
+
+def percentile(sorted_values, p):
+    """最近秩法求百分位数"""
+    if not sorted_values:
+        return None
+    rank = max(1, math.ceil(p / 100 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+class VirtualUser:
+    def __init__(self, base_url, args, rng):
+        self.base_url = base_url.rstrip('/')
+        self.args = args
+        self.rng = rng
+        self.http = requests.Session()
+        self.conversation_ids = []
+        self.current_id = None
+        self.samples = {route: [] for route in ROUTES}
+        self.errors = {route: 0 for route in ROUTES}
+
+    def request(self, method, route, **kwargs):
+        start = time.perf_counter()
+        try:
+            response = self.http.request(method, self.base_url + route, timeout=self.args.timeout, **kwargs)
+            data = response.json()
+            ok = response.status_code == 200 and data.get('success', False)
+        except (requests.RequestException, ValueError):
+            data, ok = {}, False
+        self.samples[route].append(time.perf_counter() - start)
+        if not ok:
+            self.errors[route] += 1
+        return data
+
+    def question(self):
+        if self.rng.random() < self.args.hot_ratio:
+            return self.rng.choice(HOT_QUESTIONS)
+        return self.rng.choice(TEMPLATES).format(city=self.rng.choice(CITIES), dish=self.rng.choice(DISHES))
+
+    def setup(self):
+        data = self.request('GET', '/conversations')
+        self.current_id = data.get('current_conversation_id')
+        self.conversation_ids = [c['id'] for c in data.get('conversations', [])]
+        while len(self.conversation_ids) < self.args.conversations:
+            data = self.request('POST', '/conversations/new', json={})
+            if data.get('conversation_id'):
+                self.conversation_ids.append(data['conversation_id'])
+                self.current_id = data['conversation_id']
+
+    def step(self):
+        if len(self.conversation_ids) > 1 and self.rng.random() < self.args.switch_ratio:
+            target = self.rng.choice([c for c in self.conversation_ids if c != self.current_id])
+            self.request('POST', '/conversations/switch', json={'conversation_id': target})
+            self.current_id = target
+        self.request('POST', '/chat', json={'message': self.question()})
+        self.request('GET', '/conversations')
+        if self.args.think_time:
+            time.sleep(self.rng.uniform(0, 2 * self.args.think_time))
+
+    def run(self, deadline):
+        self.setup()
+        while time.monotonic() < deadline:
+            self.step()
+
+
+def redis_net_bytes(client):
+    if client is None:
+        return None
+    try:
+        info = client.info('stats')
+        return info['total_net_input_bytes'], info['total_net_output_bytes']
+    except (redis.RedisError, KeyError) as e:
+        print(f"⚠️  读取 Redis 统计失败: {e!r}")
+        return None
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def summarize(users, elapsed):
+    routes = {}
+    total_count = 0
+    total_errors = 0
+    for route in ROUTES:
+        samples = sorted(s for u in users for s in u.samples[route])
+        errors = sum(u.errors[route] for u in users)
+        if not samples:
+            continue
+        total_count += len(samples)
+        total_errors += errors
+        routes[route] = {
+            'count': len(samples),
+            'errors': errors,
+            'throughput_rps': round(len(samples) / elapsed, 2),
+            'mean_ms': round(sum(samples) / len(samples) * 1000, 1),
+            'p50_ms': round(percentile(samples, 50) * 1000, 1),
+            'p95_ms': round(percentile(samples, 95) * 1000, 1),
+            'p99_ms': round(percentile(samples, 99) * 1000, 1)
+        }
+    return routes, {'count': total_count, 'errors': total_errors,
+                    'throughput_rps': round(total_count / elapsed, 2)}
+
+
+def print_report(result, baseline=None):
+    print(f"\n{'路由':<24}{'请求数':>8}{'错误':>6}{'RPS':>9}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for route, row in result['routes'].items():
+        print(f"{route:<24}{row['count']:>8}{row['errors']:>6}{row['throughput_rps']:>9}"
+              f"{row['p50_ms']:>10}{row['p95_ms']:>10}{row['p99_ms']:>10}")
+        old = (baseline or {}).get('routes', {}).get(route)
+        if old:
+            deltas = [f"{k[:-3]} {row[k] - old[k]:+.1f}" for k in ('p50_ms', 'p95_ms', 'p99_ms')]
+            print(f"{'  对比基线':<22}{'':>23}{row['throughput_rps'] - old['throughput_rps']:>+9.2f}  "
+                  + '  '.join(deltas))
+    total = result['total']
+    print(f"\n合计 {total['count']} 个请求，错误 {total['errors']} 个，吞吐 {total['throughput_rps']} 请求/秒")
+    if result['redis']:
+        r = result['redis']
+        print(f"Redis：每个请求读入 {r['bytes_in_per_request']} 字节，写出 {r['bytes_out_per_request']} 字节")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='食探 Web 服务压测')
+    parser.add_argument('--url', default='http://127.0.0.1:5000', help='被测服务地址')
+    parser.add_argument('--users', type=int, default=20, help='并发虚拟用户数')
+    parser.add_argument('--duration', type=float, default=60, help='压测时长（秒）')
+    parser.add_argument('--conversations', type=int, default=3, help='每个用户的对话数')
+    parser.add_argument('--switch-ratio', type=float, default=0.3, help='每轮切换对话的概率')
+    parser.add_argument('--hot-ratio', type=float, default=0.2, help='提热门问题的概率')
+    parser.add_argument('--think-time', type=float, default=0.0, help='每轮之间的平均思考时间（秒）')
+    parser.add_argument('--timeout', type=float, default=120, help='单个请求超时（秒）')
+    parser.add_argument('--redis-url', default=os.getenv('REDIS_URL', 'redis://localhost:6379/0'),
+                        help='被测服务使用的 Redis，用于统计读写字节数；传空字符串跳过')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--json', help='把结果保存到该 JSON 文件')
+    parser.add_argument('--baseline', help='与之前保存的 JSON 结果对比')
+    args = parser.parse_args()
+
+    redis_client = redis.from_url(args.redis_url) if args.redis_url else None
+    users = [VirtualUser(args.url, args, random.Random(args.seed + i)) for i in range(args.users)]
+
+    print(f"压测 {args.url}：{args.users} 个用户，持续 {args.duration} 秒")
+    net_before = redis_net_bytes(redis_client)
+    started_at = datetime.now().isoformat(timespec='seconds')
+    start = time.monotonic()
+    deadline = start + args.duration
+    threads = [threading.Thread(target=u.run, args=(deadline,), daemon=True) for u in users]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.monotonic() - start
+    net_after = redis_net_bytes(redis_client)
+
+    routes, total = summarize(users, elapsed)
+    redis_stats = None
+    if net_before and net_after and total['count']:
+        bytes_in = net_after[0] - net_before[0]
+        bytes_out = net_after[1] - net_before[1]
+        redis_stats = {'bytes_in': bytes_in, 'bytes_out': bytes_out,
+                       'bytes_in_per_request': round(bytes_in / total['count']),
+                       'bytes_out_per_request': round(bytes_out / total['count'])}
+
+    result = {
+        'commit': git_commit(),
+        'started_at': started_at,
+        'elapsed_s': round(elapsed, 2),
+        'config': {k: v for k, v in vars(args).items() if k not in ('json', 'baseline')},
+        'routes': routes,
+        'total': total,
+        'redis': redis_stats
+    }
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+    print_report(result, baseline)
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+        print(f"\n结果已保存到 {args.json}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,387 @@
+"""
+对话生成任务队列 - /chat 只把问题放进 Redis 队列并立即返回任务 ID，由独立的 Worker 进程调用千帆
+
+/chat 原来在 Web Worker 里同步等待 bot.ask，一次生成最长要等 60 秒，几个慢请求就能占满 Worker。
+开启任务模式（CHAT_JOBS_ENABLED=1）后：
+- /chat 做完指令、限流与本地知识库这些毫秒级的处理后，把问题写成一个任务放进队列，返回 202 与 job_id；
+  队列积压超过 max_pending 时返回 429
+- 生成 Worker（python chat_jobs.py worker，可以部署多份）取出任务，打包上下文、调用 SimpleFoodBot.ask
+  （含格式化），把一问一答写进对话，再通知等待结果的请求
+- 客户端用 GET /chat/jobs/<id>?wait=秒 长轮询，或订阅 GET /chat/jobs/<id>/events（SSE）取得结果；
+  /chat/stream 在任务模式下同样入队，先发送 job 事件（含任务 ID），再转发任务的结果
+- 等待结果只在 ASGI 入口（asgi.py，AsyncJobWatcher）中进行，不占用线程；Flask 入口立即返回当前状态，
+  客户端按指数退避再次查询，避免长轮询和 SSE 占满 Web Worker 的线程
+这样生成能力（Worker 进程数 × 线程数）与 HTTP 处理能力可以分别扩容。
+
+Redis 中的数据（前缀 food_bot:jobs）：
+    :pending       LIST  等待处理的任务 ID（左进右出）
+    :processing    LIST  已被 Worker 取走、尚未结束的任务 ID（BLMOVE 原子地从 pending 移过来）
+    :delayed       ZSET  等待重试的任务 ID -> 可以重新排队的时间
+    :dead          LIST  重试次数用完或排队超时的任务 ID（死信，保留最近 dead_letter_max 个）
+    :job:<id>      HASH  任务内容、状态（queued / running / done / failed）、尝试次数、结果
+    :job:<id>:notify LIST 任务结束时放入一个元素，等待结果的请求用 BLPOP 阻塞在这里
+超时、重试与死信：
+- 排队超过 queue_timeout 的任务不再调用千帆（用户多半已经放弃），直接进入死信
+- 每次取出任务时设置租约 lease；Worker 崩溃时任务留在 processing 中，租约过期后由其他 Worker 收回重试。
+  租约应明显长于一次生成的最长耗时，否则仍在进行的任务会被重复执行
+- 千帆超时、连接失败等兜底回复与异常按指数退避重试，最多 max_attempts 次，之后进入死信，
+  把兜底提示语作为结果返回给客户端（不写入对话，用户可以直接重发）
+"""
+import argparse
+import logging
+import os
+import signal
+import sys
+import threading
+import time
+import uuid
+
+from admission import Overloaded
+from telemetry import CHAT_JOBS, observe_stage
+
+logger = logging.getLogger(__name__)
+
+STATUS_QUEUED = 'queued'
+STATUS_RUNNING = 'running'
+STATUS_DONE = 'done'
+STATUS_FAILED = 'failed'
+FINAL_STATUSES = (STATUS_DONE, STATUS_FAILED)
+
+# 任务哈希中按整数 / 浮点数解码的字段
+INT_FIELDS = ('attempts', 'version', 'no_cache')
+FLOAT_FIELDS = ('created_at', 'started_at', 'finished_at', 'lease_until')
+
+
+class JobFailed(Exception):
+    """任务处理失败；retryable 为 False 或重试次数用完时进入死信"""
+
+    def __init__(self, reason: str, reply: str = None, retryable: bool = True, retry_after: float = None):
+        super().__init__(reason)
+        self.reason = reason
+        self.reply = reply
+        self.retryable = retryable
+        self.retry_after = retry_after
+
+
+class ChatJobQueue:
+    def __init__(self, redis_client, prefix: str = 'food_bot:jobs', max_pending: int = 1000,
+                 max_attempts: int = 3, queue_timeout: float = 60, lease: float = 180,
+                 retry_backoff: float = 2, result_ttl: int = 3600, dead_letter_max: int = 1000,
+                 enabled: bool = False):
+        """
+        :param redis_client: redis.Redis 实例
+        :param max_pending: 排队任务数上限，超出时 enqueue 抛出 Overloaded
+        :param max_attempts: 每个任务最多执行的次数（含第一次）
+        :param queue_timeout: 任务从入队到开始执行的最长等待时间（秒）
+        :param lease: 一次执行的租约（秒），过期未结束的任务视为 Worker 已崩溃
+        :param retry_backoff: 第一次重试前的等待时间（秒），之后每次翻倍
+        :param result_ttl: 任务结束后结果保留的时间（秒）
+        :param dead_letter_max: 死信列表保留的任务数
+        :param enabled: /chat 是否使用任务模式；Worker 不看这个开关
+        """
+        self.redis = redis_client
+        self.prefix = prefix
+        self.max_pending = max_pending
+        self.max_attempts = max_attempts
+        self.queue_timeout = queue_timeout
+        self.lease = lease
+        self.retry_backoff = retry_backoff
+        self.result_ttl = result_ttl
+        self.dead_letter_max = dead_letter_max
+        self.enabled = enabled
+        self.pending_key = f'{prefix}:pending'
+        self.processing_key = f'{prefix}:processing'
+        self.delayed_key = f'{prefix}:delayed'
+        self.dead_key = f'{prefix}:dead'
+        self._next_reap = 0.0
+
+    @classmethod
+    def from_env(cls, redis_client) -> "ChatJobQueue":
+        env = os.environ
+        return cls(
+            redis_client,
+            max_pending=int(env.get('CHAT_JOBS_MAX_PENDING', 1000)),
+            max_attempts=int(env.get('CHAT_JOBS_MAX_ATTEMPTS', 3)),
+            queue_timeout=float(env.get('CHAT_JOBS_QUEUE_TIMEOUT', 60)),
+            lease=float(env.get('CHAT_JOBS_LEASE', 180)),
+            retry_backoff=float(env.get('CHAT_JOBS_RETRY_BACKOFF', 2)),
+            result_ttl=int(env.get('CHAT_JOBS_RESULT_TTL', 3600)),
+            enabled=env.get('CHAT_JOBS_ENABLED', '0').lower() in ('1', 'true', 'yes')
+        )
+
+    def _job_key(self, job_id):
+        return f'{self.prefix}:job:{job_id}'
+
+    def _notify_key(self, job_id):
+        return f'{self.prefix}:job:{job_id}:notify'
+
+    # ---------------- Web 端 ----------------
+    def enqueue(self, uid, cid, message, no_cache=False) -> str:
+        """放入一个生成任务，返回任务 ID；积压过多时抛出 Overloaded"""
+        if self.redis.llen(self.pending_key) >= self.max_pending:
+            CHAT_JOBS.inc(event='rejected')
+            raise Overloaded('job_queue_full', self.retry_backoff)
+        job_id = uuid.uuid4().hex
+        pipe = self.redis.pipeline(transaction=True)
+        pipe.hset(self._job_key(job_id), mapping={
+            'uid': uid, 'cid': cid, 'message': message, 'no_cache': int(bool(no_cache)),
+            'status': STATUS_QUEUED, 'attempts': 0, 'created_at': time.time()
+        })
+        # 排队、重试与结果保留的时间加起来都不会超过这个有效期
+        pipe.expire(self._job_key(job_id), self._job_ttl())
+        pipe.lpush(self.pending_key, job_id)
+        pipe.execute()
+        CHAT_JOBS.inc(event='enqueued')
+        return job_id
+
+    def get(self, job_id):
+        """任务的当前状态，不存在（或已过期）时返回 None"""
+        return _decode_job(job_id, self.redis.hgetall(self._job_key(job_id)))
+
+    def wait(self, job_id, timeout: float):
+        """最多等待 timeout 秒直到任务结束，返回任务的最新状态（可能仍未结束）"""
+        job = self.get(job_id)
+        if job is None or job['status'] in FINAL_STATUSES or timeout <= 0:
+            return job
+        woken = self.redis.blpop([self._notify_key(job_id)], timeout=max(1, int(timeout)))
+        if woken:
+            # 放回去，叫醒同一任务的其他等待者（例如长轮询与 SSE 同时在等）
+            self.redis.lpush(self._notify_key(job_id), 1)
+        return self.get(job_id)
+
+    # ---------------- Worker 端 ----------------
+    def claim(self, timeout: float = 1.0):
+        """取出一个任务并加上租约，timeout 秒内没有任务时返回 None
+        顺带把到期的重试任务放回队列、收回租约过期的任务
+        """
+        now = time.time()
+        self.promote_due(now)
+        if now >= self._next_reap:
+            self._next_reap = now + max(1.0, self.lease / 4)
+            self.reap_expired(now)
+
+        raw_id = self.redis.blmove(self.pending_key, self.processing_key, timeout, 'RIGHT', 'LEFT')
+        if raw_id is None:
+            return None
+        job_id = raw_id.decode('utf-8')
+        job = self.get(job_id)
+        if job is None:
+            self.redis.lrem(self.processing_key, 1, job_id)
+            return None
+
+        now = time.time()
+        if job['attempts'] == 0 and now - job['created_at'] > self.queue_timeout:
+            # 第一次执行前排队太久，用户多半已经放弃，不再调用千帆（重试的任务不受此限制）
+            self._finish_failed(job, JobFailed('queue_timeout', retryable=False))
+            return None
+
+        pipe = self.redis.pipeline(transaction=True)
+        pipe.hset(self._job_key(job_id), mapping={'status': STATUS_RUNNING, 'started_at': now,
+                                                  'lease_until': now + self.lease})
+        pipe.hincrby(self._job_key(job_id), 'attempts', 1)
+        _, attempts = pipe.execute()
+        job.update(status=STATUS_RUNNING, started_at=now, lease_until=now + self.lease, attempts=attempts)
+        return job
+
+    def complete(self, job, result: dict):
+        """任务成功：保存结果（reply、version 等），通知等待者"""
+        pipe = self.redis.pipeline(transaction=True)
+        pipe.hset(self._job_key(job['id']), mapping={**result, 'status': STATUS_DONE, 'finished_at': time.time()})
+        pipe.lrem(self.processing_key, 1, job['id'])
+        self._notify(pipe, job['id'])
+        pipe.execute()
+        CHAT_JOBS.inc(event='completed')
+
+    def fail(self, job, error: JobFailed):
+        """任务失败：还有重试次数时按指数退避重新排队，否则进入死信"""
+        if not error.retryable or job['attempts'] >= self.max_attempts:
+            self._finish_failed(job, error)
+            return
+        delay = error.retry_after or self.retry_backoff * 2 ** (job['attempts'] - 1)
+        pipe = self.redis.pipeline(transaction=True)
+        pipe.hset(self._job_key(job['id']), mapping={'status': STATUS_QUEUED, 'error': error.reason})
+        pipe.lrem(self.processing_key, 1, job['id'])
+        pipe.zadd(self.delayed_key, {job['id']: time.time() + delay})
+        pipe.execute()
+        CHAT_JOBS.inc(event='retried')
+        logger.info("[任务] %s 第 %d 次执行失败（%s），%.1f 秒后重试", job['id'], job['attempts'], error.reason, delay)
+
+    def _finish_failed(self, job, error: JobFailed):
+        pipe = self.redis.pipeline(transaction=True)
+        mapping = {'status': STATUS_FAILED, 'error': error.reason, 'finished_at': time.time()}
+        if error.reply:
+            mapping['reply'] = error.reply
+        pipe.hset(self._job_key(job['id']), mapping=mapping)
+        pipe.lrem(self.processing_key, 1, job['id'])
+        pipe.lpush(self.dead_key, job['id'])
+        pipe.ltrim(self.dead_key, 0, self.dead_letter_max - 1)
+        self._notify(pipe, job['id'])
+        pipe.execute()
+        CHAT_JOBS.inc(event='dead')
+        logger.warning("[任务] %s 进入死信：%s（已执行 %d 次）", job['id'], error.reason, job.get('attempts', 0))
+
+    def _notify(self, pipe, job_id):
+        pipe.expire(self._job_key(job_id), self.result_ttl)
+        pipe.lpush(self._notify_key(job_id), 1)
+        pipe.expire(self._notify_key(job_id), self.result_ttl)
+
+    def _job_ttl(self) -> int:
+        retries = self.retry_backoff * 2 ** self.max_attempts
+        return int(self.queue_timeout + (self.lease + retries) * self.max_attempts + self.result_ttl)
+
+    def promote_due(self, now: float = None):
+        """把到了重试时间的任务放回队列（放在最右端，下一个就被取出）"""
+        now = now or time.time()
+        for raw_id in self.redis.zrangebyscore(self.delayed_key, '-inf', now, start=0, num=100):
+            # ZREM 成功的 Worker 负责放回，多个 Worker 同时检查也不会重复
+            if self.redis.zrem(self.delayed_key, raw_id):
+                self.redis.rpush(self.pending_key, raw_id)
+
+    def reap_expired(self, now: float = None):
+        """收回租约已过期的任务（执行它的 Worker 多半已经崩溃），按失败处理"""
+        now = now or time.time()
+        for raw_id in self.redis.lrange(self.processing_key, 0, -1):
+            job_id = raw_id.decode('utf-8')
+            job = self.get(job_id)
+            if job is not None:
+                # 刚被 BLMOVE 取走、还没来得及设置租约的任务按入队时间估计
+                deadline = job.get('lease_until') or job['created_at'] + self.queue_timeout + self.lease
+                if deadline > now:
+                    continue
+            # LREM 成功的 Worker 负责处理，避免重复收回
+            if not self.redis.lrem(self.processing_key, 1, job_id) or job is None:
+                continue
+            CHAT_JOBS.inc(event='lease_expired')
+            self.fail(job, JobFailed('lease_expired'))
+
+    def stats(self) -> dict:
+        pipe = self.redis.pipeline()
+        pipe.llen(self.pending_key)
+        pipe.zcard(self.delayed_key)
+        pipe.llen(self.processing_key)
+        pipe.llen(self.dead_key)
+        pending, delayed, processing, dead = pipe.execute()
+        return {'enabled': self.enabled, 'pending': pending, 'delayed': delayed,
+                'processing': processing, 'dead': dead}
+
+
+class AsyncJobWatcher:
+    """ChatJobQueue Web 端读取（get / wait）的 asyncio 版本：等待任务结束时不占用线程，供 asgi.py 使用"""
+
+    def __init__(self, queue: ChatJobQueue, redis_client):
+        """
+        :param queue: 提供键名与开关的同步队列
+        :param redis_client: redis.asyncio.Redis 实例，与 queue 连接同一个 Redis
+        """
+        self.queue = queue
+        self.redis = redis_client
+
+    async def get(self, job_id):
+        return _decode_job(job_id, await self.redis.hgetall(self.queue._job_key(job_id)))
+
+    async def wait(self, job_id, timeout: float):
+        """与 ChatJobQueue.wait 相同"""
+        job = await self.get(job_id)
+        if job is None or job['status'] in FINAL_STATUSES or timeout <= 0:
+            return job
+        notify_key = self.queue._notify_key(job_id)
+        if await self.redis.blpop([notify_key], timeout=max(1, int(timeout))):
+            await self.redis.lpush(notify_key, 1)
+        return await self.get(job_id)
+
+
+def _decode_job(job_id, raw):
+    if not raw:
+        return None
+    job = {k.decode('utf-8'): v.decode('utf-8') for k, v in raw.items()}
+    for field in INT_FIELDS:
+        if field in job:
+            job[field] = int(job[field])
+    for field in FLOAT_FIELDS:
+        if field in job:
+            job[field] = float(job[field])
+    job['id'] = job_id
+    return job
+
+
+class JobWorker:
+    """生成 Worker：concurrency 个线程循环取任务交给 handler 处理
+    handler(job) 返回要保存的结果（dict），失败时抛出 JobFailed（其他异常按可重试处理）
+    """
+
+    def __init__(self, queue: ChatJobQueue, handler, concurrency: int = 4, poll_timeout: float = 1.0):
+        self.queue = queue
+        self.handler = handler
+        self.concurrency = concurrency
+        self.poll_timeout = poll_timeout
+        self._stop = threading.Event()
+        self._threads = []
+
+    def start(self):
+        for i in range(self.concurrency):
+            thread = threading.Thread(target=self._loop, name=f'chat-job-{i}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self, *_):
+        """不再取新任务；正在处理的任务照常完成"""
+        self._stop.set()
+
+    def run(self):
+        """前台运行，收到 SIGTERM / SIGINT 后等正在处理的任务结束再退出"""
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        self.start()
+        logger.info("[任务] Worker 已启动，%d 个线程", self.concurrency)
+        while not self._stop.wait(1):
+            pass
+        logger.info("[任务] 正在退出，等待进行中的任务完成")
+        for thread in self._threads:
+            thread.join()
+
+    def _loop(self):
+        while not self._stop.is_set():
+            try:
+                job = self.queue.claim(self.poll_timeout)
+            except Exception:
+                logger.exception("[任务] 读取队列失败")
+                self._stop.wait(self.poll_timeout)
+                continue
+            if job is not None:
+                self.process(job)
+
+    def process(self, job):
+        observe_stage('job_queue_wait', job['started_at'] - job['created_at'])
+        try:
+            result = self.handler(job)
+        except JobFailed as e:
+            self.queue.fail(job, e)
+        except Overloaded as e:
+            self.queue.fail(job, JobFailed(e.reason, retry_after=e.retry_after))
+        except Exception as e:
+            logger.exception("[任务] %s 处理失败", job['id'])
+            self.queue.fail(job, JobFailed(f'internal:{type(e).__name__}'))
+        else:
+            self.queue.complete(job, result)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='对话生成任务队列')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    worker = subparsers.add_parser('worker', help='启动生成 Worker')
+    worker.add_argument('-c', '--concurrency', type=int, default=int(os.getenv('CHAT_JOBS_WORKERS', 4)),
+                        help='同时处理的任务数（线程数）')
+    subparsers.add_parser('stats', help='查看队列积压情况')
+    args = parser.parse_args(argv)
+
+    # 与 Web 进程共用 app.py 中的机器人、对话存储与 Redis 配置
+    import app as web
+
+    if args.command == 'stats':
+        print(web.chat_jobs.stats())
+        return
+    JobWorker(web.chat_jobs, web.run_chat_job, concurrency=args.concurrency).run()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
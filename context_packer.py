@@ -0,0 +1,109 @@
+"""
+上下文打包 - 按 token 预算挑选发送给千帆的历史消息，超出预算的旧消息折叠成滚动摘要
+
+原先按固定条数截断历史（最近 8 条 / 16 条），不看实际长度：回复很长时可能超出
+ernie-3.5-8k 的输入上限，闲聊几句时又白白丢掉了上下文。这里按估算的 token 数打包：
+1. 系统提示词、当前输入、摘要先占用预算
+2. 从最新的一轮往前，整轮加入历史，直到预算用完
+3. 放不下的旧消息交给模型压缩成一段摘要，附在系统提示词后面；摘要按对话缓存，
+   只在有新的消息被挤出预算时才重新生成
+
+token 数按千帆文档给出的经验公式估算：汉字数 + 英文单词数 × 1.3。
+"""
+import os
+import re
+
+# 汉字、假名、谚文以及全角标点，每个字符约为一个 token
+CJK_PATTERN = re.compile(r'[\u2e80-\u9fff\uac00-\ud7af\uf900-\ufaff\uff00-\uffef]')
+WORD_PATTERN = re.compile(r'[A-Za-z0-9]+')
+# 每条消息的角色、分隔符等额外开销
+MESSAGE_OVERHEAD = 4
+# 生成摘要时每条消息最多取的字符数
+SUMMARY_INPUT_CHARS = 500
+
+SUMMARY_PROMPT = """请把下面的美食对话压缩成一段不超过{limit}字的摘要，供后续对话参考。
+保留用户的口味偏好、忌口、所在城市、预算，以及已经推荐过的餐厅和菜品；省略寒暄和格式。
+只输出摘要本身。
+
+已有摘要：
+{summary}
+
+新增对话：
+{dialogue}"""
+
+
+def estimate_tokens(text: str) -> int:
+    """估算一段文本的 token 数"""
+    if not text:
+        return 0
+    cjk = len(CJK_PATTERN.findall(text))
+    words = len(WORD_PATTERN.findall(text))
+    return cjk + int(words * 1.3 + 0.5)
+
+
+def message_tokens(message: dict) -> int:
+    return estimate_tokens(message.get('content', '')) + MESSAGE_OVERHEAD
+
+
+class ContextPacker:
+    def __init__(self, budget: int = 5120, summary_tokens: int = 300, fold_ratio: float = 0.5):
+        """
+        :param budget: 单次请求输入部分（系统提示词 + 摘要 + 历史 + 当前输入）的 token 上限
+        :param summary_tokens: 摘要最多占用的 token 数
+        :param fold_ratio: 需要折叠时，历史只保留到预算的这个比例，
+                           留出余量让之后几轮不必每轮都重新生成摘要
+        """
+        self.budget = budget
+        self.summary_tokens = summary_tokens
+        self.fold_ratio = fold_ratio
+
+    @classmethod
+    def from_env(cls) -> "ContextPacker":
+        env = os.environ
+        return cls(
+            budget=int(env.get('CONTEXT_TOKEN_BUDGET', 5120)),
+            summary_tokens=int(env.get('CONTEXT_SUMMARY_TOKENS', 300)),
+            fold_ratio=float(env.get('CONTEXT_FOLD_RATIO', 0.5))
+        )
+
+    def fit(self, system_prompt: str, history: list, user_input: str, summary: str = '') -> int:
+        """返回能放进预算的历史起点：history[start:] 整轮保留，且以用户消息开头"""
+        fixed = (estimate_tokens(system_prompt) + estimate_tokens(summary)
+                 + estimate_tokens(user_input) + 2 * MESSAGE_OVERHEAD)
+        return self._fit_history(history, self.budget - fixed)
+
+    def plan(self, system_prompt: str, history: list, user_input: str, summary: str = '') -> int:
+        """与 fit 相同，但历史放不下时按 fold_ratio 多折叠一些，并为摘要预留空间"""
+        start = self.fit(system_prompt, history, user_input, summary)
+        if start == 0:
+            return 0
+        fixed = (estimate_tokens(system_prompt) + max(estimate_tokens(summary), self.summary_tokens)
+                 + estimate_tokens(user_input) + 2 * MESSAGE_OVERHEAD)
+        return self._fit_history(history, int((self.budget - fixed) * self.fold_ratio))
+
+    @staticmethod
+    def _fit_history(history: list, available: int) -> int:
+        start = len(history)
+        used = 0
+        for i in range(len(history) - 1, -1, -1):
+            used += message_tokens(history[i])
+            if used > available:
+                break
+            # 千帆要求 user / assistant 交替且以 user 开头，只在用户消息处截断
+            if history[i].get('role') == 'user':
+                start = i
+        return start
+
+    def summary_payload(self, summary: str, messages: list, model: str) -> dict:
+        """生成摘要用的请求体"""
+        # 单条消息过长时只取开头，避免摘要请求本身超出输入上限
+        dialogue = '\n'.join(
+            f"{'用户' if m['role'] == 'user' else '食探'}：{m['content'][:SUMMARY_INPUT_CHARS]}" for m in messages
+        )
+        prompt = SUMMARY_PROMPT.format(limit=self.summary_tokens, summary=summary or '（无）', dialogue=dialogue)
+        return {
+            "model": model,
+            "messages": [{"role": "user", "content": prompt}],
+            "max_tokens": self.summary_tokens,
+            "temperature": 0.3
+        }
@@ -0,0 +1,146 @@
+"""
+对话归档 - 把完整的对话记录追加写入本地 SQLite（WAL 模式），按游标分页读取
+
+Redis 中的对话只保留最近 HISTORY_MAX_MESSAGES 条消息，并随 Session 在 24 小时后过期；
+归档保存每一条消息且不过期，/conversations/<id>/messages 从这里分页读取更早的消息，
+切换对话时也只返回最后一页，不再一次性下发整个对话。
+
+- 表 messages 只追加；主键 id 自增，同一对话内按 id 排序即为消息顺序，分页游标就是 id
+- 每条消息带上写入时的版本号（同一轮问答共用一个），(对话, 版本号, 角色) 唯一，重复写入同一条消息会被忽略，
+  并发补写归档时不会产生重复记录；没有版本号的旧消息不受约束
+- WAL 模式下读写互不阻塞；synchronous=NORMAL，掉电时最多丢失最后几次提交
+- 每个线程（以及 fork 出的每个子进程）使用自己的连接；fork 之前打开的连接在子进程中只丢弃、不关闭
+- 用户删除或清空对话时，对应的归档记录一并删除
+- 归档是本机磁盘上的 SQLite 文件，只在同一台机器的进程之间共享：多台机器部署时每台机器各有一份不完整的归档，
+  需要让同一用户固定访问同一台机器（会话粘滞），否则请把 ARCHIVE_PATH 设为空、不启用归档。
+  SQLite 的锁依赖本机文件系统，不要把 ARCHIVE_PATH 放在 NFS 等网络存储上
+"""
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# 从父进程继承来的连接：SQLite 不允许在 fork 前后共用同一个连接，关闭它也可能影响父进程，保持引用直到进程退出
+_inherited_connections = []
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS messages (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id TEXT NOT NULL,
+    conversation_id TEXT NOT NULL,
+    role TEXT NOT NULL,
+    content TEXT NOT NULL,
+    timestamp TEXT,
+    version INTEGER,
+    archived_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_messages_conversation ON messages (user_id, conversation_id, id);
+"""
+
+# 旧版本创建的表没有 version 列，先补列再建唯一索引
+MIGRATIONS = (('version', 'ALTER TABLE messages ADD COLUMN version INTEGER'),)
+UNIQUE_INDEX = ('CREATE UNIQUE INDEX IF NOT EXISTS idx_messages_turn '
+                'ON messages (user_id, conversation_id, version, role)')
+
+
+class ConversationArchive:
+    def __init__(self, path: str, busy_timeout: float = 5.0):
+        """
+        :param path: SQLite 数据库文件路径，所在目录不存在时自动创建
+        :param busy_timeout: 其他进程正在写入时等待的最长时间（秒）
+        """
+        self.path = path
+        self.busy_timeout = busy_timeout
+        self._local = threading.local()
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        conn = self._connect()
+        conn.executescript(SCHEMA)
+        columns = {row[1] for row in conn.execute('PRAGMA table_info(messages)')}
+        for column, sql in MIGRATIONS:
+            if column not in columns:
+                conn.execute(sql)
+        conn.execute(UNIQUE_INDEX)
+
+    @classmethod
+    def from_env(cls):
+        """ARCHIVE_PATH 为空时不启用归档，返回 None；默认放在项目的 data 目录下（本机磁盘，见模块说明）"""
+        default = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'archive.sqlite3')
+        path = os.getenv('ARCHIVE_PATH', default)
+        if not path:
+            return None
+        logger.info("[归档] 使用本机 SQLite 文件 %s，多台机器部署时需要会话粘滞", path)
+        return cls(path)
+
+    def _connect(self):
+        self.reset()
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=self.busy_timeout, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def reset(self):
+        """fork 之后丢弃继承来的连接，下次访问时重新打开；gunicorn 预加载时由 app.reset_after_fork() 调用，
+        其他情况下由 _connect 在发现进程号变化时调用"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None and self._local.pid != os.getpid():
+            _inherited_connections.append(conn)
+            self._local.conn = None
+
+    # ---------------- 写入 ----------------
+    def append(self, uid, cid, messages):
+        """按顺序追加消息，已经归档过的消息（版本号和角色相同）跳过"""
+        now = time.time()
+        rows = [(uid, cid, m.get('role', ''), m.get('content', ''), m.get('timestamp'), m.get('version'), now)
+                for m in messages]
+        conn = self._connect()
+        with conn:
+            conn.executemany('INSERT OR IGNORE INTO messages '
+                             '(user_id, conversation_id, role, content, timestamp, version, archived_at) '
+                             'VALUES (?, ?, ?, ?, ?, ?, ?)', rows)
+
+    def delete(self, uid, cid):
+        conn = self._connect()
+        with conn:
+            conn.execute('DELETE FROM messages WHERE user_id = ? AND conversation_id = ?', (uid, cid))
+
+    def delete_all(self, uid):
+        conn = self._connect()
+        with conn:
+            conn.execute('DELETE FROM messages WHERE user_id = ?', (uid,))
+
+    # ---------------- 读取 ----------------
+    def has(self, uid, cid) -> bool:
+        row = self._connect().execute(
+            'SELECT 1 FROM messages WHERE user_id = ? AND conversation_id = ? LIMIT 1', (uid, cid)).fetchone()
+        return row is not None
+
+    def page(self, uid, cid, before: int = None, limit: int = 20):
+        """早于游标 before 的最后 limit 条消息（按时间正序）
+        :return: (消息列表, 下一页游标)；没有更早的消息时游标为 None
+        """
+        sql = 'SELECT id, role, content, timestamp, version FROM messages WHERE user_id = ? AND conversation_id = ?'
+        params = [uid, cid]
+        if before is not None:
+            sql += ' AND id < ?'
+            params.append(before)
+        sql += ' ORDER BY id DESC LIMIT ?'
+        params.append(limit + 1)
+        rows = self._connect().execute(sql, params).fetchall()
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        messages = []
+        for row in reversed(rows):
+            message = {'id': row[0], 'role': row[1], 'content': row[2], 'timestamp': row[3]}
+            # 和 Redis 中的消息一致：有版本号时带上，前端据此做增量同步
+            if row[4] is not None:
+                message['version'] = row[4]
+            messages.append(message)
+        return messages, (rows[-1][0] if has_more else None)
@@ -0,0 +1,543 @@
+"""
+对话存储 - 每个对话独立存放在 Redis 中，Session 里只保留用户 ID 和当前对话 ID
+
+键结构（前缀默认 food_bot:）：
+- food_bot:user:<uid>:starred            ZSET，已加星标的对话 ID，分数为最后更新时间
+- food_bot:user:<uid>:recent             ZSET，未加星标的对话 ID，分数为最后更新时间
+- food_bot:conv:<uid>:<cid>              HASH，对话元信息（名称、星标、时间、最后一条消息、
+                                          消息总数，以及更早消息的滚动摘要）
+- food_bot:conv:<uid>:<cid>:messages     LIST，对话消息（JSON，或传入 codec 时为 SessionCodec 格式），
+                                          追加后裁剪到最近 N 条
+- food_bot:user:<uid>:sync               HASH，用户的版本号 version 与增量同步的下限 floor
+- food_bot:user:<uid>:changes            ZSET，对话 ID，分数为对话最后一次变化（含删除）时的版本号
+
+发一条消息只需追加两条消息并更新一个 HASH，读写量与用户有多少个对话、历史有多长无关。
+两个有序集合构成侧边栏的排序索引（星标在前，其余按最近更新倒序），由各个写操作顺带维护，
+列表接口按游标分页读取，不需要全量扫描和排序。
+所有键的过期时间与 Session 一致，每次写入时刷新。
+
+版本号：每个用户一个单调递增的版本号，所有前端可见的写操作都在同一个事务中把它加一（WATCH 乐观事务，
+同一用户并发写入时重试），并记在对话元信息（version）、消息（version）和 changes 中。
+接口据此生成 ETag，并支持 since=<版本号> 的增量同步：只返回此后变化的对话与新增的消息。
+版本号从首次写入时的毫秒时间开始，同步状态过期后重新开始也比之前的版本号大；
+floor 之前的版本（同步状态新建、删除全部对话）无法增量同步，调用方应返回完整数据。
+传入 archive（ConversationArchive）时，每条消息另外追加到持久归档中，history_page 从归档分页读取。
+"""
+import json
+import logging
+import sqlite3
+import time
+import uuid
+from datetime import datetime
+
+import redis
+
+logger = logging.getLogger(__name__)
+
+
+class ConversationStore:
+    # 分页时依次读取的索引分区：先星标，后普通对话
+    SECTIONS = ('starred', 'recent')
+    # 一次增量同步最多返回的对话数，超出时调用方改为返回完整列表
+    MAX_DELTA_CONVERSATIONS = 200
+
+    def __init__(self, redis_client, prefix: str = 'food_bot:', ttl: int = 24 * 3600, max_messages: int = 8,
+                 codec=None, archive=None):
+        """
+        :param redis_client: redis.Redis 实例
+        :param prefix: Redis key 前缀
+        :param ttl: 对话数据的过期时间（秒），与 Session 有效期保持一致
+        :param max_messages: 每个对话最多保留的消息条数
+        :param codec: 消息编解码器（SessionCodec），None 时按 JSON 存储；
+                      传入时旧的 JSON 消息仍可读取，新消息按 codec 写入（长回复会被压缩）
+        :param archive: 完整消息的持久归档（ConversationArchive），None 时只保留 Redis 中的最近消息
+        """
+        self.redis = redis_client
+        self.prefix = prefix
+        self.ttl = ttl
+        self.max_messages = max_messages
+        self.codec = codec.variant(legacy=json.loads, tagged=False) if codec is not None else None
+        self.archive = archive
+
+    # ---------------- 键 ----------------
+    def _section_key(self, uid, section):
+        return f'{self.prefix}user:{uid}:{section}'
+
+    def _legacy_index_key(self, uid):
+        """旧版本使用的无序 SET 索引，仅用于迁移"""
+        return f'{self.prefix}user:{uid}:conversations'
+
+    def _meta_key(self, uid, cid):
+        return f'{self.prefix}conv:{uid}:{cid}'
+
+    def _messages_key(self, uid, cid):
+        return f'{self.prefix}conv:{uid}:{cid}:messages'
+
+    def _sync_key(self, uid):
+        return f'{self.prefix}user:{uid}:sync'
+
+    def _changes_key(self, uid):
+        return f'{self.prefix}user:{uid}:changes'
+
+    # ---------------- 编解码 ----------------
+    @staticmethod
+    def _decode_meta(cid, raw, message_count):
+        meta = {k.decode('utf-8'): v.decode('utf-8') for k, v in raw.items()}
+        return {
+            'id': cid,
+            'name': meta.get('name', '未命名'),
+            'starred': meta.get('starred') == '1',
+            'created_at': meta.get('created_at'),
+            'last_updated': meta.get('last_updated'),
+            'last_message': meta.get('last_message', ''),
+            'message_count': message_count,
+            'version': int(meta.get('version', 0))
+        }
+
+    def _encode_message(self, message):
+        if self.codec is not None:
+            return self.codec.dumps(message)
+        return json.dumps(message, ensure_ascii=False)
+
+    def _decode_message(self, raw):
+        if self.codec is not None:
+            return self.codec.loads(raw)
+        return json.loads(raw)
+
+    @staticmethod
+    def _score(iso_time):
+        """索引分数：last_updated 对应的时间戳，无法解析时使用当前时间"""
+        try:
+            return datetime.fromisoformat(iso_time).timestamp()
+        except (TypeError, ValueError):
+            return datetime.now().timestamp()
+
+    @classmethod
+    def _parse_cursor(cls, cursor):
+        """游标格式为 <分区>:<上一页最后一项的分数>:<上一页最后一项的对话 ID>，返回 (分区, 分数, 对话 ID)
+        第一页的分数与对话 ID 为 None；旧格式的游标没有对话 ID
+        """
+        if not cursor:
+            return cls.SECTIONS[0], None, None
+        section, _, rest = cursor.partition(':')
+        score, _, member = rest.partition(':')
+        if section not in cls.SECTIONS:
+            raise ValueError(f'无效的游标: {cursor}')
+        return section, float(score), member or None
+
+    def _touch(self, pipe, uid, cid=None):
+        """刷新过期时间"""
+        for section in self.SECTIONS:
+            pipe.expire(self._section_key(uid, section), self.ttl)
+        pipe.expire(self._changes_key(uid), self.ttl)
+        if cid is not None:
+            pipe.expire(self._meta_key(uid, cid), self.ttl)
+            pipe.expire(self._messages_key(uid, cid), self.ttl)
+
+    # ---------------- 版本号 ----------------
+    def _transaction(self, uid, build):
+        """在一个事务中执行写操作，并把用户的版本号加一
+        :param build: build(pipe, version)，向事务中添加本次写入的命令
+        :return: (新版本号, build 添加的命令的执行结果)
+        """
+        sync_key = self._sync_key(uid)
+        with self.redis.pipeline() as pipe:
+            while True:
+                try:
+                    pipe.watch(sync_key)
+                    current = pipe.hget(sync_key, 'version')
+                    pipe.multi()
+                    if current is None:
+                        # 新用户或同步状态已过期：从当前毫秒时间开始，之前的版本号都不能再增量同步
+                        version = int(time.time() * 1000)
+                        pipe.hset(sync_key, mapping={'version': version, 'floor': version})
+                    else:
+                        version = int(current) + 1
+                        pipe.hset(sync_key, 'version', version)
+                    pipe.expire(sync_key, self.ttl)
+                    build(pipe, version)
+                    return version, pipe.execute()[2:]
+                except redis.WatchError:
+                    # 同一用户的其他请求在读取版本号之后写入了，重试
+                    continue
+
+    def _mark_changed(self, pipe, uid, version, *cids):
+        pipe.zadd(self._changes_key(uid), {cid: version for cid in cids})
+
+    def version(self, uid):
+        """用户当前的版本号与增量同步的下限：(version, floor)，还没有写入过时为 (0, 0)"""
+        version, floor = self.redis.hmget(self._sync_key(uid), 'version', 'floor')
+        return int(version or 0), int(floor or 0)
+
+    def changes_since(self, uid, since):
+        """版本号 since 之后变化的对话
+        :return: (变化的对话元信息, 已删除的对话 ID)；since 早于下限或变化太多时返回 None，调用方应返回完整列表
+        """
+        version, floor = self.version(uid)
+        if not floor <= since <= version:
+            return None
+        changed = self.redis.zrangebyscore(self._changes_key(uid), f'({since}', '+inf',
+                                           start=0, num=self.MAX_DELTA_CONVERSATIONS + 1)
+        if len(changed) > self.MAX_DELTA_CONVERSATIONS:
+            return None
+        cids = [cid.decode('utf-8') for cid in changed]
+        if not cids:
+            return [], []
+        pipe = self.redis.pipeline()
+        for cid in cids:
+            pipe.hgetall(self._meta_key(uid, cid))
+            pipe.llen(self._messages_key(uid, cid))
+        results = pipe.execute()
+        metas, removed = [], []
+        for i, cid in enumerate(cids):
+            raw, length = results[2 * i], results[2 * i + 1]
+            if raw:
+                metas.append(self._decode_meta(cid, raw, length // 2))
+            else:
+                removed.append(cid)
+        return metas, removed
+
+    def conversation_version(self, uid, cid) -> int:
+        """对话最后一次变化时的版本号，没有记录时为 0"""
+        return int(self.redis.hget(self._meta_key(uid, cid), 'version') or 0)
+
+    def messages_since(self, uid, cid, since):
+        """版本号 since 之后新增的消息
+        :return: 消息列表；对话在此之后被清空、已不存在，或 Redis 中的最近消息不足以确定完整的增量时返回 None
+        """
+        pipe = self.redis.pipeline()
+        pipe.lrange(self._messages_key(uid, cid), 0, -1)
+        pipe.hmget(self._meta_key(uid, cid), 'total_messages', 'reset_version', 'created_at')
+        raw_messages, (total, reset_version, created_at) = pipe.execute()
+        if created_at is None or int(reset_version or 0) > since:
+            return None
+        history = [self._decode_message(raw) for raw in raw_messages]
+        new = [m for m in history if m.get('version', 0) > since]
+        # Redis 只保留最近 max_messages 条：全部都是新消息且更早的已被裁掉时，无法确定中间是否有遗漏
+        if history and len(new) == len(history) and int(total or 0) > len(history):
+            return None
+        return new
+
+    # ---------------- 对话 ----------------
+    def create(self, uid, name='新对话', last_message='新对话开始', cid=None):
+        """新建对话，返回对话 ID"""
+        cid = cid or str(uuid.uuid4())
+        now = datetime.now().isoformat()
+
+        def build(pipe, version):
+            pipe.zadd(self._section_key(uid, 'recent'), {cid: self._score(now)})
+            pipe.hset(self._meta_key(uid, cid), mapping={
+                'name': name, 'starred': '0', 'created_at': now,
+                'last_updated': now, 'last_message': last_message, 'version': version
+            })
+            self._mark_changed(pipe, uid, version, cid)
+            self._touch(pipe, uid, cid)
+        self._transaction(uid, build)
+        return cid
+
+    def exists(self, uid, cid):
+        return bool(cid) and bool(self.redis.exists(self._meta_key(uid, cid)))
+
+    def ids(self, uid, limit=None):
+        """按侧边栏顺序返回对话 ID，limit 为 None 时返回全部"""
+        stop = -1 if limit is None else limit - 1
+        pipe = self.redis.pipeline()
+        for section in self.SECTIONS:
+            pipe.zrevrange(self._section_key(uid, section), 0, stop)
+        ids = [cid.decode('utf-8') for part in pipe.execute() for cid in part]
+        return ids if limit is None else ids[:limit]
+
+    def count(self, uid):
+        pipe = self.redis.pipeline()
+        for section in self.SECTIONS:
+            pipe.zcard(self._section_key(uid, section))
+        return sum(pipe.execute())
+
+    def get_meta(self, uid, cid):
+        """单个对话的元信息，不存在时返回 None"""
+        pipe = self.redis.pipeline()
+        pipe.hgetall(self._meta_key(uid, cid))
+        pipe.llen(self._messages_key(uid, cid))
+        raw, length = pipe.execute()
+        if not raw:
+            return None
+        return self._decode_meta(cid, raw, length // 2)
+
+    def list_page(self, uid, limit=50, cursor=None):
+        """按侧边栏顺序（星标在前，其余按最近更新倒序）读取一页对话元信息，不读取消息内容
+
+        :param cursor: 上一页返回的游标，None 表示第一页
+        :return: (元信息列表, 下一页游标)，没有更多时游标为 None
+        """
+        section, score, member = self._parse_cursor(cursor)
+        if cursor is None:
+            self._migrate_legacy_index(uid)
+
+        # 多取一项用来判断是否还有下一页
+        page = []
+        for name in self.SECTIONS[self.SECTIONS.index(section):]:
+            rows = self._page_rows(self._section_key(uid, name), score, member, limit + 1 - len(page))
+            page += [(name, cid.decode('utf-8'), score) for cid, score in rows]
+            if len(page) > limit:
+                break
+            score = member = None
+
+        next_cursor = None
+        if len(page) > limit:
+            page = page[:limit]
+            name, cid, score = page[-1]
+            next_cursor = f'{name}:{score!r}:{cid}'
+        if not page:
+            return [], next_cursor
+
+        pipe = self.redis.pipeline()
+        for _, cid, _ in page:
+            pipe.hgetall(self._meta_key(uid, cid))
+            pipe.llen(self._messages_key(uid, cid))
+        results = pipe.execute()
+
+        metas = []
+        stale = []
+        for i, (_, cid, _) in enumerate(page):
+            raw, length = results[2 * i], results[2 * i + 1]
+            if raw:
+                metas.append(self._decode_meta(cid, raw, length // 2))
+            else:
+                stale.append(cid)
+        if stale:
+            # 对话数据已过期，顺手从索引中移除
+            self._unindex(uid, *stale)
+        return metas, next_cursor
+
+    def _page_rows(self, key, score, member, num):
+        """按分数倒序读取排在 (score, member) 之后的 num 项 [(对话 ID, 分数), ...]
+
+        同分的成员按 ID 倒序排列（与 ZREVRANGE 一致），所以与上一页最后一项同分、ID 更小的对话接在后面，
+        不会因为分数相同（同一秒内更新、迁移的旧对话）被跳过
+        """
+        if score is None:
+            return self.redis.zrevrangebyscore(key, '+inf', '-inf', start=0, num=num, withscores=True)
+        if member is None:
+            # 旧格式游标只有分数，从更低的分数继续
+            return self.redis.zrevrangebyscore(key, f'({score!r}', '-inf', start=0, num=num, withscores=True)
+        pipe = self.redis.pipeline()
+        pipe.zrevrangebyscore(key, score, score, withscores=True)
+        pipe.zrevrangebyscore(key, f'({score!r}', '-inf', start=0, num=num, withscores=True)
+        ties, lower = pipe.execute()
+        last = member.encode('utf-8')
+        return ([row for row in ties if row[0] < last] + lower)[:num]
+
+    def _unindex(self, uid, *cids):
+        pipe = self.redis.pipeline()
+        for section in self.SECTIONS:
+            pipe.zrem(self._section_key(uid, section), *cids)
+        pipe.execute()
+
+    def _migrate_legacy_index(self, uid):
+        """把旧版无序 SET 索引中的对话按元信息重建到有序索引中"""
+        legacy_key = self._legacy_index_key(uid)
+        ids = [cid.decode('utf-8') for cid in self.redis.smembers(legacy_key)]
+        if not ids:
+            return
+        pipe = self.redis.pipeline()
+        for cid in ids:
+            pipe.hmget(self._meta_key(uid, cid), 'starred', 'last_updated')
+        results = pipe.execute()
+
+        pipe = self.redis.pipeline()
+        for cid, (starred, last_updated) in zip(ids, results):
+            if last_updated is None:
+                continue
+            section = 'starred' if starred == b'1' else 'recent'
+            pipe.zadd(self._section_key(uid, section), {cid: self._score(last_updated.decode('utf-8'))})
+        pipe.delete(legacy_key)
+        self._touch(pipe, uid)
+        pipe.execute()
+
+    def get_history(self, uid, cid):
+        """对话的全部消息（最多 max_messages 条）"""
+        return [self._decode_message(raw) for raw in self.redis.lrange(self._messages_key(uid, cid), 0, -1)]
+
+    def get_context(self, uid, cid):
+        """对话上下文：存储中的消息，以及打包历史所需的序号和缓存的摘要
+
+        :return: {'history', 'offset': history[0] 在整个对话中的序号, 'summary', 'summary_upto'}
+        """
+        pipe = self.redis.pipeline()
+        pipe.lrange(self._messages_key(uid, cid), 0, -1)
+        pipe.hmget(self._meta_key(uid, cid), 'total_messages', 'summary', 'summary_upto')
+        raw_messages, (total, summary, summary_upto) = pipe.execute()
+        history = [self._decode_message(raw) for raw in raw_messages]
+        total = int(total) if total is not None else len(history)
+        return {
+            'history': history,
+            'offset': max(0, total - len(history)),
+            'summary': summary.decode('utf-8') if summary else '',
+            'summary_upto': int(summary_upto or 0)
+        }
+
+    def set_summary(self, uid, cid, summary, summary_upto):
+        """缓存滚动摘要"""
+        pipe = self.redis.pipeline()
+        pipe.hset(self._meta_key(uid, cid), mapping={'summary': summary, 'summary_upto': summary_upto})
+        self._touch(pipe, uid, cid)
+        pipe.execute()
+
+    def append_turn(self, uid, cid, user_msg, ai_msg, meta):
+        """追加一问一答并更新元信息（一次事务完成），返回新的版本号
+        :param meta: 需要更新的元信息字段
+        """
+        messages_key = self._messages_key(uid, cid)
+        meta_key = self._meta_key(uid, cid)
+        score = self._score(meta.setdefault('last_updated', datetime.now().isoformat()))
+
+        def build(pipe, version):
+            user_msg['version'] = ai_msg['version'] = version
+            # 只更新对话已在的那个分区（XX），不需要先查询星标状态
+            for section in self.SECTIONS:
+                pipe.zadd(self._section_key(uid, section), {cid: score}, xx=True, ch=True)
+            pipe.rpush(messages_key, self._encode_message(user_msg), self._encode_message(ai_msg))
+            pipe.ltrim(messages_key, -self.max_messages, -1)
+            pipe.hset(meta_key, mapping={**meta, 'version': version})
+            pipe.hincrby(meta_key, 'total_messages', 2)
+            # 对话在等待回复期间过期时补齐必需字段
+            pipe.hsetnx(meta_key, 'starred', '0')
+            pipe.hsetnx(meta_key, 'created_at', meta['last_updated'])
+            self._mark_changed(pipe, uid, version, cid)
+            self._touch(pipe, uid, cid)
+        version, results = self._transaction(uid, build)
+
+        if not any(results[:len(self.SECTIONS)]) and self.redis.zscore(self._section_key(uid, 'starred'), cid) is None:
+            # 对话不在索引中（已过期或已被删除后重建），放回普通分区
+            pipe = self.redis.pipeline()
+            pipe.zadd(self._section_key(uid, 'recent'), {cid: score})
+            self._touch(pipe, uid)
+            pipe.execute()
+
+        self._archive(self.archive and self._archive_turn, uid, cid, [user_msg, ai_msg])
+        return version
+
+    def clear_history(self, uid, cid):
+        now = datetime.now().isoformat()
+
+        def build(pipe, version):
+            pipe.delete(self._messages_key(uid, cid))
+            # reset_version：早于它的消息增量已失效
+            pipe.hset(self._meta_key(uid, cid), mapping={'last_message': '对话已清空', 'last_updated': now,
+                                                         'total_messages': 0, 'version': version,
+                                                         'reset_version': version})
+            pipe.hdel(self._meta_key(uid, cid), 'summary', 'summary_upto')
+            for section in self.SECTIONS:
+                pipe.zadd(self._section_key(uid, section), {cid: self._score(now)}, xx=True)
+            self._mark_changed(pipe, uid, version, cid)
+            self._touch(pipe, uid, cid)
+        self._transaction(uid, build)
+        self._archive(self.archive and self.archive.delete, uid, cid)
+
+    def toggle_star(self, uid, cid):
+        """切换星标，返回切换后的状态；对话不存在时返回 None"""
+        meta_key = self._meta_key(uid, cid)
+        current = self.redis.hget(meta_key, 'starred')
+        if current is None:
+            return None
+        starred = current != b'1'
+        now = datetime.now().isoformat()
+        source, target = ('recent', 'starred') if starred else ('starred', 'recent')
+
+        def build(pipe, version):
+            pipe.hset(meta_key, mapping={'starred': '1' if starred else '0', 'last_updated': now, 'version': version})
+            pipe.zrem(self._section_key(uid, source), cid)
+            pipe.zadd(self._section_key(uid, target), {cid: self._score(now)})
+            self._mark_changed(pipe, uid, version, cid)
+            self._touch(pipe, uid, cid)
+        self._transaction(uid, build)
+        return starred
+
+    def delete(self, uid, cid):
+        def build(pipe, version):
+            for section in self.SECTIONS:
+                pipe.zrem(self._section_key(uid, section), cid)
+            pipe.delete(self._meta_key(uid, cid), self._messages_key(uid, cid))
+            # changes 中保留已删除的对话，增量同步时报告为已删除
+            self._mark_changed(pipe, uid, version, cid)
+            self._touch(pipe, uid)
+        self._transaction(uid, build)
+        self._archive(self.archive and self.archive.delete, uid, cid)
+
+    def delete_all(self, uid):
+        ids = self.ids(uid)
+        keys = [self._section_key(uid, section) for section in self.SECTIONS] + [self._legacy_index_key(uid),
+                                                                                 self._changes_key(uid)]
+        for cid in ids:
+            keys += [self._meta_key(uid, cid), self._messages_key(uid, cid)]
+
+        def build(pipe, version):
+            pipe.delete(*keys)
+            # 不再记录逐个对话的变化，之前的版本只能完整同步
+            pipe.hset(self._sync_key(uid), 'floor', version)
+        self._transaction(uid, build)
+        self._archive(self.archive and self.archive.delete_all, uid)
+
+    def import_conversations(self, uid, conversations):
+        """把旧版 Session 中整块保存的 conversations 字典迁移到独立的键中"""
+        def build(pipe, version):
+            for cid, conv in conversations.items():
+                last_updated = conv.get('last_updated') or datetime.now().isoformat()
+                section = 'starred' if conv.get('starred') else 'recent'
+                pipe.zadd(self._section_key(uid, section), {cid: self._score(last_updated)})
+                pipe.hset(self._meta_key(uid, cid), mapping={
+                    'name': conv.get('name', '未命名'),
+                    'starred': '1' if conv.get('starred') else '0',
+                    'created_at': conv.get('created_at') or datetime.now().isoformat(),
+                    'last_updated': last_updated,
+                    'last_message': conv.get('last_message', ''),
+                    'total_messages': len(conv.get('history', [])),
+                    'version': version
+                })
+                messages_key = self._messages_key(uid, cid)
+                pipe.delete(messages_key)
+                history = conv.get('history', [])[-self.max_messages:]
+                if history:
+                    pipe.rpush(messages_key, *[self._encode_message(m) for m in history])
+                self._mark_changed(pipe, uid, version, cid)
+                self._touch(pipe, uid, cid)
+        if conversations:
+            self._transaction(uid, build)
+
+    # ---------------- 归档 ----------------
+    def history_page(self, uid, cid, before=None, limit=20):
+        """分页读取对话消息（按时间正序），before 为上一页返回的游标
+        :return: (消息列表, 更早一页的游标)；没有更早的消息时游标为 None
+        不启用归档时一次返回 Redis 中的全部消息
+        """
+        if self.archive is None:
+            return self.get_history(uid, cid), None
+        try:
+            if before is None and not self.archive.has(uid, cid):
+                # 启用归档之前就有的对话：先把 Redis 中现有的消息补进归档
+                history = self.get_history(uid, cid)
+                if not history:
+                    return [], None
+                self.archive.append(uid, cid, history)
+            return self.archive.page(uid, cid, before, limit)
+        except sqlite3.Error as e:
+            logger.warning("[归档] 读取失败，改用 Redis 中的最近消息: %s", e)
+            return ([], None) if before is not None else (self.get_history(uid, cid), None)
+
+    def _archive_turn(self, uid, cid, messages):
+        if self.archive.has(uid, cid):
+            self.archive.append(uid, cid, messages)
+        else:
+            # 归档中还没有这个对话：Redis 中的消息（已包含本轮）整体补进去；
+            # 和 history_page 的补写并发时，已写入的消息按 (版本号, 角色) 去重
+            self.archive.append(uid, cid, self.get_history(uid, cid))
+
+    @staticmethod
+    def _archive(func, *args):
+        """写归档失败只记录日志，不影响 Redis 中的对话"""
+        if not func:
+            return
+        try:
+            func(*args)
+        except sqlite3.Error as e:
+            logger.warning("[归档] 写入失败: %s", e)
@@ -1,318 +1,714 @@
 """
 修改后的美食机器人核心代码 - 适配Web版本 (增强网络稳定性 & 支持历史记忆 & 格式化回复)
 """
-import requests
+import asyncio
 import json
+import logging
+import time
+
+import requests
+import httpx
+
+from qianfan_transport import QianfanTransport, AsyncQianfanTransport
+from response_cache import ResponseCache
+from reply_formatter import format_reply, StreamingReplyFormatter
+from single_flight import SingleFlight, AsyncSingleFlight, FlightError
+from context_packer import ContextPacker
+from model_router import ModelRouter, HedgeCancelled
+from knowledge_index import KnowledgeIndex
+from telemetry import (configure_logging, stage, observe_stage, UPSTREAM_RESPONSES, UPSTREAM_TIMEOUTS,
+                       FALLBACK_REPLIES, KNOWLEDGE_LOOKUPS)
+
+logger = logging.getLogger(__name__)
+
+
+class FallbackReply(str):
+    """兜底提示语：与普通回复一样是字符串，另外带上原因，供批量模式等区分真正的回答"""
+
+    def __new__(cls, text: str, reason: str):
+        reply = super().__new__(cls, text)
+        reply.reason = reason
+        return reply
+
+
+def _fallback(reason: str, reply: str) -> str:
+    """记录一次兜底提示语（超时、连接失败等），返回提示语本身"""
+    FALLBACK_REPLIES.inc(reason=reason)
+    return FallbackReply(reply, reason)
 
 
 class SimpleFoodBot:
-    def __init__(self, api_key: str):
+    # 构建系统提示词（增强版：要求格式化的回复）
+    SYSTEM_PROMPT = """你是"食探"，一个专业的美食推荐专家。你精通中国各地菜系、餐厅推荐、美食文化和饮食搭配。
+
+请遵循以下原则：
+1. 专注于美食相关内容
+2. 提供实用的餐厅或菜品推荐
+3. 考虑用户的预算、口味偏好和地点
+4. 回答要热情、专业、实用，并且格式化输出
+5. 如果用户询问非美食内容，礼貌地引导回美食话题
+
+格式化要求：
+- 使用清晰的段落分隔
+- 使用项目符号（•）或编号列表
+- 适当使用空行分隔不同部分
+- 突出重要信息如价格、地点、特色
+- 对餐厅推荐使用"**"加粗突出
+
+请开始你的美食推荐："""
+
+    # 本地知识库的资料附在系统提示词后面的标题
+    GROUNDING_HEADER = "【参考资料】以下资料来自本地美食知识库，涉及其中的菜品、菜系或城市时以资料为准："
+
+    def __init__(self, api_key: str, transport: QianfanTransport = None, cache: ResponseCache = None,
+                 flight: SingleFlight = None, packer: ContextPacker = None, router: ModelRouter = None,
+                 knowledge: KnowledgeIndex = None, check_connection: bool = True):
         """
         初始化机器人
         :param api_key: 百度千帆的API Key
+        :param transport: 复用的千帆传输层，默认按环境变量配置新建一个
+        :param cache: 回复缓存，默认不缓存
+        :param flight: 请求合并层，相同请求并发时只调用一次千帆；默认不合并
+        :param packer: 上下文打包器，按 token 预算挑选历史，默认按环境变量配置
+        :param router: 模型路由（选择模型、对冲慢请求），默认按环境变量配置
+        :param knowledge: 本地知识库，能直接作答的问题不调用千帆，其余问题附上相关资料；默认不使用
+        :param check_connection: 为 False 时构造时不测试连接（由调用方在后台用 ping() 探测）
         """
         self.api_key = api_key
+        self.transport = transport or QianfanTransport.from_env(api_key)
+        self.cache = cache
+        self.flight = flight
+        self.packer = packer or ContextPacker.from_env()
+        self.router = router or ModelRouter.from_env()
+        self.knowledge = knowledge
+        if not check_connection:
+            return
         
         # 测试API连接
         if self._test_connection():
-            print("✓ API连接成功！机器人初始化完成。")
+            logger.info("✓ API连接成功！机器人初始化完成。")
         else:
-            print("✗ API连接失败，请检查API Key和网络。")
+            logger.error("✗ API连接失败，请检查API Key和网络。")
             raise ConnectionError("API连接失败")
 
+    def ping(self) -> bool:
+        """探测千帆是否可用（供健康检查使用）"""
+        return self._test_connection()
+
+    def lookup_knowledge(self, user_input: str):
+        """查询本地知识库，没有知识库时返回 None
+        结果可以传给 ask / ask_stream 的 lookup 参数，避免同一个问题查询两次
+        """
+        if self.knowledge is None or not user_input.strip():
+            return None
+        with stage('knowledge'):
+            result = self.knowledge.lookup(user_input)
+        KNOWLEDGE_LOOKUPS.inc(outcome=result.outcome)
+        return result
+
     def _test_connection(self) -> bool:
         """测试API连接是否正常"""
         try:
-            # 测试时也强制不使用代理，保持环境一致
-            proxies = {"http": None, "https": None}
-            response = requests.post(
-                "https://qianfan.baidubce.com/v2/chat/completions",
-                headers={
-                    "Content-Type": "application/json",
-                    "Authorization": f"Bearer {self.api_key}"
-                },
-                json={
-                    "model": "ernie-3.5-8k",
+            # 与正式请求共用同一个连接池，测试成功后连接会被保留复用
+            response = self.transport.post(
+                {
+                    "model": self.router.primary,
                     "messages": [{"role": "user", "content": "你好"}],
-                    "max_tokens": 50
+                    "max_tokens": 2  # 只确认鉴权与服务可用，尽量少消耗 token
                 },
-                timeout=10,
-                proxies=proxies  # 新增
+                read_timeout=10
             )
             return response.status_code == 200
         except Exception as e:
-            print(f"[测试连接异常] {e}")
+            logger.warning("[测试连接异常] %s", e)
             return False
 
-    def ask(self, user_input: str, conversation_history=None) -> str:
+    def ask(self, user_input: str, conversation_history=None, use_cache: bool = True, summary: str = None,
+            lookup=None) -> str:
         """主对话方法 - Web版专用 (增强稳定性版 & 支持历史记忆 & 格式化回复)
         :param user_input: 用户当前输入
         :param conversation_history: 格式为 [{'role':'user','content':'...'}, {'role':'assistant','content':'...'}, ...] 的列表
+        :param use_cache: 为 False 时跳过回复缓存，强制请求千帆
+        :param summary: 更早对话的摘要（见 prepare_context），附在系统提示词后面
+        :param lookup: 调用方已经做过的知识库查询（lookup_knowledge 的结果），默认在这里查询
         """
         if not user_input.strip():
             return "请输入您想了解的美食问题哦~"
+
+        # 知识库有把握的事实问题直接作答，不调用千帆
+        lookup = lookup or self.lookup_knowledge(user_input)
+        if lookup and lookup.answer:
+            return lookup.answer
         
-        # 准备请求数据
-        url = "https://qianfan.baidubce.com/v2/chat/completions"
+        # 准备请求数据（包含系统提示、历史对话、知识库资料和当前输入）
+        data = self._build_payload(user_input, conversation_history, summary=summary,
+                                   grounding=lookup and lookup.snippets)
         
-        headers = {
-            "Content-Type": "application/json",
-            "Authorization": f"Bearer {self.api_key}"
-        }
+        logger.debug("[API请求] 本次消息列表共 %d 条，历史轮数: %d", len(data['messages']),
+                     len(conversation_history) // 2 if conversation_history else 0)
+        
+        # 命中缓存时直接返回已格式化的回复，跳过千帆调用和格式化
+        cache_key = self._cache_lookup_key(data, use_cache)
+        if cache_key:
+            cached = self.cache.get(cache_key)
+            if cached is not None:
+                logger.debug("[API请求] 命中回复缓存")
+                return cached
         
-        # 构建系统提示词（增强版：要求格式化的回复）
-        system_prompt = """你是"食探"，一个专业的美食推荐专家。你精通中国各地菜系、餐厅推荐、美食文化和饮食搭配。
+        try:
+            ai_reply = self._complete(data)
+            logger.debug("[API响应] 成功获取回复，长度: %d", len(ai_reply))
+            
+            # 对AI回复进行格式化处理
+            with stage('format'):
+                formatted_reply = self._format_reply(ai_reply, user_input)
+            if cache_key:
+                self.cache.set(cache_key, formatted_reply)
+            return formatted_reply
+            
+        except requests.exceptions.Timeout:
+            logger.warning("[API错误] 请求超时")
+            return _fallback('timeout', "抱歉，与AI服务的连接超时了，可能是网络较慢或服务繁忙，请稍后再试。")
+        except requests.exceptions.ProxyError as e:
+            logger.warning("[API错误] 代理设置错误: %s", e)
+            return _fallback('proxy', "网络代理配置异常，请检查本地网络设置或联系管理员。")
+        except requests.exceptions.ConnectionError as e:
+            logger.warning("[API错误] 连接错误: %s", e)
+            return _fallback('connection', "无法连接到AI服务，请检查您的网络连接是否正常。")
+        except requests.exceptions.RequestException as e:
+            logger.warning("[API错误] 网络请求异常: %s", e)
+            return _fallback('http_error', f"网络请求出错：{str(e)[:100]}")
+        except (KeyError, json.JSONDecodeError) as e:
+            logger.warning("[API错误] 解析响应失败: %s", e)
+            return _fallback('parse_error', "处理AI响应时出错，请重试。")
+        except FlightError as e:
+            logger.warning("[API错误] 等待相同请求失败: %s", e)
+            return _fallback('flight', "抱歉，与AI服务的连接超时了，可能是网络较慢或服务繁忙，请稍后再试。")
+        except Exception:
+            logger.exception("[API错误] 未预期的异常")
+            return _fallback('internal', "系统内部错误，请稍后再试。")
 
-请遵循以下原则：
-1. 专注于美食相关内容
-2. 提供实用的餐厅或菜品推荐
-3. 考虑用户的预算、口味偏好和地点
-4. 回答要热情、专业、实用，并且格式化输出
-5. 如果用户询问非美食内容，礼貌地引导回美食话题
+    def ask_stream(self, user_input: str, conversation_history=None, use_cache: bool = True, summary: str = None,
+                   lookup=None):
+        """流式对话方法 - 逐块返回千帆的生成结果
+        :param user_input: 用户当前输入
+        :param conversation_history: 与 ask() 相同格式的历史列表
+        :param use_cache: 为 False 时跳过回复缓存；命中缓存时只产出一个 done 事件
+        :param summary: 与 ask() 相同
+        :param lookup: 与 ask() 相同；知识库直接作答时只产出一个 done 事件
+        :return: 生成器，依次产出事件字典：
+                 {'type': 'delta', 'content': '...'}  增量文本（未格式化）
+                 {'type': 'done', 'reply': '...'}     完整回复（已格式化）
+                 {'type': 'error', 'reply': '...'}    出错时的提示语
+        """
+        if not user_input.strip():
+            yield {"type": "error", "reply": "请输入您想了解的美食问题哦~"}
+            return
 
-格式化要求：
-- 使用清晰的段落分隔
-- 使用项目符号（•）或编号列表
-- 适当使用空行分隔不同部分
-- 突出重要信息如价格、地点、特色
-- 对餐厅推荐使用"**"加粗突出
+        lookup = lookup or self.lookup_knowledge(user_input)
+        if lookup and lookup.answer:
+            yield {"type": "done", "reply": lookup.answer}
+            return
 
-请开始你的美食推荐："""
+        data = self._build_payload(user_input, conversation_history, stream=True, summary=summary,
+                                   grounding=lookup and lookup.snippets)
+
+        cache_key = self._cache_lookup_key(data, use_cache)
+        if cache_key:
+            cached = self.cache.get(cache_key)
+            if cached is not None:
+                logger.debug("[API请求] 命中回复缓存")
+                yield {"type": "done", "reply": cached}
+                return
+
+        # 边接收边格式化，生成结束时格式化结果也基本就绪
+        formatter = StreamingReplyFormatter(user_input)
+        formatted_parts = []
+        reply_length = 0
+        format_seconds = 0.0
+        try:
+            for delta in self._stream_completion(data):
+                start = time.perf_counter()
+                formatted_parts.append(formatter.feed(delta))
+                format_seconds += time.perf_counter() - start
+                reply_length += len(delta)
+                yield {"type": "delta", "content": delta}
+
+            logger.debug("[API响应] 流式回复结束，长度: %d", reply_length)
+            start = time.perf_counter()
+            formatted_parts.append(formatter.finish())
+            formatted_reply = "".join(formatted_parts)
+            observe_stage('format', format_seconds + time.perf_counter() - start)
+            if cache_key:
+                self.cache.set(cache_key, formatted_reply)
+            yield {"type": "done", "reply": formatted_reply}
+
+        except requests.exceptions.Timeout:
+            logger.warning("[API错误] 流式请求超时")
+            yield {"type": "error", "reply": _fallback(
+                'timeout', "抱歉，与AI服务的连接超时了，可能是网络较慢或服务繁忙，请稍后再试。")}
+        except requests.exceptions.ConnectionError as e:
+            logger.warning("[API错误] 连接错误: %s", e)
+            yield {"type": "error", "reply": _fallback('connection', "无法连接到AI服务，请检查您的网络连接是否正常。")}
+        except requests.exceptions.RequestException as e:
+            logger.warning("[API错误] 网络请求异常: %s", e)
+            yield {"type": "error", "reply": _fallback('http_error', f"网络请求出错：{str(e)[:100]}")}
+        except (KeyError, IndexError, json.JSONDecodeError) as e:
+            logger.warning("[API错误] 解析流式响应失败: %s", e)
+            yield {"type": "error", "reply": _fallback('parse_error', "处理AI响应时出错，请重试。")}
+        except FlightError as e:
+            logger.warning("[API错误] 等待相同请求失败: %s", e)
+            yield {"type": "error", "reply": _fallback(
+                'flight', "抱歉，与AI服务的连接超时了，可能是网络较慢或服务繁忙，请稍后再试。")}
+        except Exception:
+            logger.exception("[API错误] 未预期的异常")
+            yield {"type": "error", "reply": _fallback('internal', "系统内部错误，请稍后再试。")}
+
+    def _complete(self, data: dict) -> str:
+        """调用千帆并返回原始回复；相同请求并发时经请求合并层只调用一次，慢请求由模型路由对冲"""
+        if self.flight is None:
+            return self.router.call(data, self._request_completion)
+        return self.flight.do(self.flight.make_key(data), lambda: self.router.call(data, self._request_completion))
+
+    def _request_completion(self, data: dict, cancel=None) -> str:
+        """非流式调用千帆
+        :param cancel: 对冲时由模型路由传入的 CancelToken；输掉后传输层立即断开连接，本方法抛出 HedgeCancelled
+        """
+        # 传输层负责连接复用、忽略系统代理以及 429/5xx 的退避重试
+        start = time.perf_counter()
+        try:
+            response = self.transport.post(data, cancel=cancel)
+        except requests.exceptions.RequestException as e:
+            if cancel is not None and cancel.is_set():
+                raise HedgeCancelled(data['model']) from e
+            if isinstance(e, requests.exceptions.Timeout):
+                UPSTREAM_TIMEOUTS.inc()
+            raise
+        if cancel is not None and cancel.is_set():
+            raise HedgeCancelled(data['model'])
+        # elapsed 是发出请求到解析完响应头的时间，响应体在这之后才读取
+        observe_stage('upstream_connect', response.elapsed.total_seconds())
+        observe_stage('upstream_total', time.perf_counter() - start)
+        UPSTREAM_RESPONSES.inc(status=response.status_code)
+        logger.debug("[API响应] 状态码: %d", response.status_code)
         
-        # ============ 关键：构建包含历史的消息列表 ============
+        response.raise_for_status()
+        try:
+            return response.json()["choices"][0]["message"]["content"]
+        except (KeyError, json.JSONDecodeError):
+            logger.warning("[API错误] 响应文本: %s", response.text[:500])
+            raise
+
+    def _stream_completion(self, data: dict):
+        """逐块产出千帆的增量文本；相同请求并发时共享同一个上游流"""
+        if self.flight is None:
+            return self._request_stream(data)
+        return self.flight.stream(self.flight.make_key(data), lambda: self._request_stream(data))
+
+    def _request_stream(self, data: dict):
+        # 流式时读超时表示两块数据之间的最大间隔
+        start = time.perf_counter()
+        try:
+            response = self.transport.post(data, stream=True)
+        except requests.exceptions.Timeout:
+            UPSTREAM_TIMEOUTS.inc()
+            raise
+        with response:
+            observe_stage('upstream_connect', time.perf_counter() - start)
+            UPSTREAM_RESPONSES.inc(status=response.status_code)
+            logger.debug("[API响应] 状态码: %d", response.status_code)
+            response.raise_for_status()
+            # 千帆的 SSE 响应不带 charset，requests 会误判为 ISO-8859-1
+            response.encoding = "utf-8"
+
+            first = True
+            try:
+                for line in response.iter_lines(decode_unicode=True):
+                    delta = self._parse_stream_line(line)
+                    if delta is None:
+                        break
+                    if delta:
+                        if first:
+                            observe_stage('upstream_first_token', time.perf_counter() - start)
+                            first = False
+                        yield delta
+            except requests.exceptions.ConnectionError as e:
+                # 读取过程中的读超时由 urllib3 包装成 ConnectionError 抛出
+                if 'timed out' in str(e).lower():
+                    UPSTREAM_TIMEOUTS.inc()
+                raise
+            observe_stage('upstream_total', time.perf_counter() - start)
+
+    def prepare_context(self, user_input: str, history: list, offset: int = 0,
+                        summary: str = '', summary_upto: int = 0):
+        """按 token 预算打包历史；被挤出预算且尚未进入摘要的旧消息折叠进滚动摘要
+        :param history: 存储中的历史消息
+        :param offset: history[0] 在整个对话中的序号（更早的消息已从存储中裁掉）
+        :param summary: 已缓存的摘要
+        :param summary_upto: 摘要覆盖到的消息序号（不含）
+        :return: (要发送的历史, 摘要, 摘要覆盖到的序号)；摘要有更新时序号变大，调用方应写回缓存
+        """
+        base, start = self._plan_context(user_input, history, offset, summary, summary_upto)
+        if start > base:
+            new_summary = self._summarize(summary, history[base:start])
+            if new_summary:
+                return history[start:], new_summary, offset + start
+            # 摘要生成失败：不折叠，只按预算截断
+            start = base + self.packer.fit(self.SYSTEM_PROMPT, history[base:], user_input, summary)
+        return history[start:], summary, summary_upto
+
+    def _plan_context(self, user_input, history, offset, summary, summary_upto):
+        """返回 (可用历史的起点, 保留历史的起点)，两者之间的消息需要折叠进摘要"""
+        # 已经进入摘要的消息不再参与打包
+        base = min(max(0, summary_upto - offset), len(history))
+        start = base + self.packer.plan(self.SYSTEM_PROMPT, history[base:], user_input, summary)
+        return base, start
+
+    def _summarize(self, summary: str, messages: list):
+        """把旧摘要和新挤出的消息压缩成新摘要，失败时返回 None"""
+        try:
+            logger.info("[上下文] 折叠 %d 条旧消息进摘要", len(messages))
+            payload = self.packer.summary_payload(summary, messages, self.router.summary_model)
+            return self.router.call(payload, self._request_completion).strip()
+        except Exception as e:
+            logger.warning("[上下文] 生成摘要失败: %s", e)
+            return None
+
+    def _build_payload(self, user_input: str, conversation_history=None, stream: bool = False,
+                       summary: str = None, grounding: list = None) -> dict:
+        """构建对话补全接口的请求体"""
+        data = {
+            "model": self.router.choose(user_input),
+            "messages": self._build_messages(user_input, conversation_history, summary, grounding),
+            "max_tokens": self.router.max_tokens,
+            "temperature": 0.7
+        }
+        if stream:
+            data["stream"] = True
+        return data
+
+    def _cache_lookup_key(self, payload: dict, use_cache: bool):
+        """需要走缓存时返回缓存键，否则返回 None"""
+        if not use_cache or self.cache is None or not self.cache.enabled:
+            return None
+        return self.cache.make_key(payload)
+
+    @staticmethod
+    def _parse_stream_line(line: str):
+        """解析千帆 SSE 响应中的一行，返回增量文本；遇到结束标记 [DONE] 时返回 None"""
+        if not line or not line.startswith("data:"):
+            return ""
+        payload = line[5:].strip()
+        if payload == "[DONE]":
+            return None
+
+        result = json.loads(payload)
+        if "error" in result:
+            raise KeyError(result["error"].get("message", "error"))
+        return result["choices"][0].get("delta", {}).get("content") or ""
+
+    def _build_messages(self, user_input: str, conversation_history=None, summary: str = None,
+                        grounding: list = None) -> list:
+        """构建包含系统提示、历史对话和当前输入的消息列表"""
+        system_prompt = self.SYSTEM_PROMPT
+        if grounding:
+            system_prompt += f"\n\n{self.GROUNDING_HEADER}\n" + "\n".join(f"• {s}" for s in grounding)
+        if summary:
+            system_prompt += f"\n\n【之前的对话摘要】\n{summary}"
         messages = [{"role": "system", "content": system_prompt}]
-        
+
         # 1. 如果有历史对话，先添加历史（注意格式转换）
         if conversation_history:
-            # 只取最近的8轮历史（16条消息），避免超出token限制
-            for msg in conversation_history[-16:]:
+            # 按 token 预算从最新一轮往前保留，避免超出输入上限
+            start = self.packer.fit(system_prompt, conversation_history, user_input)
+            for msg in conversation_history[start:]:
                 # 确保历史消息的格式符合API要求，只保留 role 和 content
                 # 注意：历史记录中可能有'timestamp'字段，我们需要过滤掉
                 messages.append({"role": msg["role"], "content": msg["content"]})
-        
+
         # 2. 最后添加当前用户输入
         messages.append({"role": "user", "content": user_input})
-        
-        # 调试信息：查看发送的消息结构
-        print(f"[API请求] 本次消息列表共 {len(messages)} 条")
-        print(f"[API请求] 历史轮数: {len(conversation_history)//2 if conversation_history else 0}")
-        
-        data = {
-            "model": "ernie-3.5-8k",
-            "messages": messages,  # 现在这里包含了系统提示、历史对话和当前输入
-            "max_tokens": 1024,
-            "temperature": 0.7
-        }
-        
+        return messages
+
+    def _format_reply(self, reply: str, user_input: str) -> str:
+        """格式化AI回复，使其更易读（单趟格式化引擎，见 reply_formatter）"""
+        return format_reply(reply, user_input)
+
+
+class AsyncFoodBot(SimpleFoodBot):
+    """SimpleFoodBot 的 asyncio 版本 - 供 ASGI 服务使用
+
+    ask / ask_stream 的参数、历史格式、返回内容与同步版完全一致，只是需要 await；
+    等待千帆生成期间不占用线程。构造函数不发网络请求，需要测试连接时使用 create()。
+    """
+
+    def __init__(self, api_key: str, transport: AsyncQianfanTransport = None, flight: AsyncSingleFlight = None,
+                 packer: ContextPacker = None, router: ModelRouter = None, knowledge: KnowledgeIndex = None,
+                 cache: ResponseCache = None):
+        """
+        :param api_key: 百度千帆的API Key
+        :param transport: 复用的异步传输层，默认按环境变量配置新建一个
+        :param flight: 进程内请求合并层（只用于非流式的 ask），默认不合并
+        :param packer: 上下文打包器，默认按环境变量配置
+        :param router: 模型路由，默认按环境变量配置；可与同步版共用一个实例以共享延迟统计
+        :param knowledge: 本地知识库，与同步版相同；查询是纯内存计算，直接在事件循环中执行
+        :param cache: 回复缓存，可与同步版共用一个实例；它基于同步 Redis 客户端，读写放到线程中执行，
+                      不阻塞事件循环。默认不缓存
+        """
+        self.api_key = api_key
+        self.transport = transport or AsyncQianfanTransport.from_env(api_key)
+        self.cache = cache
+        self.flight = flight
+        self.packer = packer or ContextPacker.from_env()
+        self.router = router or ModelRouter.from_env()
+        self.knowledge = knowledge
+
+    @classmethod
+    async def create(cls, api_key: str, **kwargs) -> "AsyncFoodBot":
+        """创建机器人并测试API连接，失败时与同步版一样抛出 ConnectionError；其余参数与构造函数相同"""
+        bot = cls(api_key, **kwargs)
+        if await bot._test_connection():
+            logger.info("✓ API连接成功！异步机器人初始化完成。")
+            return bot
+        logger.error("✗ API连接失败，请检查API Key和网络。")
+        await bot.aclose()
+        raise ConnectionError("API连接失败")
+
+    async def ping(self) -> bool:
+        """探测千帆是否可用（同步版 ping 的异步版本）"""
+        return await self._test_connection()
+
+    async def _test_connection(self) -> bool:
+        """测试API连接是否正常"""
         try:
-            # ============ 关键修复：强制忽略系统代理 ============
-            proxies = {"http": None, "https": None}
-            
-            # 调试信息（发送请求时打印）
-            print(f"[API请求] 发送请求，内容长度: {len(user_input)}")
-            
-            response = requests.post(
-                url, 
-                headers=headers, 
-                json=data, 
-                timeout=60,          # 总超时时间已足够
-                proxies=proxies      # 核心修复：避免被系统代理阻塞
+            response = await self.transport.post(
+                {
+                    "model": self.router.primary,
+                    "messages": [{"role": "user", "content": "你好"}],
+                    "max_tokens": 2  # 只确认鉴权与服务可用，尽量少消耗 token
+                },
+                read_timeout=10
             )
-            
-            # 调试信息（收到响应时打印）
-            print(f"[API响应] 状态码: {response.status_code}")
-            
-            response.raise_for_status()
-            result = response.json()
-            
-            ai_reply = result["choices"][0]["message"]["content"]
-            print(f"[API响应] 成功获取回复，长度: {len(ai_reply)}")
-            
-            # 对AI回复进行格式化处理
-            formatted_reply = self._format_reply(ai_reply, user_input)
-            return formatted_reply
-            
-        except requests.exceptions.Timeout:
-            print("[API错误] 请求超时")
-            return "抱歉，与AI服务的连接超时了，可能是网络较慢或服务繁忙，请稍后再试。"
-        except requests.exceptions.ProxyError as e:
-            print(f"[API错误] 代理设置错误: {e}")
-            return "网络代理配置异常，请检查本地网络设置或联系管理员。"
-        except requests.exceptions.ConnectionError as e:
-            print(f"[API错误] 连接错误: {e}")
-            return "无法连接到AI服务，请检查您的网络连接是否正常。"
-        except requests.exceptions.RequestException as e:
-            print(f"[API错误] 网络请求异常: {e}")
-            return f"网络请求出错：{str(e)[:100]}"
-        except (KeyError, json.JSONDecodeError) as e:
-            print(f"[API错误] 解析响应失败: {e}")
-            print(f"[API错误] 响应文本: {response.text[:500] if 'response' in locals() else '无响应'}")
-            return f"处理AI响应时出错，请重试。"
+            return response.status_code == 200
         except Exception as e:
-            print(f"[API错误] 未预期的异常: {e}")
-            return "系统内部错误，请稍后再试。"
+            logger.warning("[测试连接异常] %s", e)
+            return False
 
-    def _format_reply(self, reply: str, user_input: str) -> str:
-        """格式化AI回复，使其更易读"""
-        if not reply:
-            return reply
-        
-        # 1. 确保回复包含适当的换行
-        formatted = reply
-        
-        # 2. 根据用户输入的关键词进行特殊格式化
-        user_input_lower = user_input.lower()
-        
-        # 如果用户询问价格预算，特别格式化价格信息
-        if any(keyword in user_input_lower for keyword in ['价格', '预算', '多少钱', '人均', '消费']):
-            formatted = self._format_price_info(formatted)
-        
-        # 3. 确保列表项有适当的格式
-        formatted = self._format_list_items(formatted)
-        
-        # 4. 确保段落之间有适当的间距
-        formatted = self._format_paragraphs(formatted)
-        
-        # 5. 处理常见的Markdown格式
-        formatted = self._format_markdown(formatted)
-        
-        return formatted
-    
-    def _format_price_info(self, text: str) -> str:
-        """格式化价格信息"""
-        lines = text.split('\n')
-        formatted_lines = []
-        
-        for line in lines:
-            # 查找并格式化价格信息
-            import re
-            # 匹配人民币符号和数字
-            price_patterns = [
-                r'(\d+)\s*元',
-                r'¥\s*(\d+)',
-                r'RMB\s*(\d+)',
-                r'人均\s*(\d+)',
-                r'预算\s*(\d+)'
-            ]
-            
-            for pattern in price_patterns:
-                matches = re.finditer(pattern, line)
-                for match in matches:
-                    # 在价格信息前后添加强调标记
-                    price_text = match.group(0)
-                    line = line.replace(price_text, f"**{price_text}**")
-            
-            formatted_lines.append(line)
-        
-        return '\n'.join(formatted_lines)
-    
-    def _format_list_items(self, text: str) -> str:
-        """格式化列表项"""
-        lines = text.split('\n')
-        formatted_lines = []
-        
-        for i, line in enumerate(lines):
-            stripped = line.strip()
-            
-            # 检查是否是列表项
-            if (stripped.startswith('•') or 
-                stripped.startswith('-') or 
-                stripped.startswith('*') or
-                stripped.startswith('1.') or
-                stripped.startswith('2.') or
-                stripped.startswith('3.') or
-                stripped.startswith('4.') or
-                stripped.startswith('5.')):
-                # 确保列表项前面有适当的缩进
-                if i > 0 and not formatted_lines[-1].endswith('\n\n'):
-                    formatted_lines.append('')
-                formatted_lines.append(line)
-                # 确保列表项后面有适当的间距
-                if i < len(lines) - 1 and not lines[i+1].strip().startswith(('•', '-', '*', '1.', '2.', '3.', '4.', '5.')):
-                    formatted_lines.append('')
-            else:
-                formatted_lines.append(line)
-        
-        return '\n'.join(formatted_lines)
-    
-    def _format_paragraphs(self, text: str) -> str:
-        """确保段落之间有适当的间距"""
-        # 将多个换行符替换为两个换行符
-        import re
-        text = re.sub(r'\n{3,}', '\n\n', text)
-        
-        # 确保句子之间有适当的间距
-        lines = text.split('\n')
-        formatted_lines = []
-        
-        for line in lines:
-            if line.strip():  # 如果不是空行
-                # 在中文句子后添加适当的间距
-                sentences = re.split(r'([。！？])', line)
-                formatted_sentences = []
-                
-                for j in range(0, len(sentences), 2):
-                    if j < len(sentences) - 1:
-                        formatted_sentences.append(sentences[j] + sentences[j+1])
-                    else:
-                        formatted_sentences.append(sentences[j])
-                
-                line = ''.join(formatted_sentences)
-            
-            formatted_lines.append(line)
-        
-        return '\n'.join(formatted_lines)
-    
-    def _format_markdown(self, text: str) -> str:
-        """处理Markdown格式"""
-        # 将**加粗**转换为HTML格式（前端会处理）
-        # 这里我们只确保格式正确
-        import re
-        
-        # 确保加粗格式正确
-        text = re.sub(r'\*\*(.+?)\*\*', r'**\1**', text)
-        
-        # 确保标题格式正确
-        lines = text.split('\n')
-        formatted_lines = []
-        
-        for line in lines:
-            # 检测标题格式
-            if line.strip().startswith('###'):
-                if formatted_lines and formatted_lines[-1] != '':
-                    formatted_lines.append('')
-                formatted_lines.append(line)
-                formatted_lines.append('')
-            elif line.strip().startswith('##'):
-                if formatted_lines and formatted_lines[-1] != '':
-                    formatted_lines.append('')
-                formatted_lines.append(line)
-                formatted_lines.append('')
-            elif line.strip().startswith('#'):
-                if formatted_lines and formatted_lines[-1] != '':
-                    formatted_lines.append('')
-                formatted_lines.append(line)
-                formatted_lines.append('')
+    async def prepare_context(self, user_input: str, history: list, offset: int = 0,
+                              summary: str = '', summary_upto: int = 0):
+        """与 SimpleFoodBot.prepare_context 相同"""
+        base, start = self._plan_context(user_input, history, offset, summary, summary_upto)
+        if start > base:
+            new_summary = await self._summarize(summary, history[base:start])
+            if new_summary:
+                return history[start:], new_summary, offset + start
+            # 摘要生成失败：不折叠，只按预算截断
+            start = base + self.packer.fit(self.SYSTEM_PROMPT, history[base:], user_input, summary)
+        return history[start:], summary, summary_upto
+
+    async def _summarize(self, summary: str, messages: list):
+        try:
+            logger.info("[上下文] 折叠 %d 条旧消息进摘要", len(messages))
+            payload = self.packer.summary_payload(summary, messages, self.router.summary_model)
+            reply = await self.router.acall(payload, self._request_completion)
+            return reply.strip()
+        except Exception as e:
+            logger.warning("[上下文] 生成摘要失败: %s", e)
+            return None
+
+    async def ask(self, user_input: str, conversation_history=None, use_cache: bool = True, summary: str = None,
+                  lookup=None) -> str:
+        """主对话方法 - 与 SimpleFoodBot.ask 相同，返回格式化后的回复"""
+        if not user_input.strip():
+            return "请输入您想了解的美食问题哦~"
+
+        lookup = lookup or self.lookup_knowledge(user_input)
+        if lookup and lookup.answer:
+            return lookup.answer
+
+        data = self._build_payload(user_input, conversation_history, summary=summary,
+                                   grounding=lookup and lookup.snippets)
+        logger.debug("[API请求] 本次消息列表共 %d 条", len(data['messages']))
+
+        cache_key = self._cache_lookup_key(data, use_cache)
+        if cache_key:
+            cached = await asyncio.to_thread(self.cache.get, cache_key)
+            if cached is not None:
+                logger.debug("[API请求] 命中回复缓存")
+                return cached
+
+        try:
+            if self.flight is None:
+                ai_reply = await self.router.acall(data, self._request_completion)
             else:
-                formatted_lines.append(line)
-        
-        return '\n'.join(formatted_lines)
+                ai_reply = await self.flight.do(self.flight.make_key(data),
+                                                lambda: self.router.acall(data, self._request_completion))
+            logger.debug("[API响应] 成功获取回复，长度: %d", len(ai_reply))
+            with stage('format'):
+                formatted_reply = self._format_reply(ai_reply, user_input)
+            if cache_key:
+                await asyncio.to_thread(self.cache.set, cache_key, formatted_reply)
+            return formatted_reply
+
+        except httpx.TimeoutException:
+            logger.warning("[API错误] 请求超时")
+            return _fallback('timeout', "抱歉，与AI服务的连接超时了，可能是网络较慢或服务繁忙，请稍后再试。")
+        except httpx.ProxyError as e:
+            logger.warning("[API错误] 代理设置错误: %s", e)
+            return _fallback('proxy', "网络代理配置异常，请检查本地网络设置或联系管理员。")
+        except httpx.NetworkError as e:
+            logger.warning("[API错误] 连接错误: %s", e)
+            return _fallback('connection', "无法连接到AI服务，请检查您的网络连接是否正常。")
+        except httpx.HTTPError as e:
+            logger.warning("[API错误] 网络请求异常: %s", e)
+            return _fallback('http_error', f"网络请求出错：{str(e)[:100]}")
+        except (KeyError, IndexError, json.JSONDecodeError) as e:
+            logger.warning("[API错误] 解析响应失败: %s", e)
+            return _fallback('parse_error', "处理AI响应时出错，请重试。")
+        except FlightError as e:
+            logger.warning("[API错误] 等待相同请求失败: %s", e)
+            return _fallback('flight', "抱歉，与AI服务的连接超时了，可能是网络较慢或服务繁忙，请稍后再试。")
+        except Exception:
+            logger.exception("[API错误] 未预期的异常")
+            return _fallback('internal', "系统内部错误，请稍后再试。")
+
+    async def _request_completion(self, data: dict, cancel=None) -> str:
+        """非流式调用千帆，参数与 SimpleFoodBot._request_completion 相同；
+        对冲输掉时模型路由会先 set() 取消标记再取消任务，两者之间读完的响应不再返回"""
+        # 以流式方式发送再读完响应体，才能分别统计拿到响应头和读完响应的时间
+        start = time.perf_counter()
+        try:
+            async with self.transport.stream(data) as response:
+                observe_stage('upstream_connect', time.perf_counter() - start)
+                UPSTREAM_RESPONSES.inc(status=response.status_code)
+                logger.debug("[API响应] 状态码: %d", response.status_code)
+                response.raise_for_status()
+                await response.aread()
+        except httpx.TimeoutException:
+            UPSTREAM_TIMEOUTS.inc()
+            raise
+        if cancel is not None and cancel.is_set():
+            raise HedgeCancelled(data['model'])
+        observe_stage('upstream_total', time.perf_counter() - start)
+        return response.json()["choices"][0]["message"]["content"]
+
+    async def ask_stream(self, user_input: str, conversation_history=None, use_cache: bool = True,
+                         summary: str = None, lookup=None):
+        """流式对话方法 - 异步生成器，参数与产出的事件与 SimpleFoodBot.ask_stream 相同"""
+        if not user_input.strip():
+            yield {"type": "error", "reply": "请输入您想了解的美食问题哦~"}
+            return
+
+        lookup = lookup or self.lookup_knowledge(user_input)
+        if lookup and lookup.answer:
+            yield {"type": "done", "reply": lookup.answer}
+            return
+
+        data = self._build_payload(user_input, conversation_history, stream=True, summary=summary,
+                                   grounding=lookup and lookup.snippets)
+
+        cache_key = self._cache_lookup_key(data, use_cache)
+        if cache_key:
+            cached = await asyncio.to_thread(self.cache.get, cache_key)
+            if cached is not None:
+                logger.debug("[API请求] 命中回复缓存")
+                yield {"type": "done", "reply": cached}
+                return
+
+        formatter = StreamingReplyFormatter(user_input)
+        formatted_parts = []
+        reply_length = 0
+        format_seconds = 0.0
+        start = time.perf_counter()
+        try:
+            async with self.transport.stream(data) as response:
+                observe_stage('upstream_connect', time.perf_counter() - start)
+                UPSTREAM_RESPONSES.inc(status=response.status_code)
+                logger.debug("[API响应] 状态码: %d", response.status_code)
+                response.raise_for_status()
+
+                async for line in response.aiter_lines():
+                    delta = self._parse_stream_line(line)
+                    if delta is None:
+                        break
+                    if delta:
+                        if not reply_length:
+                            observe_stage('upstream_first_token', time.perf_counter() - start)
+                        began = time.perf_counter()
+                        formatted_parts.append(formatter.feed(delta))
+                        format_seconds += time.perf_counter() - began
+                        reply_length += len(delta)
+                        yield {"type": "delta", "content": delta}
+            observe_stage('upstream_total', time.perf_counter() - start)
+
+            logger.debug("[API响应] 流式回复结束，长度: %d", reply_length)
+            began = time.perf_counter()
+            formatted_parts.append(formatter.finish())
+            formatted_reply = "".join(formatted_parts)
+            observe_stage('format', format_seconds + time.perf_counter() - began)
+            if cache_key:
+                await asyncio.to_thread(self.cache.set, cache_key, formatted_reply)
+            yield {"type": "done", "reply": formatted_reply}
+
+        except httpx.TimeoutException:
+            UPSTREAM_TIMEOUTS.inc()
+            logger.warning("[API错误] 流式请求超时")
+            yield {"type": "error", "reply": _fallback(
+                'timeout', "抱歉，与AI服务的连接超时了，可能是网络较慢或服务繁忙，请稍后再试。")}
+        except httpx.NetworkError as e:
+            logger.warning("[API错误] 连接错误: %s", e)
+            yield {"type": "error", "reply": _fallback('connection', "无法连接到AI服务，请检查您的网络连接是否正常。")}
+        except httpx.HTTPError as e:
+            logger.warning("[API错误] 网络请求异常: %s", e)
+            yield {"type": "error", "reply": _fallback('http_error', f"网络请求出错：{str(e)[:100]}")}
+        except (KeyError, IndexError, json.JSONDecodeError) as e:
+            logger.warning("[API错误] 解析流式响应失败: %s", e)
+            yield {"type": "error", "reply": _fallback('parse_error', "处理AI响应时出错，请重试。")}
+        except Exception:
+            logger.exception("[API错误] 未预期的异常")
+            yield {"type": "error", "reply": _fallback('internal', "系统内部错误，请稍后再试。")}
+
+    async def aclose(self):
+        """释放连接池"""
+        await self.transport.aclose()
 
 
 # 为了兼容原命令行版本，保留main函数
-def main():
-    """命令行版本的主函数"""
+def main(argv=None):
+    """命令行版本的主函数
+    python food_bot.py                                   交互式对话
+    python food_bot.py batch questions.jsonl -o out.jsonl 并发批量问答（见 batch_runner）
+    """
+    import argparse
     import os
     from dotenv import load_dotenv
-    
+
+    parser = argparse.ArgumentParser(description='食探美食机器人命令行版')
+    subparsers = parser.add_subparsers(dest='command')
+    batch = subparsers.add_parser('batch', help='并发处理 JSONL 文件中的问题，逐条写出 JSONL 结果')
+    batch.add_argument('input', help='输入 JSONL，每行 {"id": ..., "question": ...}')
+    batch.add_argument('-o', '--output', required=True, help='结果 JSONL；已存在时默认续跑')
+    batch.add_argument('--workers', type=int, default=8, help='并发数')
+    batch.add_argument('--rate', type=float, default=0, help='每秒最多发出的问题数，0 表示不限')
+    batch.add_argument('--no-resume', action='store_true', help='清空输出文件，从头开始')
+    batch.add_argument('--no-cache', action='store_true', help='不读回复缓存，全部请求千帆')
+    batch.add_argument('--warm-cache', action='store_true',
+                       help='使用 REDIS_URL 上的回复缓存（与线上共用），可用于预热')
+    args = parser.parse_args(argv)
+
     load_dotenv()
+    configure_logging()
     API_KEY = os.getenv('BAIDU_API_KEY', '')
     
     if not API_KEY:
         print("请设置环境变量 BAIDU_API_KEY")
         return
+
+    if args.command == 'batch':
+        run_batch_command(API_KEY, args)
+        return
     
-    bot = SimpleFoodBot(API_KEY)
+    bot = SimpleFoodBot(API_KEY, knowledge=KnowledgeIndex.from_env())
     
     print("🤖 美食机器人已启动！输入'退出'结束对话")
     print("-" * 50)
@@ -335,5 +731,28 @@ def main():
             print(f"错误：{e}")
 
 
+def run_batch_command(api_key: str, args):
+    """batch 子命令"""
+    import os
+    import redis
+    from batch_runner import run_batch
+
+    cache = None
+    if args.warm_cache:
+        cache = ResponseCache.from_env(redis.from_url(os.getenv('REDIS_URL', 'redis://localhost:6379/0')))
+    # 连接池至少容纳全部 worker，避免超出的请求临时建连
+    pool_maxsize = max(args.workers, int(os.getenv('QIANFAN_POOL_MAXSIZE', 20)))
+    transport = QianfanTransport.from_env(api_key, pool_maxsize=pool_maxsize)
+    bot = SimpleFoodBot(api_key, transport=transport, cache=cache, knowledge=KnowledgeIndex.from_env())
+
+    print(f"批量处理 {args.input} → {args.output}（{args.workers} 个并发"
+          f"{f'，每秒最多 {args.rate} 条' if args.rate else ''}）")
+    summary = run_batch(bot, args.input, args.output, workers=args.workers, rate=args.rate,
+                        resume=not args.no_resume, use_cache=not args.no_cache)
+    print(f"完成：成功 {summary['ok']} 条，失败 {summary['failed']} 条，跳过已完成 {summary['skipped']} 条；"
+          f"用时 {summary['elapsed_s']} 秒，{summary['throughput']} 条/秒，"
+          f"p50 {summary['p50_ms']} ms，p95 {summary['p95_ms']} ms")
+
+
 if __name__ == "__main__":
     main()
\ No newline at end of file
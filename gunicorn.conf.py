@@ -0,0 +1,66 @@
+"""
+生产部署：gunicorn 多进程（pre-fork）配置，gunicorn 启动时自动读取当前目录下的本文件
+运行：gunicorn app:app      （或 python app.py，见 app.py 末尾；WEB_SERVER=flask python app.py 仍使用 Flask 开发服务器）
+
+app.run(debug=True) 是单进程的调试服务器，一台机器只用得上一个核，重载器还会多启动一个进程、
+把机器人初始化两遍。这里由 gunicorn 的 master 进程 fork 出多个 Worker：
+- Worker 数、每个 Worker 的线程数、Worker 类型都从环境变量读取（见下方各项）
+    gthread（默认）：每个 Worker 一个线程池，等待千帆时占用一个线程
+    gevent：协程，单个 Worker 可以挂起上千个等待中的请求，需要 pip install gevent
+    sync：每个 Worker 同时只处理一个请求，只适合调试
+- 默认不预加载应用：每个 Worker 在 fork 之后才导入 app.py，机器人、千帆连接池与 Redis 连接池
+  都属于本进程；WEB_PRELOAD=1 时在 master 中预加载（启动更快、知识库等只读数据按写时复制共享），
+  fork 后由 app.reset_after_fork() 丢弃继承来的连接
+- Worker 开始处理请求前调用 app.init_worker() 创建机器人、启动健康检查，第一个请求不用等初始化
+- 收到 SIGTERM 后 Worker 不再接受新连接，进行中的请求（包括流式对话）最多再处理 graceful_timeout 秒，
+  之后调用 app.shutdown_worker() 关闭千帆连接、写完剩余日志
+- 每个 Worker 处理 max_requests（加上随机抖动）个请求后由 master 平滑替换，避免内存缓慢增长
+
+注意：准入控制的并发名额（UPSTREAM_MAX_CONCURRENCY）与各种进程内缓存都按 Worker 计算，
+总的千帆并发约为 Worker 数 × UPSTREAM_MAX_CONCURRENCY。
+"""
+import multiprocessing
+import os
+
+env = os.environ
+
+bind = env.get('WEB_BIND', f"{env.get('HOST', '0.0.0.0')}:{env.get('PORT', 5000)}")
+
+# 每个核一个 Worker；等待千帆的时间由线程（或协程）承担，不需要更多进程
+workers = int(env.get('WEB_WORKERS', multiprocessing.cpu_count()))
+worker_class = env.get('WEB_WORKER_CLASS', 'gthread')
+threads = int(env.get('WEB_THREADS', 16))
+# gevent Worker 同时处理的连接数上限
+worker_connections = int(env.get('WEB_WORKER_CONNECTIONS', 1000))
+preload_app = env.get('WEB_PRELOAD', '0').lower() in ('1', 'true', 'yes')
+
+# Worker 超过这么多秒没有响应 master 的心跳就被重启；要大于千帆的读超时（60 秒）
+timeout = int(env.get('WEB_TIMEOUT', 90))
+# SIGTERM 后等待进行中的请求完成的时间，要能覆盖一次完整的流式生成
+graceful_timeout = int(env.get('WEB_GRACEFUL_TIMEOUT', 75))
+keepalive = int(env.get('WEB_KEEPALIVE', 5))
+
+max_requests = int(env.get('WEB_MAX_REQUESTS', 2000))
+# 随机抖动，避免所有 Worker 同时重启
+max_requests_jitter = int(env.get('WEB_MAX_REQUESTS_JITTER', 200))
+
+accesslog = env.get('WEB_ACCESS_LOG') or None
+errorlog = '-'
+loglevel = env.get('LOG_LEVEL', 'info').lower()
+proc_name = 'foodie_chatbot_web'
+
+
+def post_fork(server, worker):
+    if server.cfg.preload_app:
+        import app
+        app.reset_after_fork()
+
+
+def post_worker_init(worker):
+    import app
+    app.init_worker()
+
+
+def worker_exit(server, worker):
+    import app
+    app.shutdown_worker()
@@ -0,0 +1,207 @@
+"""
+健康监控 - 后台线程定期探测千帆与 Redis，请求路径只读取缓存的结果
+
+原先 /status 和 /chat 在机器人初始化失败后每次都会重新探测千帆（最长阻塞 10 秒）。
+现在探测全部放到一个后台线程里：
+- 每个检查项有自己的探测间隔；失败后按指数退避重试（2、4、8…秒，不超过 max_backoff），
+  恢复后回到正常间隔
+- /status、/readyz 和 get_bot() 只读内存中的状态，立即返回
+- 连续失败 failure_threshold 次才标记为不健康，一次偶发的失败不会让所有请求都被拒绝
+- SharedProbe 让同一个 Redis 上的所有进程（各个 Web Worker、任务 Worker）共用一次探测结果，
+  千帆的探测是一次真实的（计费的）对话补全，不应每个进程各发一次
+"""
+import logging
+import threading
+import time
+from datetime import datetime
+
+import redis
+
+logger = logging.getLogger(__name__)
+
+
+class SharedProbe:
+    """跨进程共用探测结果：结果存在 Redis 中，过期前直接读取；过期后只有抢到锁的进程真正探测
+
+    Redis 不可用时退回本进程直接探测。
+    """
+
+    def __init__(self, redis_client, key: str, probe, ttl: float = 60, failure_ttl: float = 2,
+                 lock_ttl: float = 15):
+        """
+        :param key: 存放结果的 key，锁为 <key>:lock
+        :param probe: 真正的探测函数，返回 True 表示健康
+        :param ttl: 成功结果的有效期（秒），一般与探测间隔相同
+        :param failure_ttl: 失败结果的有效期（秒），较短以便尽快重试
+        :param lock_ttl: 探测锁的过期时间（秒），应大于一次探测的最长耗时
+        """
+        self.redis = redis_client
+        self.key = key
+        self.probe = probe
+        self.ttl = ttl
+        self.failure_ttl = failure_ttl
+        self.lock_ttl = lock_ttl
+
+    def __call__(self) -> bool:
+        try:
+            deadline = time.monotonic() + self.lock_ttl
+            while True:
+                cached = self.redis.get(self.key)
+                if cached is not None:
+                    return cached == b'1'
+                if self.redis.set(self.key + ':lock', 1, nx=True, ex=max(1, round(self.lock_ttl))):
+                    break
+                if time.monotonic() >= deadline:
+                    break
+                # 其他进程正在探测，等它写回结果
+                time.sleep(0.5)
+        except redis.RedisError as e:
+            logger.warning("[健康检查] 读取共享探测结果失败，本进程直接探测: %s", e)
+            return bool(self.probe())
+
+        healthy = False
+        try:
+            healthy = bool(self.probe())
+            return healthy
+        finally:
+            try:
+                pipe = self.redis.pipeline()
+                pipe.set(self.key, b'1' if healthy else b'0',
+                         ex=max(1, round(self.ttl if healthy else self.failure_ttl)))
+                pipe.delete(self.key + ':lock')
+                pipe.execute()
+            except redis.RedisError as e:
+                logger.warning("[健康检查] 写入共享探测结果失败: %s", e)
+
+
+class _Check:
+    def __init__(self, name, probe, interval, max_backoff, failure_threshold):
+        self.name = name
+        self.probe = probe
+        self.interval = interval
+        self.max_backoff = max_backoff
+        self.failure_threshold = failure_threshold
+        self.healthy = None          # None 表示还没有探测过
+        self.consecutive_failures = 0
+        self.last_checked = None
+        self.last_ok = None
+        self.last_error = None
+        self.latency_ms = None
+        self.next_due = 0.0
+
+    def snapshot(self, now):
+        return {
+            'healthy': self.healthy,
+            'consecutive_failures': self.consecutive_failures,
+            'last_checked': self.last_checked,
+            'last_ok': self.last_ok,
+            'last_error': self.last_error,
+            'latency_ms': self.latency_ms,
+            'next_check_in_s': round(max(0.0, self.next_due - now), 1)
+        }
+
+
+class HealthMonitor:
+    RETRY_BASE = 2  # 失败后第一次重试的间隔（秒）
+
+    def __init__(self):
+        self._checks = {}
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def add_check(self, name: str, probe, interval: float = 30, max_backoff: float = 60,
+                  failure_threshold: int = 1):
+        """注册检查项
+        :param probe: 无参函数，返回 True 表示健康；返回 False 或抛异常表示不健康
+        :param interval: 健康时的探测间隔（秒）
+        :param max_backoff: 不健康时重试间隔的上限（秒）
+        :param failure_threshold: 连续失败多少次才标记为不健康，此前保持原来的状态
+        """
+        with self._lock:
+            self._checks[name] = _Check(name, probe, interval, max_backoff, max(1, failure_threshold))
+        self._wake.set()
+
+    def start(self):
+        """启动后台线程（重复调用无副作用）"""
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, name='health-monitor', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        self._wake.set()
+
+    def trigger(self, name: str = None):
+        """让指定检查项（默认全部）尽快重新探测"""
+        with self._lock:
+            for check in self._checks.values():
+                if name is None or check.name == name:
+                    check.next_due = 0.0
+        self._wake.set()
+
+    def status(self, name: str):
+        """检查项的最近结果：True / False，未注册或尚未探测时为 None"""
+        with self._lock:
+            check = self._checks.get(name)
+            return None if check is None else check.healthy
+
+    def snapshot(self) -> dict:
+        """全部检查项的状态；所有检查项都健康时 ready 为 True"""
+        now = time.monotonic()
+        with self._lock:
+            checks = {name: check.snapshot(now) for name, check in self._checks.items()}
+        ready = bool(checks) and all(c['healthy'] for c in checks.values())
+        return {'ready': ready, 'checks': checks}
+
+    # ---------------- 后台线程 ----------------
+    def _run(self):
+        while not self._stopped.is_set():
+            now = time.monotonic()
+            with self._lock:
+                due = [c for c in self._checks.values() if c.next_due <= now]
+            for check in due:
+                self._probe(check)
+
+            with self._lock:
+                next_due = min((c.next_due for c in self._checks.values()), default=now + 60)
+            self._wake.wait(timeout=max(0.05, next_due - time.monotonic()))
+            self._wake.clear()
+
+    def _probe(self, check):
+        start = time.monotonic()
+        error = None
+        try:
+            healthy = bool(check.probe())
+            if not healthy:
+                error = '探测返回失败'
+        except Exception as e:
+            healthy = False
+            error = f'{type(e).__name__}: {str(e)[:200]}'
+        elapsed = time.monotonic() - start
+
+        with self._lock:
+            was_healthy = check.healthy
+            if healthy or check.consecutive_failures + 1 >= check.failure_threshold:
+                check.healthy = healthy
+            check.latency_ms = round(elapsed * 1000, 1)
+            check.last_checked = datetime.now().isoformat(timespec='seconds')
+            if healthy:
+                check.consecutive_failures = 0
+                check.last_ok = check.last_checked
+                check.last_error = None
+                delay = check.interval
+            else:
+                check.consecutive_failures += 1
+                check.last_error = error
+                delay = min(check.max_backoff, self.RETRY_BASE * 2 ** (check.consecutive_failures - 1))
+            check.next_due = time.monotonic() + delay
+
+        if check.healthy != was_healthy:
+            if healthy:
+                logger.info("✓ [健康检查] %s 可用（%s ms）", check.name, check.latency_ms)
+            else:
+                logger.warning("✗ [健康检查] %s 不可用：%s，%s 秒后重试", check.name, error, delay)
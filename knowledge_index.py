@@ -0,0 +1,306 @@
+"""
+本地美食知识库 - 菜品 / 菜系 / 城市的倒排索引（中文二元组 + BM25），用于快速作答与提示词补充资料
+
+“西湖醋鱼是哪里的菜”这类纯事实问题原来也要完整调用一次千帆。这里把整理好的知识条目
+（knowledge/dishes.jsonl）预先建成倒排索引，启动时从紧凑的索引文件载入：
+- 高置信度的问题直接用知识库作答（毫秒级，不调用千帆）：问题里恰好提到一个已知的菜品、菜系或城市，
+  问法是“哪里的菜 / 属于什么菜系 / 是什么 / 有什么特色美食”之类的事实问题，
+  且不涉及推荐、价格、做法、比较等需要模型发挥的内容
+- 其余问题按 BM25 取最相关的几条资料，附在系统提示词后面，让模型的回答以知识库为准
+
+分词：连续的汉字切成相邻二元组（单字保留单字），英文与数字按词；BM25 的 k1、b 取常用值。
+索引文件格式：MAGIC b'FKIX' + 格式版本 + zlib 压缩的 JSON（条目、词表与倒排表、文档长度），
+加载时把词频预先换算成每个（词，条目）的 BM25 分值，查询时只需累加。
+
+构建：python knowledge_index.py build [knowledge/dishes.jsonl] [-o knowledge/index.bin]
+查询：python knowledge_index.py query "西湖醋鱼是哪里的菜"
+基准测试见 benchmarks/bench_knowledge.py。
+"""
+import argparse
+import heapq
+import json
+import logging
+import math
+import os
+import re
+import sys
+import time
+import zlib
+
+logger = logging.getLogger(__name__)
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_SOURCE = os.path.join(BASE_DIR, 'knowledge', 'dishes.jsonl')
+DEFAULT_INDEX = os.path.join(BASE_DIR, 'knowledge', 'index.bin')
+
+MAGIC = b'FKIX'
+FORMAT_VERSION = 1
+
+TOKEN_PATTERN = re.compile(r'[\u4e00-\u9fff]+|[a-z0-9]+')
+
+# 各字段在建索引时重复的次数，相当于字段权重
+FIELD_WEIGHTS = (('name', 3), ('aliases', 2), ('cuisine', 1), ('region', 1), ('summary', 1), ('dishes', 1))
+
+# 能直接作答的问法
+FACT_PATTERN = re.compile(r'哪里|哪儿|哪个(地方|城市|省)|什么地方|哪的|发源|起源|源自|产地|'
+                          r'菜系|什么菜|哪种菜|是什么|是啥|什么是|介绍|了解一下|特点|特色|代表菜|名菜')
+# 城市条目只回答以“有什么好吃的”之类结尾的问题，“有什么好吃的面”这种带限定的交给模型
+SPECIALTY_PATTERN = re.compile(r'(有(什么|啥|哪些)(好吃的?|美食|小吃|名菜)|(特色|代表)(美食|菜|小吃)|必吃的?|名菜)'
+                               r'[？?。！!吗呢呀啊]*$')
+# 需要模型发挥的问题：推荐、价格、做法、比较、健康等，不直接作答
+OPEN_PATTERN = re.compile(r'推荐|哪家|餐厅|饭店|饭馆|店|人均|价格|多少钱|预算|便宜|做法|怎么做|如何做|教程|'
+                          r'食谱|附近|地址|营业|排队|外卖|热量|卡路里|减肥|能不能|可以吃|过敏|孕|'
+                          r'和|与|跟|比|还是|区别|哪个好')
+MAX_DIRECT_QUERY_LENGTH = 30
+# 资料的分值还要达到最高分的这个比例，避免只命中“的特”之类常见二元组的条目
+RELATIVE_MIN_SCORE = 0.3
+CLAUSE_PATTERN = re.compile('[，。；]')
+
+
+def tokenize(text: str) -> list:
+    """汉字切成相邻二元组，英文与数字按词"""
+    tokens = []
+    for run in TOKEN_PATTERN.findall(text.lower()):
+        if run[0] < '\u4e00' or len(run) == 1:
+            tokens.append(run)
+        else:
+            tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+    return tokens
+
+
+def first_clause(text: str) -> str:
+    return CLAUSE_PATTERN.split(text, maxsplit=1)[0]
+
+
+def make_snippet(doc: dict) -> str:
+    """提示词中使用的一条资料"""
+    if doc['type'] == 'dish':
+        return f"{doc['name']}（{doc['cuisine']}，{doc['region']}）：{doc['summary']}"
+    if doc['type'] == 'cuisine':
+        return f"{doc['name']}（{doc['region']}）：{doc['summary']}代表菜有{'、'.join(doc['dishes'])}。"
+    return doc['summary']
+
+
+class KnowledgeResult:
+    """一次查询的结果
+    :ivar answer: 可以直接返回给用户的回答，不能直接作答时为 None
+    :ivar snippets: 附在系统提示词后面的资料，按相关度排列
+    """
+    __slots__ = ('answer', 'snippets')
+
+    def __init__(self, answer, snippets):
+        self.answer = answer
+        self.snippets = snippets
+
+    @property
+    def outcome(self) -> str:
+        """direct 直接作答 / grounded 补充资料 / miss 没有相关资料"""
+        if self.answer:
+            return 'direct'
+        return 'grounded' if self.snippets else 'miss'
+
+
+class KnowledgeIndex:
+    def __init__(self, docs: list, postings: dict, lengths: list, top_k: int = 3, min_score: float = 4.0,
+                 direct: bool = True, k1: float = 1.5, b: float = 0.75):
+        """
+        :param docs: 知识条目（见 knowledge/dishes.jsonl），每条带预先生成的 snippet
+        :param postings: 词 -> [[条目序号, 词频], ...]
+        :param lengths: 每个条目的词数
+        :param top_k: 最多附加的资料条数
+        :param min_score: BM25 分值低于这个值的条目不作为资料
+        :param direct: 为 False 时只补充资料，不直接作答
+        """
+        self.docs = docs
+        self.top_k = top_k
+        self.min_score = min_score
+        self.direct = direct
+        self.term_count = len(postings)
+
+        # 预先算好每个（词，条目）的 BM25 分值：查询只按词去重，不需要查询词频
+        total = len(docs)
+        avgdl = sum(lengths) / total if total else 0
+        norms = [k1 * (1 - b + b * length / avgdl) for length in lengths]
+        self.postings = {}
+        for term, entries in postings.items():
+            idf = math.log(1 + (total - len(entries) + 0.5) / (len(entries) + 0.5))
+            self.postings[term] = [(doc, idf * tf * (k1 + 1) / (tf + norms[doc])) for doc, tf in entries]
+
+        # 名称与别名按长度从长到短匹配，“重庆小面”优先于“重庆”
+        names = [(alias, i) for i, doc in enumerate(docs) for alias in [doc['name'], *doc.get('aliases', [])]]
+        self.names = sorted(names, key=lambda item: -len(item[0]))
+        self.by_name = {doc['name']: i for i, doc in enumerate(docs)}
+
+    # ---------------- 构建与读写 ----------------
+    @classmethod
+    def build(cls, docs: list, **kwargs) -> "KnowledgeIndex":
+        return cls(*cls._invert(docs), **kwargs)
+
+    @staticmethod
+    def _invert(docs: list):
+        docs = [dict(doc, snippet=make_snippet(doc)) for doc in docs]
+        postings = {}
+        lengths = []
+        for i, doc in enumerate(docs):
+            tokens = []
+            for field, weight in FIELD_WEIGHTS:
+                value = doc.get(field) or ''
+                text = ' '.join(value) if isinstance(value, list) else value
+                tokens += tokenize(text) * weight
+            lengths.append(len(tokens))
+            counts = {}
+            for token in tokens:
+                counts[token] = counts.get(token, 0) + 1
+            for token, tf in counts.items():
+                postings.setdefault(token, []).append([i, tf])
+        return docs, postings, lengths
+
+    @staticmethod
+    def load_source(path: str) -> list:
+        with open(path, encoding='utf-8') as f:
+            return [json.loads(line) for line in f if line.strip()]
+
+    @classmethod
+    def write(cls, docs: list, path: str) -> int:
+        """把知识条目建成索引文件，返回文件字节数"""
+        docs, postings, lengths = cls._invert(docs)
+        payload = json.dumps({'docs': docs, 'postings': postings, 'lengths': lengths},
+                             ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+        data = MAGIC + bytes((FORMAT_VERSION,)) + zlib.compress(payload, 9)
+        tmp = f'{path}.tmp{os.getpid()}'  # 多个 worker 可能同时重建索引，各写各的临时文件
+        with open(tmp, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, path)
+        return len(data)
+
+    @classmethod
+    def load(cls, path: str, **kwargs) -> "KnowledgeIndex":
+        with open(path, 'rb') as f:
+            data = f.read()
+        if len(data) <= len(MAGIC) or not data.startswith(MAGIC):
+            raise ValueError(f'{path} 不是知识库索引文件')
+        if data[len(MAGIC)] != FORMAT_VERSION:
+            raise ValueError(f'不支持的索引格式版本: {data[len(MAGIC)]}')
+        payload = json.loads(zlib.decompress(data[len(MAGIC) + 1:]))
+        return cls(payload['docs'], payload['postings'], payload['lengths'], **kwargs)
+
+    @classmethod
+    def from_env(cls):
+        """KNOWLEDGE_ENABLED=0 时不启用，返回 None
+        索引文件（KNOWLEDGE_INDEX）不存在或比数据源（KNOWLEDGE_SOURCE）旧时按数据源重新构建并写回
+        """
+        env = os.environ
+        if env.get('KNOWLEDGE_ENABLED', '1').lower() in ('0', 'false', 'no'):
+            return None
+        path = env.get('KNOWLEDGE_INDEX', DEFAULT_INDEX)
+        source = env.get('KNOWLEDGE_SOURCE', DEFAULT_SOURCE)
+        kwargs = {
+            'top_k': int(env.get('KNOWLEDGE_TOP_K', 3)),
+            'min_score': float(env.get('KNOWLEDGE_MIN_SCORE', 4.0)),
+            'direct': env.get('KNOWLEDGE_DIRECT', '1').lower() not in ('0', 'false', 'no')
+        }
+        try:
+            if os.path.exists(source) and (not os.path.exists(path)
+                                           or os.path.getmtime(path) < os.path.getmtime(source)):
+                logger.info("[知识库] 索引不存在或已过期，按 %s 重新构建", source)
+                cls.write(cls.load_source(source), path)
+            index = cls.load(path, **kwargs)
+        except (OSError, ValueError, KeyError, zlib.error) as e:
+            logger.warning("[知识库] 加载失败，不启用本地知识库: %s", e)
+            return None
+        logger.info("[知识库] 已加载 %d 个条目，%d 个词", len(index.docs), index.term_count)
+        return index
+
+    def stats(self) -> dict:
+        return {'enabled': True, 'docs': len(self.docs), 'terms': self.term_count, 'direct': self.direct}
+
+    # ---------------- 查询 ----------------
+    def search(self, query: str, k: int = None) -> list:
+        """BM25 相关度最高的 k 个条目：[(条目序号, 分值), ...]"""
+        scores = {}
+        for term in set(tokenize(query)):
+            for doc, weight in self.postings.get(term, ()):
+                scores[doc] = scores.get(doc, 0.0) + weight
+        return heapq.nlargest(k or self.top_k, scores.items(), key=lambda item: item[1])
+
+    def match_entities(self, query: str) -> list:
+        """问题中提到的条目序号（按出现位置排列），较长的名称优先，重叠的较短名称不计"""
+        covered = []
+        found = {}
+        for name, doc in self.names:
+            start = query.find(name)
+            while start != -1:
+                end = start + len(name)
+                if all(end <= s or start >= e for s, e in covered):
+                    covered.append((start, end))
+                    found.setdefault(doc, start)
+                start = query.find(name, end)
+        return sorted(found, key=found.get)
+
+    def lookup(self, query: str) -> KnowledgeResult:
+        """直接作答的回答（如果有把握）与补充资料"""
+        query = query.strip()
+        entities = self.match_entities(query)
+        answer = self._answer(query, entities) if self.direct else None
+
+        hits = self.search(query)
+        cutoff = max(self.min_score, hits[0][1] * RELATIVE_MIN_SCORE) if hits else 0
+        hits = [doc for doc, score in hits if score >= cutoff]
+        ranked = entities + [doc for doc in hits if doc not in entities]
+        return KnowledgeResult(answer, [self.docs[doc]['snippet'] for doc in ranked[:self.top_k]])
+
+    def _answer(self, query, entities):
+        # 回答按 reply_formatter 的输出格式拼接（列表项之间空一行），不需要再格式化
+        if len(entities) != 1 or len(query) > MAX_DIRECT_QUERY_LENGTH or OPEN_PATTERN.search(query):
+            return None
+        doc = self.docs[entities[0]]
+        if doc['type'] == 'city':
+            if not SPECIALTY_PATTERN.search(query):
+                return None
+            lines = [f"{doc['name']}的特色美食："]
+            for name in doc['dishes']:
+                dish = self.docs[self.by_name[name]]
+                lines.append(f"• **{name}**（{dish['cuisine']}）：{first_clause(dish['summary'])}")
+            return '\n\n'.join(lines)
+        if not FACT_PATTERN.search(query):
+            return None
+        if doc['type'] == 'cuisine':
+            lines = [f"**{doc['name']}**是{doc['region']}的地方菜系。{doc['summary']}", '代表菜：']
+            for name in doc['dishes']:
+                dish = self.docs[self.by_name[name]]
+                lines.append(f"• **{name}**（{dish['region']}）：{first_clause(dish['summary'])}")
+            return '\n\n'.join(lines)
+        return f"**{doc['name']}**是{doc['region']}的特色美食，属于{doc['cuisine']}。\n\n{doc['summary']}"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='本地美食知识库索引')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    build = subparsers.add_parser('build', help='把 JSONL 数据源建成索引文件')
+    build.add_argument('source', nargs='?', default=DEFAULT_SOURCE, help='知识条目 JSONL')
+    build.add_argument('-o', '--output', default=DEFAULT_INDEX, help='索引文件')
+    query = subparsers.add_parser('query', help='查询索引，打印直接作答的结果与补充资料')
+    query.add_argument('question')
+    query.add_argument('-i', '--index', default=DEFAULT_INDEX, help='索引文件')
+    args = parser.parse_args(argv)
+
+    if args.command == 'build':
+        start = time.perf_counter()
+        docs = KnowledgeIndex.load_source(args.source)
+        size = KnowledgeIndex.write(docs, args.output)
+        print(f"已写入 {args.output}：{len(docs)} 个条目，{size} 字节，用时 {(time.perf_counter() - start) * 1000:.1f} ms")
+        return
+
+    index = KnowledgeIndex.load(args.index)
+    start = time.perf_counter()
+    result = index.lookup(args.question)
+    elapsed = (time.perf_counter() - start) * 1e6
+    print(f"结果：{result.outcome}（{elapsed:.0f} µs）")
+    if result.answer:
+        print(f"\n{result.answer}")
+    for snippet in result.snippets:
+        print(f"\n• {snippet}")
+
+
+if __name__ == '__main__':
+    sys.exit(main())
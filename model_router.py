@@ -0,0 +1,368 @@
+"""
+模型路由 - 简单问题交给更快更便宜的模型；主模型迟迟不返回时对冲（hedge）一个请求，先到先用
+
+原先所有请求都固定发给 ernie-3.5-8k，尾延迟主要来自偶发的极慢上游调用。这里：
+- 选择模型：短且不需要长篇推荐的问题（“你好”“谢谢”“人均多少”）发给 fast 模型，其余发给主模型；
+  fast 模型近期错误率过高时自动退回主模型
+- 对冲请求：非流式调用超过该模型近期延迟的 P95（可配置）仍未返回时，向 hedge 模型再发一个请求，
+  哪个先成功用哪个，另一个取消。每个请求最多对冲一次。
+  可能对冲的调用会给请求函数传入 CancelToken：同步版无法取消正在执行的线程，请求函数把它交给传输层，
+  传输层在发送之前登记中断连接的回调，被取消时立即断开连接（上游随之停止生成），请求函数抛出 HedgeCancelled，
+  输掉的一方不会继续消耗上游配额、占用线程；异步版先 set() 取消标记再取消任务。
+  请求本身仍是普通的非流式请求。
+  可对冲的调用数（pool_size）与同时进行的对冲数（max_hedges）都有上限，同步版与异步版一致：
+  名额用尽时不对冲，主请求直接在调用线程（或当前协程）中执行，同步版不会排在尚未结束的请求后面
+- 统计：每个模型最近 window 次调用的延迟与成败，驱动上面两项决策，并导出到 /status 与 /metrics
+
+模型名与接口地址都来自环境变量（QIANFAN_BASE_URL 指向本地替身即可离线测试，
+见 benchmarks/fake_qianfan.py 的 --model-latency）。
+"""
+import asyncio
+import concurrent.futures
+import os
+import re
+import threading
+import time
+from collections import deque
+
+DEFAULT_MODEL = "ernie-3.5-8k"
+
+# 需要长篇回答的问题即使很短也交给主模型
+COMPLEX_PATTERN = re.compile(r'推荐|攻略|路线|行程|对比|比较|预算|菜单|做法|怎么做|哪些|哪几')
+
+
+class HedgeCancelled(Exception):
+    """对冲中输掉的一方被取消（同步版由请求函数在检查到取消事件时抛出）"""
+
+
+class CancelToken:
+    """同步对冲中一次调用的取消标记：set() 后 is_set() 为真，并执行请求函数用 on_cancel 登记的回调"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._set = False
+        self._callbacks = []
+
+    def is_set(self) -> bool:
+        return self._set
+
+    def set(self):
+        with self._lock:
+            if self._set:
+                return
+            self._set = True
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            callback()
+
+    def on_cancel(self, callback):
+        """登记取消时执行的回调（如中断连接）；已经取消时立即执行"""
+        with self._lock:
+            if not self._set:
+                self._callbacks.append(callback)
+                return
+        callback()
+
+
+class _ModelStats:
+    def __init__(self, window):
+        self.latencies = deque(maxlen=window)   # 成功（以及被对冲取消）的调用耗时（秒）
+        self.outcomes = deque(maxlen=window)    # True 成功 / False 失败
+        self.requests = 0
+        self.errors = 0
+
+    def percentile(self, p):
+        if not self.latencies:
+            return None
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))]
+
+    def error_rate(self):
+        return self.outcomes.count(False) / len(self.outcomes) if self.outcomes else 0.0
+
+
+class ModelRouter:
+    def __init__(self, primary: str = DEFAULT_MODEL, fast: str = None, hedge: str = None,
+                 max_tokens: int = 1024, short_query_chars: int = 12, hedge_percentile: float = 95,
+                 hedge_min_delay: float = 1.0, hedge_initial_delay: float = 10.0, window: int = 200,
+                 min_samples: int = 20, max_error_rate: float = 0.5, pool_size: int = 32,
+                 max_hedges: int = 8):
+        """
+        :param primary: 主模型
+        :param fast: 简单问题使用的模型，None 表示不分流
+        :param hedge: 对冲请求使用的模型，None 表示不对冲（可以与主模型相同）
+        :param max_tokens: 回复的最大 token 数
+        :param short_query_chars: 不超过这个字数且不含 COMPLEX_PATTERN 的问题视为简单问题
+        :param hedge_percentile: 调用超过该模型近期延迟的这个百分位时发出对冲请求
+        :param hedge_min_delay: 对冲等待时间的下限（秒），避免延迟普遍很低时频繁对冲
+        :param hedge_initial_delay: 样本不足 min_samples 时的对冲等待时间（秒）
+        :param window: 每个模型保留最近多少次调用的统计
+        :param max_error_rate: 模型近期错误率超过该值时不再分流或对冲到它
+        :param pool_size: 同时进行的可对冲调用数上限，也是同步版线程池的大小；名额用尽时不对冲
+        :param max_hedges: 同时进行中的对冲请求数上限，超出时不再对冲，只等主请求
+        """
+        self.primary = primary
+        self.fast = fast or None
+        self.hedge = hedge or None
+        self.max_tokens = max_tokens
+        self.short_query_chars = short_query_chars
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_delay = hedge_min_delay
+        self.hedge_initial_delay = hedge_initial_delay
+        self.window = window
+        self.min_samples = min_samples
+        self.max_error_rate = max_error_rate
+        self.pool_size = pool_size
+        self.max_hedges = max_hedges
+        self._models = {}
+        self._counts = {'routed_fast': 0, 'hedges_fired': 0, 'hedges_won': 0, 'hedges_skipped': 0}
+        self._lock = threading.Lock()
+        self._pool = None
+        self._busy = 0        # 正在进行的可对冲调用数（同步版即线程池中正在执行的调用数）
+        self._hedging = 0     # 其中的对冲请求数
+
+    @classmethod
+    def from_env(cls) -> "ModelRouter":
+        env = os.environ
+        return cls(
+            primary=env.get('QIANFAN_MODEL', DEFAULT_MODEL),
+            fast=env.get('ROUTER_FAST_MODEL'),
+            hedge=env.get('ROUTER_HEDGE_MODEL'),
+            max_tokens=int(env.get('QIANFAN_MAX_TOKENS', 1024)),
+            short_query_chars=int(env.get('ROUTER_SHORT_QUERY_CHARS', 12)),
+            hedge_percentile=float(env.get('ROUTER_HEDGE_PERCENTILE', 95)),
+            hedge_min_delay=float(env.get('ROUTER_HEDGE_MIN_DELAY', 1.0)),
+            hedge_initial_delay=float(env.get('ROUTER_HEDGE_INITIAL_DELAY', 10.0)),
+            window=int(env.get('ROUTER_WINDOW', 200)),
+            min_samples=int(env.get('ROUTER_MIN_SAMPLES', 20)),
+            max_error_rate=float(env.get('ROUTER_MAX_ERROR_RATE', 0.5)),
+            pool_size=int(env.get('ROUTER_POOL_SIZE', 32)),
+            max_hedges=int(env.get('ROUTER_MAX_HEDGES', 8))
+        )
+
+    @property
+    def summary_model(self) -> str:
+        """生成对话摘要用的模型：有 fast 模型时用它"""
+        return self.fast if self.fast and self._usable(self.fast) else self.primary
+
+    def choose(self, user_input: str) -> str:
+        """为本次提问选择模型"""
+        text = user_input.strip()
+        if (self.fast and len(text) <= self.short_query_chars and not COMPLEX_PATTERN.search(text)
+                and self._usable(self.fast)):
+            with self._lock:
+                self._counts['routed_fast'] += 1
+            return self.fast
+        return self.primary
+
+    def hedge_delay(self, model: str):
+        """model 的调用等待多久后发出对冲请求；不对冲时返回 None"""
+        if not self.hedge or not self._usable(self.hedge):
+            return None
+        with self._lock:
+            stats = self._models.get(model)
+            if stats is None or len(stats.latencies) < self.min_samples:
+                return self.hedge_initial_delay
+            return max(self.hedge_min_delay, stats.percentile(self.hedge_percentile))
+
+    def record(self, model: str, seconds: float, ok):
+        """记录一次调用；ok 为 None 表示调用被对冲取消，只知道它至少需要 seconds 秒"""
+        with self._lock:
+            stats = self._models.get(model)
+            if stats is None:
+                stats = self._models[model] = _ModelStats(self.window)
+            if ok is None:
+                # 不计入样本的话，被取消的慢调用会让分位数越来越低、对冲越来越频繁
+                stats.latencies.append(seconds)
+                return
+            stats.requests += 1
+            stats.outcomes.append(ok)
+            if ok:
+                stats.latencies.append(seconds)
+            else:
+                stats.errors += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            models = {
+                name: {
+                    'requests': s.requests,
+                    'errors': s.errors,
+                    'recent_error_rate': round(s.error_rate(), 4),
+                    'p50_ms': None if not s.latencies else round(s.percentile(50) * 1000, 1),
+                    'p95_ms': None if not s.latencies else round(s.percentile(95) * 1000, 1),
+                    'samples': len(s.latencies)
+                }
+                for name, s in self._models.items()
+            }
+            counts = dict(self._counts)
+            counts.update(pool_busy=self._busy, hedges_in_flight=self._hedging)
+        return {'primary': self.primary, 'fast': self.fast, 'hedge': self.hedge, **counts, 'models': models}
+
+    # ---------------- 调用 ----------------
+    def call(self, data: dict, request):
+        """同步调用 request(data)，记录统计，需要时对冲
+        :param request: 发送一次请求并返回回复文本的函数，接收请求体；可能对冲时以 request(data, cancel) 调用，
+                        cancel 为 CancelToken，被取消后应立即断开连接并抛出 HedgeCancelled
+        """
+        delay = self.hedge_delay(data['model'])
+        if delay is None or not self._reserve():
+            # 不对冲，或线程池已满：直接在调用线程中执行，不排在其他调用（包括还没停下的对冲输家）后面
+            if delay is not None:
+                self._count('hedges_skipped')
+            return self._timed(request, data)
+
+        cancels = {}
+        primary = self._submit(request, data, cancels)
+        try:
+            return primary.result(timeout=delay)
+        except concurrent.futures.TimeoutError:
+            pass
+
+        if not self._reserve(hedge=True):
+            self._count('hedges_skipped')
+            return primary.result()
+        hedge = self._submit(request, dict(data, model=self.hedge), cancels, hedge=True)
+        self._count('hedges_fired')
+        pending = {primary, hedge}
+        error = None
+        try:
+            while pending:
+                done, pending = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    if future.exception() is None:
+                        if future is hedge:
+                            self._count('hedges_won')
+                        return future.result()
+                    if future is primary or error is None:
+                        error = future.exception()
+            raise error
+        finally:
+            # 输掉的一方立即断开连接，释放上游配额和线程
+            for loser in pending:
+                cancels[loser].set()
+
+    async def acall(self, data: dict, request):
+        """call 的 asyncio 版本；request 为协程函数，调用方式与 call 相同，对冲输掉的一方会被取消"""
+        delay = self.hedge_delay(data['model'])
+        if delay is None or not self._reserve():
+            if delay is not None:
+                self._count('hedges_skipped')
+            return await self._atimed(request, data)
+
+        cancels = {}
+        primary = self._spawn(request, data, cancels)
+        done, _ = await asyncio.wait({primary}, timeout=delay)
+        if done:
+            return primary.result()
+
+        if not self._reserve(hedge=True):
+            self._count('hedges_skipped')
+            return await primary
+        hedge = self._spawn(request, dict(data, model=self.hedge), cancels, hedge=True)
+        self._count('hedges_fired')
+        pending = {primary, hedge}
+        error = None
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is hedge:
+                            self._count('hedges_won')
+                        return task.result()
+                    if task is primary or error is None:
+                        error = task.exception()
+            raise error
+        finally:
+            for task in pending:
+                cancels[task].set()
+                task.cancel()
+
+    def _submit(self, request, data, cancels, hedge=False):
+        """在线程池中执行一次可取消的调用（已通过 _reserve 占用名额），取消标记登记在 cancels 中"""
+        cancel = CancelToken()
+        future = self._executor().submit(self._run, request, data, cancel, hedge)
+        cancels[future] = cancel
+        return future
+
+    def _spawn(self, request, data, cancels, hedge=False):
+        """_submit 的 asyncio 版本：在任务中执行一次可取消的调用"""
+        cancel = CancelToken()
+        task = asyncio.ensure_future(self._arun(request, data, cancel, hedge))
+        cancels[task] = cancel
+        return task
+
+    def _run(self, request, data, cancel, hedge):
+        try:
+            return self._timed(request, data, cancel)
+        finally:
+            self._release(hedge)
+
+    async def _arun(self, request, data, cancel, hedge):
+        try:
+            return await self._atimed(request, data, cancel)
+        finally:
+            self._release(hedge)
+
+    def _reserve(self, hedge=False) -> bool:
+        """占用线程池中的一个名额；池已满或对冲数已达上限时返回 False"""
+        with self._lock:
+            if self._busy >= self.pool_size or (hedge and self._hedging >= self.max_hedges):
+                return False
+            self._busy += 1
+            if hedge:
+                self._hedging += 1
+            return True
+
+    def _release(self, hedge=False):
+        with self._lock:
+            self._busy -= 1
+            if hedge:
+                self._hedging -= 1
+
+    def _timed(self, request, data, cancel=None):
+        start = time.perf_counter()
+        try:
+            result = request(data) if cancel is None else request(data, cancel)
+        except HedgeCancelled:
+            self.record(data['model'], time.perf_counter() - start, None)
+            raise
+        except Exception:
+            self.record(data['model'], time.perf_counter() - start, False)
+            raise
+        self.record(data['model'], time.perf_counter() - start, True)
+        return result
+
+    async def _atimed(self, request, data, cancel=None):
+        start = time.perf_counter()
+        try:
+            result = await (request(data) if cancel is None else request(data, cancel))
+        except (asyncio.CancelledError, HedgeCancelled):
+            self.record(data['model'], time.perf_counter() - start, None)
+            raise
+        except Exception:
+            self.record(data['model'], time.perf_counter() - start, False)
+            raise
+        self.record(data['model'], time.perf_counter() - start, True)
+        return result
+
+    def _usable(self, model):
+        """近期错误率未超过阈值（样本不足时视为可用）"""
+        with self._lock:
+            stats = self._models.get(model)
+            if stats is None or len(stats.outcomes) < self.min_samples:
+                return True
+            return stats.error_rate() <= self.max_error_rate
+
+    def _count(self, name):
+        with self._lock:
+            self._counts[name] += 1
+
+    def _executor(self):
+        if self._pool is None:
+            with self._lock:
+                if self._pool is None:
+                    self._pool = concurrent.futures.ThreadPoolExecutor(self.pool_size,
+                                                                       thread_name_prefix='model-router')
+        return self._pool
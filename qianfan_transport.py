@@ -0,0 +1,340 @@
+"""
+千帆 API 传输层 - 机器人持有的可复用 HTTP 客户端 (连接池 & Keep-Alive & 重试退避)
+"""
+import asyncio
+import os
+import random
+import socket
+import threading
+from contextlib import asynccontextmanager
+
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.exceptions import ReadTimeoutError
+from urllib3.util.retry import Retry
+
+# fork 之后丢弃的、从父进程继承来的连接池：保持引用，避免被回收时关闭父进程仍在使用的 socket
+_inherited_sessions = []
+
+# 当前线程正在发送的请求的取消标记（model_router.CancelToken），由 QianfanTransport.post 设置
+_current = threading.local()
+
+
+def _cancelled() -> bool:
+    cancel = getattr(_current, 'cancel', None)
+    return cancel is not None and cancel.is_set()
+
+
+class _CancellableConnection:
+    """可以从其他线程中断的连接
+
+    发送请求之前把中断回调登记到当前线程的取消标记上，建立连接、等待响应头、读取响应体的任何阶段被取消，
+    都直接 shutdown 底层 socket，阻塞中的调用随即出错（response.close() 要等正在进行的读取返回才能获得锁）。
+    连接放回连接池时解除占用，之后迟到的取消不会断开已被其他请求复用的连接。
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._abort_lock = threading.Lock()
+        self._owner = None
+
+    def connect(self):
+        super().connect()
+        # 登记之后、连接建立之前就被取消时，回调里还没有 socket 可断
+        if _cancelled():
+            self.abort(self._owner)
+
+    def request(self, *args, **kwargs):
+        cancel = getattr(_current, 'cancel', None)
+        if cancel is not None:
+            with self._abort_lock:
+                self._owner = cancel
+            cancel.on_cancel(lambda: self.abort(cancel))
+        return super().request(*args, **kwargs)
+
+    def abort(self, owner):
+        with self._abort_lock:
+            if owner is None or self._owner is not owner or self.sock is None:
+                return
+            try:
+                self.sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+    def release(self):
+        with self._abort_lock:
+            self._owner = None
+
+
+class _HTTPConnection(_CancellableConnection, HTTPConnection):
+    pass
+
+
+class _HTTPSConnection(_CancellableConnection, HTTPSConnection):
+    pass
+
+
+class _ReleasingPool:
+    def _put_conn(self, conn):
+        if conn is not None:
+            conn.release()
+        super()._put_conn(conn)
+
+
+class _HTTPConnectionPool(_ReleasingPool, HTTPConnectionPool):
+    ConnectionCls = _HTTPConnection
+
+
+class _HTTPSConnectionPool(_ReleasingPool, HTTPSConnectionPool):
+    ConnectionCls = _HTTPSConnection
+
+
+class _CancellableAdapter(HTTPAdapter):
+    """连接池使用 _CancellableConnection 的 HTTPAdapter"""
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {'http': _HTTPConnectionPool, 'https': _HTTPSConnectionPool}
+
+
+class UpstreamRetry(Retry):
+    """千帆请求的重试策略
+
+    - 429 / 502 / 503 / 504 和连接被重置时按指数退避重试，退避时间带随机抖动（full jitter），
+      避免一批失败的请求在同一时刻一起重试
+    - 读超时不重试：生成本身就慢，重试只会让用户再多等一个完整的超时周期
+    - 请求已被取消（对冲输掉、连接被主动断开）时不重试
+    """
+
+    def increment(self, method=None, url=None, response=None, error=None, _pool=None, _stacktrace=None):
+        if isinstance(error, ReadTimeoutError) or (error is not None and _cancelled()):
+            raise error
+        return super().increment(method=method, url=url, response=response, error=error,
+                                 _pool=_pool, _stacktrace=_stacktrace)
+
+    def get_backoff_time(self) -> float:
+        backoff = super().get_backoff_time()
+        return random.uniform(0, backoff) if backoff > 0 else 0
+
+
+class QianfanTransport:
+    """封装到千帆的长连接：一个 requests.Session + 带重试的连接池"""
+
+    DEFAULT_BASE_URL = "https://qianfan.baidubce.com"
+    CHAT_PATH = "/v2/chat/completions"
+    RETRY_STATUS = (429, 502, 503, 504)
+
+    def __init__(self, api_key: str, base_url: str = DEFAULT_BASE_URL,
+                 pool_connections: int = 4, pool_maxsize: int = 20, pool_block: bool = False,
+                 connect_timeout: float = 5, read_timeout: float = 60,
+                 max_retries: int = 3, backoff_factor: float = 0.5):
+        """
+        :param api_key: 百度千帆的API Key
+        :param base_url: 千帆服务地址
+        :param pool_connections: 缓存多少个主机的连接池
+        :param pool_maxsize: 每个主机最多保持多少条 Keep-Alive 连接
+        :param pool_block: 连接用尽时是否排队等待（否则临时新建连接，用完即关）
+        :param connect_timeout: 建立连接的超时（秒）
+        :param read_timeout: 等待响应数据的超时（秒）
+        :param max_retries: 可重试错误的最大重试次数
+        :param backoff_factor: 指数退避的基数（秒）
+        """
+        self.url = base_url.rstrip("/") + self.CHAT_PATH
+        self.api_key = api_key
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+
+        retry = UpstreamRetry(
+            total=max_retries,
+            connect=max_retries,
+            read=max_retries,
+            status=max_retries,
+            backoff_factor=backoff_factor,
+            status_forcelist=self.RETRY_STATUS,
+            # 对话补全没有副作用，POST 也可以安全重试
+            allowed_methods=frozenset(["POST"]),
+            respect_retry_after_header=True,
+            # 重试用尽后返回最后一次响应，交给调用方 raise_for_status
+            raise_on_status=False
+        )
+        self._adapter_settings = dict(pool_connections=pool_connections, pool_maxsize=pool_maxsize,
+                                      pool_block=pool_block, max_retries=retry)
+        self.session = self._new_session()
+
+    def _new_session(self) -> requests.Session:
+        session = requests.Session()
+        # 强制忽略系统代理（等价于原来每次传入的 proxies={"http": None, "https": None}）
+        session.trust_env = False
+        session.headers.update({
+            "Content-Type": "application/json",
+            "Authorization": f"Bearer {self.api_key}"
+        })
+        adapter = _CancellableAdapter(**self._adapter_settings)
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        return session
+
+    @classmethod
+    def from_env(cls, api_key: str, **overrides) -> "QianfanTransport":
+        """从环境变量读取连接池配置，未设置的项使用默认值；overrides 中的参数优先"""
+        env = os.environ
+        settings = dict(
+            pool_connections=int(env.get("QIANFAN_POOL_CONNECTIONS", 4)),
+            pool_maxsize=int(env.get("QIANFAN_POOL_MAXSIZE", 20)),
+            pool_block=env.get("QIANFAN_POOL_BLOCK", "").lower() in ("1", "true", "yes"),
+            **_common_settings_from_env()
+        )
+        settings.update(overrides)
+        return cls(api_key, **settings)
+
+    def post(self, payload: dict, stream: bool = False, read_timeout: float = None,
+             cancel=None) -> requests.Response:
+        """向对话补全接口发送请求
+        :param payload: 请求体
+        :param stream: 是否流式读取响应
+        :param read_timeout: 覆盖默认的读超时（流式时为两块数据之间的最大间隔）
+        :param cancel: 取消标记（model_router.CancelToken），在其他线程 set() 后立即断开本次请求的连接，
+                       请求随之抛出 requests 的异常且不再重试；流式时读取响应体期间同样有效
+        """
+        timeout = (self.connect_timeout, read_timeout or self.read_timeout)
+        if cancel is None:
+            return self.session.post(self.url, json=payload, timeout=timeout, stream=stream)
+        _current.cancel = cancel
+        try:
+            return self.session.post(self.url, json=payload, timeout=timeout, stream=stream)
+        finally:
+            _current.cancel = None
+
+    def reset(self):
+        """fork 之后在子进程中调用：换一个新的连接池
+
+        继承来的 Keep-Alive 连接与父进程共用同一个 socket，关闭时（TLS 会发送 close_notify）会打断父进程
+        正在使用的连接，所以只丢弃、不关闭，和 redis 的 ConnectionPool.reset() 一样。
+        """
+        _inherited_sessions.append(self.session)
+        self.session = self._new_session()
+
+    def close(self):
+        """关闭连接池中的所有连接"""
+        self.session.close()
+
+
+class AsyncQianfanTransport:
+    """QianfanTransport 的 asyncio 版本，基于 httpx.AsyncClient
+
+    等待千帆生成时不占用线程，一个进程可以同时挂起成千上万个请求。
+    重试规则与同步版一致：429 / 5xx 与连接错误按带抖动的指数退避重试，读超时不重试。
+    """
+
+    DEFAULT_BASE_URL = QianfanTransport.DEFAULT_BASE_URL
+    CHAT_PATH = QianfanTransport.CHAT_PATH
+    RETRY_STATUS = QianfanTransport.RETRY_STATUS
+    RETRY_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout, httpx.ReadError,
+                    httpx.WriteError, httpx.RemoteProtocolError)
+
+    def __init__(self, api_key: str, base_url: str = DEFAULT_BASE_URL,
+                 max_connections: int = 1000, max_keepalive: int = 100, keepalive_expiry: float = 30,
+                 connect_timeout: float = 5, read_timeout: float = 60,
+                 max_retries: int = 3, backoff_factor: float = 0.5, backoff_max: float = 30):
+        """
+        :param api_key: 百度千帆的API Key
+        :param base_url: 千帆服务地址
+        :param max_connections: 同时打开的最大连接数（即最大并发上游请求数）
+        :param max_keepalive: 空闲时保留的 Keep-Alive 连接数
+        :param keepalive_expiry: 空闲连接保留时长（秒）
+        :param connect_timeout: 建立连接的超时（秒）
+        :param read_timeout: 等待响应数据的超时（秒）
+        :param max_retries: 可重试错误的最大重试次数
+        :param backoff_factor: 指数退避的基数（秒）
+        :param backoff_max: 单次退避的上限（秒）
+        """
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+        self.backoff_max = backoff_max
+
+        self.client = httpx.AsyncClient(
+            base_url=base_url.rstrip("/"),
+            headers={
+                "Content-Type": "application/json",
+                "Authorization": f"Bearer {api_key}"
+            },
+            limits=httpx.Limits(max_connections=max_connections,
+                                max_keepalive_connections=max_keepalive,
+                                keepalive_expiry=keepalive_expiry),
+            # 强制忽略系统代理
+            trust_env=False
+        )
+
+    @classmethod
+    def from_env(cls, api_key: str) -> "AsyncQianfanTransport":
+        """从环境变量读取连接池配置，未设置的项使用默认值"""
+        env = os.environ
+        return cls(
+            api_key,
+            max_connections=int(env.get("QIANFAN_MAX_CONNECTIONS", 1000)),
+            max_keepalive=int(env.get("QIANFAN_POOL_MAXSIZE", 100)),
+            **_common_settings_from_env()
+        )
+
+    async def post(self, payload: dict, read_timeout: float = None) -> httpx.Response:
+        """向对话补全接口发送请求，返回已读完响应体的 Response"""
+        return await self._send(payload, stream=False, read_timeout=read_timeout)
+
+    @asynccontextmanager
+    async def stream(self, payload: dict, read_timeout: float = None):
+        """流式请求：async with transport.stream(data) as response: ...
+
+        只在拿到响应头之前重试，开始读取数据后出错直接抛给调用方。
+        """
+        response = await self._send(payload, stream=True, read_timeout=read_timeout)
+        try:
+            yield response
+        finally:
+            await response.aclose()
+
+    async def _send(self, payload: dict, stream: bool, read_timeout: float = None) -> httpx.Response:
+        timeout = httpx.Timeout(read_timeout or self.read_timeout, connect=self.connect_timeout)
+        request = self.client.build_request("POST", self.CHAT_PATH, json=payload, timeout=timeout)
+
+        for attempt in range(self.max_retries + 1):
+            last_try = attempt == self.max_retries
+            try:
+                response = await self.client.send(request, stream=stream)
+            except self.RETRY_ERRORS:
+                if last_try:
+                    raise
+                await asyncio.sleep(self._backoff(attempt))
+                continue
+
+            if response.status_code not in self.RETRY_STATUS or last_try:
+                return response
+
+            retry_after = response.headers.get("Retry-After", "")
+            await response.aclose()
+            delay = float(retry_after) if retry_after.isdigit() else self._backoff(attempt)
+            await asyncio.sleep(min(delay, self.backoff_max))
+
+    def _backoff(self, attempt: int) -> float:
+        """带 full jitter 的指数退避"""
+        return random.uniform(0, min(self.backoff_max, self.backoff_factor * (2 ** attempt)))
+
+    async def aclose(self):
+        """关闭连接池中的所有连接"""
+        await self.client.aclose()
+
+
+def _common_settings_from_env() -> dict:
+    """同步与异步传输层共用的环境变量配置"""
+    env = os.environ
+    return {
+        "base_url": env.get("QIANFAN_BASE_URL", QianfanTransport.DEFAULT_BASE_URL),
+        "connect_timeout": float(env.get("QIANFAN_CONNECT_TIMEOUT", 5)),
+        "read_timeout": float(env.get("QIANFAN_READ_TIMEOUT", 60)),
+        "max_retries": int(env.get("QIANFAN_MAX_RETRIES", 3)),
+        "backoff_factor": float(env.get("QIANFAN_BACKOFF_FACTOR", 0.5))
+    }
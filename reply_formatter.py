@@ -0,0 +1,180 @@
+"""
+AI 回复格式化引擎 - 单趟扫描 & 预编译正则 & 支持流式增量格式化
+
+与原先 SimpleFoodBot 里的四趟处理（价格 → 列表 → 段落 → Markdown 标题）输出一致，
+但整段回复只按行切分一次，每行依次经过以下阶段后直接输出：
+1. 价格加粗（仅当用户问到价格/预算时）
+2. 列表项前后补空行
+3. 合并连续空行（等价于 re.sub(r'\\n{3,}', '\\n\\n', text)）
+4. 标题前后补空行
+
+原实现中“段落”与“加粗”两步实际不改变文本，这里直接省略。
+价格加粗按匹配位置只处理一次，修复了原实现用 str.replace 导致的两个问题：
+同一价格在一行中出现多次会被重复加粗成 ****200元****，以及已加粗的价格被再次加粗。
+"""
+import re
+
+# 价格相关的正则，按优先级排列：前面的模式已加粗的区域，后面的模式不再处理
+PRICE_PATTERNS = [
+    re.compile(r'(\d+)\s*元'),
+    re.compile(r'¥\s*(\d+)'),
+    re.compile(r'RMB\s*(\d+)'),
+    re.compile(r'人均\s*(\d+)'),
+    re.compile(r'预算\s*(\d+)')
+]
+BOLD_PATTERN = re.compile(r'\*\*(.+?)\*\*')
+DIGIT_PATTERN = re.compile(r'\d')
+
+PRICE_KEYWORDS = ('价格', '预算', '多少钱', '人均', '消费')
+LIST_MARKERS = ('•', '-', '*', '1.', '2.', '3.', '4.', '5.')
+
+
+def wants_price_format(user_input: str) -> bool:
+    """用户是否问到了价格预算"""
+    user_input_lower = user_input.lower()
+    return any(keyword in user_input_lower for keyword in PRICE_KEYWORDS)
+
+
+def bold_prices(line: str) -> str:
+    """给一行中的价格信息加上 ** 强调标记"""
+    if not DIGIT_PATTERN.search(line):
+        return line
+
+    # 已经加粗的区域不再处理
+    taken = [m.span() for m in BOLD_PATTERN.finditer(line)]
+    spans = []
+    for pattern in PRICE_PATTERNS:
+        for match in pattern.finditer(line):
+            start, end = match.span()
+            if all(end <= s or start >= e for s, e in taken):
+                taken.append((start, end))
+                spans.append((start, end))
+
+    if not spans:
+        return line
+
+    spans.sort()
+    parts = []
+    pos = 0
+    for start, end in spans:
+        parts.append(line[pos:start])
+        parts.append('**' + line[start:end] + '**')
+        pos = end
+    parts.append(line[pos:])
+    return ''.join(parts)
+
+
+class _LinePipeline:
+    """逐行处理的格式化流水线，输出行写入 self.out"""
+
+    def __init__(self, format_price: bool):
+        self.format_price = format_price
+        self.out = []
+        self.line_index = 0
+        self.prev_is_list = False
+        self.pending_blanks = 0   # 尚未决定如何合并的连续空行
+        self.seen_content = False
+
+    def push(self, line: str):
+        if self.format_price:
+            line = bold_prices(line)
+
+        # 阶段 2：列表项前补空行，列表结束后补空行
+        is_list = line.lstrip().startswith(LIST_MARKERS)
+        if self.line_index > 0 and (is_list or self.prev_is_list):
+            self._collapse('')
+        self._collapse(line)
+        self.prev_is_list = is_list
+        self.line_index += 1
+
+    def close(self):
+        """输入结束：处理末尾的连续空行"""
+        if self.seen_content:
+            blanks = min(self.pending_blanks, 2)
+        else:
+            # 整段都是空行
+            blanks = min(self.pending_blanks, 3)
+        for _ in range(blanks):
+            self._emit('')
+        self.pending_blanks = 0
+
+    def _collapse(self, line: str):
+        """阶段 3：三个以上的连续换行合并为两个"""
+        if line == '':
+            self.pending_blanks += 1
+            return
+
+        if self.pending_blanks:
+            # 开头的空行最多保留两个，中间的最多保留一个
+            blanks = min(self.pending_blanks, 1 if self.seen_content else 2)
+            for _ in range(blanks):
+                self._emit('')
+            self.pending_blanks = 0
+        self.seen_content = True
+        self._emit(line)
+
+    def _emit(self, line: str):
+        """阶段 4：标题前后补空行"""
+        out = self.out
+        if line.lstrip().startswith('#'):
+            if out and out[-1] != '':
+                out.append('')
+            out.append(line)
+            out.append('')
+        else:
+            out.append(line)
+
+
+def format_reply(reply: str, user_input: str) -> str:
+    """格式化AI回复，使其更易读"""
+    if not reply:
+        return reply
+
+    pipeline = _LinePipeline(wants_price_format(user_input))
+    for line in reply.split('\n'):
+        pipeline.push(line)
+    pipeline.close()
+    return '\n'.join(pipeline.out)
+
+
+class StreamingReplyFormatter:
+    """流式增量格式化：边接收千帆的增量文本边格式化
+
+    feed() 返回本次新确定的格式化文本，finish() 返回剩余部分；
+    所有返回值依次拼接后与 format_reply(完整回复) 完全相同。
+    """
+
+    def __init__(self, user_input: str):
+        self._pipeline = _LinePipeline(wants_price_format(user_input))
+        self._partial = ''
+        self._flushed = 0
+        self._received = False
+
+    def feed(self, chunk: str) -> str:
+        if not chunk:
+            return ''
+        self._received = True
+        lines = (self._partial + chunk).split('\n')
+        self._partial = lines.pop()
+        for line in lines:
+            self._pipeline.push(line)
+        return self._drain()
+
+    def finish(self) -> str:
+        if not self._received:
+            return ''
+        self._pipeline.push(self._partial)
+        self._partial = ''
+        self._pipeline.close()
+        return self._drain()
+
+    def _drain(self) -> str:
+        # 流水线只会在 out 末尾追加，已输出的行不会再被改写
+        out = self._pipeline.out
+        if len(out) == self._flushed:
+            return ''
+        text = '\n'.join(out[self._flushed:])
+        if self._flushed:
+            text = '\n' + text
+        self._flushed = len(out)
+        return text
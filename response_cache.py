@@ -0,0 +1,175 @@
+"""
+回复缓存 - 相同问题（相同历史、相同提示词与模型参数）直接返回已格式化的回复，跳过千帆调用
+
+两级缓存：
+- L1：进程内 LRU，命中时连 Redis 都不访问
+- L2：Redis（复用 app.py 中 SESSION_REDIS 的连接），多个 Worker 共享；
+      每条回复单独一个带 TTL 的 key，另用一个有序集合记录最近访问时间，超出容量时淘汰最久未用的条目
+"""
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+
+import redis
+
+logger = logging.getLogger(__name__)
+
+
+class ResponseCache:
+    # 问句末尾的标点不影响答案：“北京烤鸭哪家好？”与“北京烤鸭哪家好”视为同一个问题
+    _TRAILING = re.compile(r'[\s?？!！。.,，~～]+$')
+    _SPACES = re.compile(r'\s+')
+
+    def __init__(self, redis_client, prefix: str = 'food_bot:reply:', ttl: int = 6 * 3600,
+                 max_entries: int = 10000, l1_size: int = 256, l1_ttl: int = 60, enabled: bool = True):
+        """
+        :param redis_client: redis.Redis 实例，传 None 时只使用进程内缓存
+        :param prefix: Redis key 前缀
+        :param ttl: Redis 中每条回复的存活时间（秒）
+        :param max_entries: Redis 中最多保留的回复条数，超出后按 LRU 淘汰
+        :param l1_size: 进程内缓存的条数上限
+        :param l1_ttl: 进程内缓存的存活时间（秒），较短以便感知 Redis 中的淘汰
+        :param enabled: 关闭后 get 永远不命中、set 什么也不做
+        """
+        self.redis = redis_client
+        self.prefix = prefix
+        self.lru_key = prefix + 'lru'
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.l1_size = l1_size
+        self.l1_ttl = min(l1_ttl, ttl)
+        self.enabled = enabled
+
+        self._l1 = OrderedDict()  # key -> (过期时间, 回复)
+        self._lock = threading.Lock()
+        self._stats = {'l1_hits': 0, 'l2_hits': 0, 'misses': 0, 'stores': 0, 'errors': 0}
+
+    @classmethod
+    def from_env(cls, redis_client) -> "ResponseCache":
+        """从环境变量读取缓存配置，RESPONSE_CACHE_ENABLED=0 可整体关闭"""
+        env = os.environ
+        return cls(
+            redis_client,
+            ttl=int(env.get('RESPONSE_CACHE_TTL', 6 * 3600)),
+            max_entries=int(env.get('RESPONSE_CACHE_MAX_ENTRIES', 10000)),
+            l1_size=int(env.get('RESPONSE_CACHE_L1_SIZE', 256)),
+            l1_ttl=int(env.get('RESPONSE_CACHE_L1_TTL', 60)),
+            enabled=env.get('RESPONSE_CACHE_ENABLED', '1').lower() not in ('0', 'false', 'no')
+        )
+
+    # ---------------- 缓存键 ----------------
+    @classmethod
+    def normalize(cls, text: str) -> str:
+        """归一化用户输入：全角转半角、统一大小写、合并空白、去掉句尾标点"""
+        text = unicodedata.normalize('NFKC', text).lower().strip()
+        text = cls._SPACES.sub(' ', text)
+        return cls._TRAILING.sub('', text)
+
+    @classmethod
+    def make_key(cls, payload: dict) -> str:
+        """根据对话补全的请求体生成缓存键
+
+        键由三部分组成：归一化后的当前输入、实际发送的历史消息、系统提示词与模型参数的哈希。
+        stream 标志不参与计算，流式与非流式请求共用同一份缓存。
+        """
+        messages = payload['messages']
+        system = [m['content'] for m in messages if m['role'] == 'system']
+        history = [[m['role'], m['content']] for m in messages[:-1] if m['role'] != 'system']
+        params = {k: v for k, v in payload.items() if k not in ('messages', 'stream')}
+
+        config_hash = hashlib.sha256(
+            json.dumps([system, params], ensure_ascii=False, sort_keys=True).encode('utf-8')
+        ).hexdigest()
+        raw = json.dumps([cls.normalize(messages[-1]['content']), history, config_hash], ensure_ascii=False)
+        return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+    # ---------------- 读写 ----------------
+    def get(self, key: str):
+        """查询缓存，命中返回格式化后的回复，未命中返回 None"""
+        if not self.enabled:
+            return None
+
+        now = time.time()
+        with self._lock:
+            entry = self._l1.get(key)
+            if entry and entry[0] > now:
+                self._l1.move_to_end(key)
+                self._stats['l1_hits'] += 1
+                return entry[1]
+            if entry:
+                del self._l1[key]
+
+        value = None
+        if self.redis is not None:
+            try:
+                pipe = self.redis.pipeline()
+                pipe.get(self.prefix + key)
+                pipe.zadd(self.lru_key, {key: now}, xx=True)  # 命中时刷新最近访问时间
+                value = pipe.execute()[0]
+            except redis.RedisError as e:
+                logger.warning("[缓存错误] 读取失败: %s", e)
+                self._count('errors')
+
+        if value is None:
+            self._count('misses')
+            return None
+
+        reply = value.decode('utf-8')
+        self._count('l2_hits')
+        self._put_l1(key, reply, now)
+        return reply
+
+    def set(self, key: str, reply: str):
+        """写入缓存（只应写入成功的回复，错误提示不缓存）"""
+        if not self.enabled or not reply:
+            return
+
+        now = time.time()
+        self._put_l1(key, reply, now)
+        self._count('stores')
+
+        if self.redis is None:
+            return
+        try:
+            pipe = self.redis.pipeline()
+            pipe.setex(self.prefix + key, self.ttl, reply.encode('utf-8'))
+            pipe.zadd(self.lru_key, {key: now})
+            # 顺带清掉有序集合中早已过期的条目
+            pipe.zremrangebyscore(self.lru_key, 0, now - self.ttl)
+            pipe.zcard(self.lru_key)
+            size = pipe.execute()[-1]
+
+            if size > self.max_entries:
+                evicted = self.redis.zpopmin(self.lru_key, size - self.max_entries)
+                if evicted:
+                    self.redis.delete(*[self.prefix + k.decode('utf-8') for k, _ in evicted])
+        except redis.RedisError as e:
+            logger.warning("[缓存错误] 写入失败: %s", e)
+            self._count('errors')
+
+    def stats(self) -> dict:
+        """命中/未命中计数"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats['l1_entries'] = len(self._l1)
+        lookups = stats['l1_hits'] + stats['l2_hits'] + stats['misses']
+        stats['hit_rate'] = round((stats['l1_hits'] + stats['l2_hits']) / lookups, 4) if lookups else 0.0
+        stats['enabled'] = self.enabled
+        return stats
+
+    def _put_l1(self, key: str, reply: str, now: float):
+        with self._lock:
+            self._l1[key] = (now + self.l1_ttl, reply)
+            self._l1.move_to_end(key)
+            while len(self._l1) > self.l1_size:
+                self._l1.popitem(last=False)
+
+    def _count(self, name: str):
+        with self._lock:
+            self._stats[name] += 1
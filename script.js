@@ -23,6 +23,18 @@ const surpriseVideo = document.getElementById('surpriseVideo');
 let currentConversationId = null;
 let selectedHistoryId = null;
 let conversations = [];
+let nextConversationCursor = null;
+let conversationTotal = 0;
+const CONVERSATION_PAGE_SIZE = 50;
+let historyCursor = null;       // 当前对话更早一页消息的游标，null 表示已经到头
+let loadingOlderMessages = false;
+const MESSAGE_PAGE_SIZE = 20;
+let sendBlockedUntil = 0; // 服务端返回 429 后，在 Retry-After 到期前不再发送
+let conversationsVersion = null;    // 对话列表的版本号，之后只请求此后变化的对话
+let displayedConversationId = null; // 聊天区域正在显示的对话
+let displayedVersion = null;        // 聊天区域内容对应的对话版本号，null 表示与服务端不一致、不能缓存
+const conversationCache = new Map(); // 对话 ID -> { version, cursor, html }，切换回来时只请求新增的消息
+const CONVERSATION_CACHE_SIZE = 10;
 
 // 初始化粒子流星效果
 function initParticles() {
@@ -134,6 +146,8 @@ document.addEventListener('DOMContentLoaded', async function() {
     // 绑定事件监听器
     sendButton.addEventListener('click', sendMessage);
     messageInput.addEventListener('keydown', handleEnterKey);
+    // 滚动到聊天区域顶部时加载更早的消息
+    chatMessages.addEventListener('scroll', handleChatScroll);
     
     newChatBtn.addEventListener('click', handleNewChatClick);
     surpriseBtn.addEventListener('click', handleSurpriseClick);
@@ -169,20 +183,37 @@ function autoResizeTextarea() {
 // 加载对话列表
 async function loadConversations() {
     try {
-        const response = await fetch('/conversations');
+        // 只加载第一页，其余通过列表底部的“加载更多”按需获取；
+        // 之前加载过时带上版本号，服务端只返回此后变化的对话（delta）
+        const params = new URLSearchParams({ limit: CONVERSATION_PAGE_SIZE });
+        if (conversationsVersion !== null) {
+            params.set('since', conversationsVersion);
+        }
+        const response = await fetch(`/conversations?${params}`);
         const data = await response.json();
         
         if (data.success) {
-            conversations = data.conversations;
+            if (data.delta) {
+                applyConversationDelta(data.conversations, data.removed);
+            } else {
+                conversations = data.conversations;
+                nextConversationCursor = data.next_cursor;
+            }
+            conversationsVersion = data.version;
+            conversationTotal = data.total ?? conversations.length;
             currentConversationId = data.current_conversation_id;
             updateHistoryList();
             
             // 更新对话计数
-            conversationCount.textContent = `(${conversations.length})`;
+            conversationCount.textContent = `(${conversationTotal})`;
             
-            // 如果没有当前对话，加载第一个对话
+            // 如果没有当前对话，加载第一个对话；当前对话已经显示时只更新标题
             if (currentConversationId && conversations.length > 0) {
-                await loadCurrentConversation();
+                if (currentConversationId !== displayedConversationId) {
+                    await loadCurrentConversation();
+                } else {
+                    updateConversationHeader(currentConversationId);
+                }
             } else if (conversations.length > 0) {
                 // 如果没有设置当前对话，设置为第一个对话
                 await selectHistoryItem(conversations[0].id);
@@ -197,6 +228,43 @@ async function loadConversations() {
     }
 }
 
+// 合并增量：删除已删除的对话，用新的元信息替换变化的对话（排序由 updateHistoryList 负责）
+function applyConversationDelta(changed, removed) {
+    const dropped = new Set(removed);
+    changed.forEach(c => dropped.add(c.id));
+    conversations = conversations.filter(c => !dropped.has(c.id)).concat(changed);
+    removed.forEach(id => {
+        conversationCache.delete(id);
+        if (id === displayedConversationId) {
+            displayedConversationId = null;
+        }
+    });
+}
+
+// 加载下一页对话
+async function loadMoreConversations() {
+    if (!nextConversationCursor) return;
+    
+    try {
+        const params = new URLSearchParams({ limit: CONVERSATION_PAGE_SIZE, cursor: nextConversationCursor });
+        const response = await fetch(`/conversations?${params}`);
+        const data = await response.json();
+        
+        if (data.success) {
+            // 翻页期间列表可能有更新，按 ID 去重
+            const loaded = new Set(conversations.map(c => c.id));
+            conversations = conversations.concat(data.conversations.filter(c => !loaded.has(c.id)));
+            nextConversationCursor = data.next_cursor;
+            updateHistoryList();
+        } else {
+            showNotification('加载对话列表失败');
+        }
+    } catch (error) {
+        console.error('加载更多对话失败:', error);
+        showNotification('网络错误，请稍后重试');
+    }
+}
+
 // 更新历史记录列表
 function updateHistoryList() {
     // 清空历史列表
@@ -233,6 +301,15 @@ function updateHistoryList() {
         }
     });
     
+    // 还有下一页时显示“加载更多”
+    if (nextConversationCursor) {
+        const loadMoreBtn = document.createElement('button');
+        loadMoreBtn.className = 'load-more-btn';
+        loadMoreBtn.innerHTML = `<i class="fas fa-chevron-down"></i> 加载更多（${conversations.length}/${conversationTotal}）`;
+        loadMoreBtn.addEventListener('click', loadMoreConversations);
+        historyList.appendChild(loadMoreBtn);
+    }
+    
     // 更新按钮状态
     updateButtonsState();
 }
@@ -335,15 +412,7 @@ async function selectHistoryItem(conversationId) {
             historyItem.classList.add('loading');
         }
         
-        const response = await fetch('/conversations/switch', {
-            method: 'POST',
-            headers: {
-                'Content-Type': 'application/json',
-            },
-            body: JSON.stringify({ conversation_id: conversationId })
-        });
-        
-        const data = await response.json();
+        const data = await fetchConversation(conversationId);
         
         if (data.success) {
             // 移除所有选中状态和加载状态
@@ -362,31 +431,10 @@ async function selectHistoryItem(conversationId) {
             updateButtonsState();
             
             // 更新对话信息
-            const conversation = conversations.find(c => c.id === conversationId);
-            if (conversation) {
-                currentConversationName.textContent = conversation.name;
-                conversationStatus.textContent = `在线 · ${conversation.message_count || 0} 条消息`;
-            } else if (data.conversation_name) {
-                currentConversationName.textContent = data.conversation_name;
-                conversationStatus.textContent = '在线';
-            }
-            
-            // 清空聊天区域并加载历史消息
-            chatMessages.innerHTML = '';
-            
-            // 如果有历史消息，加载它们
-            if (data.history && Array.isArray(data.history) && data.history.length > 0) {
-                data.history.forEach(msg => {
-                    if (msg.content && msg.role) {
-                        addMessage(msg.content, msg.role === 'user' ? 'user' : 'ai');
-                    }
-                });
-            } else {
-                // 如果没有历史消息，显示欢迎消息
-                addMessage("您好！我是食探AI，这是新的对话。请问今天想了解哪个地区或哪种类型的美食呢？", 'ai');
-            }
+            updateConversationHeader(conversationId, data.conversation_name);
             
-            scrollToBottom();
+            renderConversation(conversationId, data,
+                "您好！我是食探AI，这是新的对话。请问今天想了解哪个地区或哪种类型的美食呢？");
         } else {
             alert('切换对话失败: ' + (data.message || '未知错误'));
             
@@ -458,43 +506,15 @@ async function loadCurrentConversation() {
     if (!currentConversationId) return;
     
     try {
-        const response = await fetch('/conversations/switch', {
-            method: 'POST',
-            headers: {
-                'Content-Type': 'application/json',
-            },
-            body: JSON.stringify({ conversation_id: currentConversationId })
-        });
-        
-        const data = await response.json();
+        const conversationId = currentConversationId;
+        const data = await fetchConversation(conversationId);
         
         if (data.success) {
-            // 清空聊天区域
-            chatMessages.innerHTML = '';
-            
             // 更新对话信息
-            const conversation = conversations.find(c => c.id === currentConversationId);
-            if (conversation) {
-                currentConversationName.textContent = conversation.name;
-                conversationStatus.textContent = `在线 · ${conversation.message_count || 0} 条消息`;
-            } else if (data.conversation_name) {
-                currentConversationName.textContent = data.conversation_name;
-                conversationStatus.textContent = '在线';
-            }
+            updateConversationHeader(conversationId, data.conversation_name);
             
-            // 如果有历史消息，加载它们
-            if (data.history && Array.isArray(data.history) && data.history.length > 0) {
-                data.history.forEach(msg => {
-                    if (msg.content && msg.role) {
-                        addMessage(msg.content, msg.role === 'user' ? 'user' : 'ai');
-                    }
-                });
-            } else {
-                // 如果没有历史消息，显示欢迎消息
-                addMessage("您好！我是食探AI，专注于全国美食推荐。我可以根据您的口味偏好、地理位置和用餐场景，为您推荐最合适的美食。请问今天想了解哪个地区或哪种类型的美食呢？", 'ai');
-            }
-            
-            scrollToBottom();
+            renderConversation(conversationId, data,
+                "您好！我是食探AI，专注于全国美食推荐。我可以根据您的口味偏好、地理位置和用餐场景，为您推荐最合适的美食。请问今天想了解哪个地区或哪种类型的美食呢？");
         }
     } catch (error) {
         console.error('加载当前对话失败:', error);
@@ -502,11 +522,133 @@ async function loadCurrentConversation() {
     }
 }
 
-// 发送消息到Flask后端（修复版：确保在当前对话中发送）
+// 切换到对话：先缓存正在显示的对话；目标对话有缓存时带上缓存的版本号，服务端只返回此后新增的消息
+async function fetchConversation(conversationId) {
+    cacheDisplayedConversation();
+    const body = { conversation_id: conversationId };
+    const cached = conversationCache.get(conversationId);
+    if (cached) {
+        body.since = cached.version;
+    }
+    
+    const response = await fetch('/conversations/switch', {
+        method: 'POST',
+        headers: {
+            'Content-Type': 'application/json',
+        },
+        body: JSON.stringify(body)
+    });
+    return response.json();
+}
+
+// 显示对话消息：增量响应在缓存的内容后面追加新消息，否则清空后显示最后一页（更早的滚动到顶部时再加载）
+function renderConversation(conversationId, data, welcomeMessage) {
+    const cached = conversationCache.get(conversationId);
+    conversationCache.delete(conversationId);
+    
+    if (data.delta && cached) {
+        chatMessages.innerHTML = cached.html;
+        historyCursor = cached.cursor;
+    } else {
+        chatMessages.innerHTML = '';
+        historyCursor = data.history_cursor ?? null;
+    }
+    
+    const history = Array.isArray(data.history) ? data.history : [];
+    history.forEach(msg => {
+        if (msg.content && msg.role) {
+            addMessage(msg.content, msg.role === 'user' ? 'user' : 'ai');
+        }
+    });
+    
+    // 如果没有历史消息，显示欢迎消息
+    if (!chatMessages.hasChildNodes()) {
+        addMessage(welcomeMessage, 'ai');
+    }
+    
+    displayedConversationId = conversationId;
+    displayedVersion = data.version ?? null;
+    scrollToBottom();
+}
+
+// 把聊天区域的内容存入缓存，超出数量时淘汰最久未用的
+function cacheDisplayedConversation() {
+    if (!displayedConversationId || displayedVersion === null) return;
+    conversationCache.delete(displayedConversationId);
+    conversationCache.set(displayedConversationId, {
+        version: displayedVersion,
+        cursor: historyCursor,
+        html: chatMessages.innerHTML
+    });
+    while (conversationCache.size > CONVERSATION_CACHE_SIZE) {
+        conversationCache.delete(conversationCache.keys().next().value);
+    }
+}
+
+// 更新聊天区域顶部的对话名称与消息数
+function updateConversationHeader(conversationId, fallbackName) {
+    const conversation = conversations.find(c => c.id === conversationId);
+    if (conversation) {
+        currentConversationName.textContent = conversation.name;
+        conversationStatus.textContent = `在线 · ${conversation.message_count || 0} 条消息`;
+    } else if (fallbackName) {
+        currentConversationName.textContent = fallbackName;
+        conversationStatus.textContent = '在线';
+    }
+}
+
+// 聊天区域滚动到顶部附近时加载更早的消息
+function handleChatScroll() {
+    if (chatMessages.scrollTop < 80 && historyCursor && !loadingOlderMessages) {
+        loadOlderMessages();
+    }
+}
+
+// 加载当前对话更早的一页消息，插到最前面并保持当前的阅读位置
+async function loadOlderMessages() {
+    const conversationId = currentConversationId;
+    loadingOlderMessages = true;
+    try {
+        const params = new URLSearchParams({ before: historyCursor, limit: MESSAGE_PAGE_SIZE });
+        const response = await fetch(`/conversations/${encodeURIComponent(conversationId)}/messages?${params}`);
+        const data = await response.json();
+        
+        // 加载期间切换了对话，丢弃结果
+        if (conversationId !== currentConversationId) return;
+        
+        if (data.success) {
+            const previousHeight = chatMessages.scrollHeight;
+            const firstMessage = chatMessages.firstChild;
+            data.messages.forEach(msg => {
+                if (msg.content && msg.role) {
+                    const messageDiv = createMessageElement(msg.content, msg.role === 'user' ? 'user' : 'ai');
+                    chatMessages.insertBefore(messageDiv, firstMessage);
+                }
+            });
+            chatMessages.scrollTop += chatMessages.scrollHeight - previousHeight;
+            historyCursor = data.next_cursor;
+        } else {
+            showNotification('加载更早的消息失败');
+        }
+    } catch (error) {
+        console.error('加载更早的消息失败:', error);
+        showNotification('网络错误，请稍后重试');
+    } finally {
+        loadingOlderMessages = false;
+    }
+}
+
+// 发送消息到Flask后端（流式版：边生成边显示）
 async function sendMessage() {
     const message = messageInput.value.trim();
     if (!message) return;
     
+    const waitSeconds = Math.ceil((sendBlockedUntil - Date.now()) / 1000);
+    if (waitSeconds > 0) {
+        showNotification(`发送太频繁啦，请 ${waitSeconds} 秒后再试`);
+        return;
+    }
+    
     // 确保有当前对话
     if (!currentConversationId) {
         // 如果没有当前对话，创建一个
@@ -525,8 +667,8 @@ async function sendMessage() {
     showTypingIndicator();
     
     try {
-        // 调用Flask后端API
-        const response = await fetch('/chat', {
+        // 调用Flask后端流式API
+        const response = await fetch('/chat/stream', {
             method: 'POST',
             headers: {
                 'Content-Type': 'application/json',
@@ -534,17 +676,76 @@ async function sendMessage() {
             body: JSON.stringify({ message: message })
         });
         
-        const data = await response.json();
+        // 被限流或服务繁忙：按 Retry-After 暂停发送，并把问题放回输入框方便重发
+        if (response.status === 429) {
+            removeTypingIndicator();
+            const data = await response.json().catch(() => ({}));
+            const retryAfter = parseInt(response.headers.get('Retry-After'), 10) || data.retry_after || 5;
+            pauseSending(retryAfter);
+            messageInput.value = message;
+            // 聊天区域多了没有保存的消息，不能再作为缓存
+            displayedVersion = null;
+            addMessage(data.reply || `当前咨询的人太多了，请 ${retryAfter} 秒后再试`, 'ai');
+            scrollToBottom();
+            return;
+        }
+        
+        let aiMessage = null;
+        let streamedText = '';
+        let succeeded = false;
+        let finished = false;
+        let job = null;
+        
+        const handleEvent = (event, data) => {
+            if (event === 'job') {
+                // 任务模式：问题已进入生成队列，结果随后在同一个流中到达，或需要查询任务
+                job = data;
+            } else if (event === 'delta') {
+                // 收到第一块内容时，用真正的消息气泡替换输入指示器
+                if (!aiMessage) {
+                    removeTypingIndicator();
+                    aiMessage = addMessage('', 'ai');
+                }
+                streamedText += data.content;
+                aiMessage.querySelector('.message-text').innerHTML = formatAIResponse(streamedText);
+                scrollToBottom();
+            } else if (event === 'done') {
+                removeTypingIndicator();
+                // 用服务端格式化后的完整回复替换流式拼接的原始文本
+                if (aiMessage) {
+                    aiMessage.querySelector('.message-text').innerHTML = formatAIResponse(data.reply);
+                } else {
+                    addMessage(data.reply, 'ai');
+                }
+                // 聊天区域与服务端的这一版对话一致，切换回来时只需要请求此后的消息
+                displayedVersion = data.version ?? null;
+                succeeded = true;
+                finished = true;
+            } else if (event === 'error') {
+                removeTypingIndicator();
+                if (aiMessage) {
+                    aiMessage.remove();
+                }
+                addMessage('抱歉，机器人暂时无法回复：' + data.reply, 'ai');
+                displayedVersion = null;
+                finished = true;
+            }
+            // status / timeout 只表示任务还没结束，继续等待
+        };
+        
+        await readEventStream(response, handleEvent);
+        
+        // 流结束时任务还没有结果（Flask 入口不等待，或 ASGI 入口的推送超时）：查询任务直到结束
+        if (job && !finished) {
+            const result = await pollChatJob(job);
+            handleEvent(result.status === 'done' ? 'done' : 'error', result);
+        }
         
         removeTypingIndicator();
         
-        if (data.success) {
-            addMessage(data.reply, 'ai');
-            
-            // 更新对话列表
+        if (succeeded) {
+            // 更新对话列表（只取变化的对话，当前对话已经显示，不再重新加载）
             await loadConversations();
-        } else {
-            addMessage('抱歉，机器人暂时无法回复：' + data.reply, 'ai');
         }
         
         // 滚动到底部
@@ -554,12 +755,97 @@ async function sendMessage() {
         removeTypingIndicator();
         console.error('Error:', error);
         addMessage('抱歉，网络请求失败，请检查网络连接。', 'ai');
+        displayedVersion = null;
         scrollToBottom();
     }
 }
 
+// 在 seconds 秒内禁用发送按钮，按钮上显示倒计时
+function pauseSending(seconds) {
+    sendBlockedUntil = Date.now() + seconds * 1000;
+    sendButton.disabled = true;
+    const originalTitle = sendButton.title;
+    
+    const timer = setInterval(() => {
+        const remaining = Math.ceil((sendBlockedUntil - Date.now()) / 1000);
+        if (remaining > 0) {
+            sendButton.title = `${remaining} 秒后可以再次发送`;
+            return;
+        }
+        clearInterval(timer);
+        sendButton.disabled = false;
+        sendButton.title = originalTitle;
+    }, 1000);
+}
+
+// 逐条解析 Server-Sent Events 响应
+// 任务模式下查询生成任务直到结束：ASGI 入口按 wait 长轮询，Flask 入口立即返回，
+// 两次查询之间按指数退避等待（0.5 秒起，最长 5 秒），总共最多等待 CHAT_JOB_POLL_TIMEOUT 毫秒
+const CHAT_JOB_POLL_TIMEOUT = 180000;
+
+async function pollChatJob(job) {
+    const deadline = Date.now() + CHAT_JOB_POLL_TIMEOUT;
+    let delay = 500;
+    while (Date.now() < deadline) {
+        const response = await fetch(`${job.poll_url}?wait=20`);
+        const data = await response.json().catch(() => ({}));
+        if (response.status === 404) {
+            return { status: 'failed', reply: data.reply || '任务不存在或已过期' };
+        }
+        if (data.status === 'done' || data.status === 'failed') {
+            return data;
+        }
+        await new Promise(resolve => setTimeout(resolve, delay));
+        delay = Math.min(delay * 2, 5000);
+    }
+    return { status: 'failed', reply: '生成时间过长，请稍后刷新对话查看' };
+}
+
+async function readEventStream(response, onEvent) {
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder('utf-8');
+    let buffer = '';
+    
+    while (true) {
+        const { value, done } = await reader.read();
+        if (done) break;
+        
+        buffer += decoder.decode(value, { stream: true });
+        
+        // 事件之间以空行分隔
+        let boundary;
+        while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+            const rawEvent = buffer.slice(0, boundary);
+            buffer = buffer.slice(boundary + 2);
+            
+            let event = 'message';
+            let data = '';
+            rawEvent.split('\n').forEach(line => {
+                if (line.startsWith('event:')) {
+                    event = line.slice(6).trim();
+                } else if (line.startsWith('data:')) {
+                    data += line.slice(5).trim();
+                }
+            });
+            
+            if (data) {
+                onEvent(event, JSON.parse(data));
+            }
+        }
+    }
+}
+
 // 添加消息到聊天区域（增强版：格式化AI回复）
 function addMessage(content, sender) {
+    const messageDiv = createMessageElement(content, sender);
+    chatMessages.appendChild(messageDiv);
+    scrollToBottom();
+    
+    return messageDiv;
+}
+
+// 创建消息气泡（不插入页面）
+function createMessageElement(content, sender) {
     const messageDiv = document.createElement('div');
     messageDiv.className = `message message-${sender} ${sender}-message`;
     
@@ -586,8 +872,7 @@ function addMessage(content, sender) {
         </div>
     `;
     
-    chatMessages.appendChild(messageDiv);
-    scrollToBottom();
+    return messageDiv;
 }
 
 // 格式化AI回复
@@ -0,0 +1,201 @@
+"""
+按路由声明的 Session 访问方式 - 不需要 Session 的请求不读 Redis，没有改动的 Session 不写回
+
+Flask-Session 在每个请求开始时从 Redis 读取 Session、结束时整块写回（SESSION_PERMANENT 下
+连 /static 和 /status 轮询也不例外）。这里包装原来的 SessionInterface：
+- 请求开始时不读 Redis，返回一个 LazySession，路由第一次读写 session 时才真正加载
+- 路由用 @session_access(...) 声明访问方式：
+    none   不使用 Session（静态文件、探针、指标）；访问 session 视为程序错误
+    read   只读；已有的 Session 不写回，只有新访客的初始化（mark_bootstrap）会保存
+    write  默认值；只有修改过的键会写回：保存前重新读取 Redis 中的 Session，只覆盖本请求改动的键，
+           避免同一用户并发的请求互相覆盖；没有改动（包括改动后的值与 Redis 中相同，如切换到当前对话）
+           时不写，只在距上次保存超过 refresh_interval 时写一次以延长 Session 与 Cookie 的有效期；
+           不写时也就不会递增近端缓存的版本号（见 session_cache.py）
+- session_load / session_save 阶段只统计真正访问了 Redis 的请求
+"""
+import logging
+import threading
+import time
+from collections.abc import MutableMapping
+
+from flask import request
+from flask.sessions import SessionMixin
+
+from telemetry import stage
+
+logger = logging.getLogger(__name__)
+
+SESSION_NONE = 'none'
+SESSION_READ = 'read'
+SESSION_WRITE = 'write'
+
+# 每次保存时写入的时间戳，用于判断是否需要刷新有效期
+SAVED_AT_KEY = '_saved_at'
+
+
+def session_access(mode: str):
+    """声明路由的 Session 访问方式：@session_access(SESSION_READ)，写在 @app.route 下面"""
+    if mode not in (SESSION_NONE, SESSION_READ, SESSION_WRITE):
+        raise ValueError(f'未知的 Session 访问方式: {mode}')
+
+    def decorator(view):
+        view.session_access = mode
+        return view
+    return decorator
+
+
+class LazySession(SessionMixin, MutableMapping):
+    """第一次读写时才从 Redis 加载的 Session，并记录本请求改动过的键"""
+
+    def __init__(self, load):
+        self._load = load
+        self._inner = None
+        self.changed_keys = set()
+        self.bootstrapped = False
+
+    @property
+    def loaded(self) -> bool:
+        return self._inner is not None
+
+    @property
+    def inner(self):
+        if self._inner is None:
+            self._inner = self._load()
+        return self._inner
+
+    @property
+    def sid(self):
+        return self.inner.sid
+
+    @property
+    def modified(self) -> bool:
+        return bool(self.changed_keys)
+
+    @modified.setter
+    def modified(self, value):
+        # 兼容直接设置 session.modified = True 的写法：视为所有键都改动过
+        if value and self.loaded:
+            self.changed_keys.update(self._inner.keys())
+
+    accessed = property(lambda self: self.loaded)
+
+    def __getitem__(self, key):
+        return self.inner[key]
+
+    def __setitem__(self, key, value):
+        self.inner[key] = value
+        self.changed_keys.add(key)
+
+    def __delitem__(self, key):
+        del self.inner[key]
+        self.changed_keys.add(key)
+
+    def __iter__(self):
+        return iter(self.inner)
+
+    def __len__(self):
+        return len(self.inner)
+
+    def __contains__(self, key):
+        return key in self.inner
+
+
+def mark_bootstrap(session):
+    """路由为新访客初始化了 Session（分配用户 ID、创建默认对话）：只读路由也需要保存这次改动"""
+    session.bootstrapped = True
+
+
+class LazySessionInterface:
+    """包装 Flask-Session 的 RedisSessionInterface，其余属性原样转发"""
+
+    def __init__(self, inner, refresh_interval: float = 3600, endpoint_modes: dict = None):
+        """
+        :param inner: 原来的 SessionInterface
+        :param refresh_interval: Session 没有改动时，距上次保存超过这么多秒才写回一次以延长有效期，
+                                 应明显小于 PERMANENT_SESSION_LIFETIME
+        :param endpoint_modes: 无法加装饰器的端点的访问方式，例如 Flask 内置的 static
+        """
+        self.inner = inner
+        self.refresh_interval = refresh_interval
+        self.endpoint_modes = {'static': SESSION_NONE, None: SESSION_NONE, **(endpoint_modes or {})}
+        self._stats = {'loads': 0, 'saves': 0, 'refreshes': 0, 'skipped_saves': 0}
+        self._lock = threading.Lock()
+
+    def mode(self, app) -> str:
+        endpoint = request.endpoint
+        if endpoint in self.endpoint_modes:
+            return self.endpoint_modes[endpoint]
+        return getattr(app.view_functions.get(endpoint), 'session_access', SESSION_WRITE)
+
+    def open_session(self, app, req):
+        def load():
+            # URL 在打开 Session 之后才匹配，访问方式要到第一次访问时才能确定
+            if self.mode(app) == SESSION_NONE:
+                raise RuntimeError(f'{request.endpoint} 声明为不使用 Session')
+            self._count('loads')
+            with stage('session_load'):
+                return self.inner.open_session(app, req) or self.inner.make_null_session(app)
+        return LazySession(load)
+
+    def save_session(self, app, session, response):
+        if not session.loaded or self.inner.is_null_session(session.inner):
+            return
+        mode = self.mode(app)
+        if mode == SESSION_READ and not session.bootstrapped:
+            self._skip(session)
+            return
+        inner = session.inner
+        changed = session.modified
+        if changed:
+            inner, changed = self._merge_stored(inner, session.changed_keys)
+        if not changed:
+            if time.time() - inner.get(SAVED_AT_KEY, 0) < self.refresh_interval:
+                self._skip(session)
+                return
+            self._count('refreshes')
+        if inner:
+            inner[SAVED_AT_KEY] = int(time.time())
+        self._count('saves')
+        with stage('session_save'):
+            return self.inner.save_session(app, inner, response)
+
+    def _merge_stored(self, inner, changed_keys):
+        """以 Redis 中当前的 Session 为底，只覆盖本请求改动过的键
+        :return: (要保存的 Session, 与 Redis 中的是否不同)
+        """
+        raw = self.inner.redis.get(self.inner.key_prefix + inner.sid)
+        if raw is None:
+            return inner, True
+        try:
+            stored = self.inner.serializer.loads(raw)
+        except Exception:
+            return inner, True
+        changed = False
+        for key in changed_keys:
+            if key in inner:
+                changed = changed or key not in stored or stored[key] != inner[key]
+                stored[key] = inner[key]
+            elif key in stored:
+                changed = True
+                del stored[key]
+        merged = self.inner.session_class(stored, sid=inner.sid)
+        merged.modified = True
+        return merged, changed
+
+    def _skip(self, session):
+        if session.modified:
+            # 只读路由修改了 Session：改动不会保存，通常说明访问方式声明错了
+            logger.warning("[Session] %s 为只读路由，改动未保存: %s",
+                           request.endpoint, sorted(session.changed_keys))
+        self._count('skipped_saves')
+
+    def _count(self, name):
+        with self._lock:
+            self._stats[name] += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return dict(self._stats)
+
+    def __getattr__(self, name):
+        return getattr(self.inner, name)
@@ -0,0 +1,144 @@
+"""
+Session 近端缓存 - 在 Flask-Session 与 Redis 之间加一层进程内 LRU，带版本号校验
+
+Flask-Session 每个请求都从 Redis 取回并反序列化整个 Session，/status 轮询、/conversations 刷新
+也不例外，而同一个 Worker 往往刚刚读写过这个 Session。这里替换 RedisSessionInterface.redis：
+- 每个 Session 旁边有一个版本号 key（<session key>:ver），写入时与 Session 在同一个事务中 INCR
+- 读取时本地有缓存就只 GET 版本号（几个字节），与缓存的版本一致则直接用缓存，
+  不一致或本地没有时在一个事务中同时取回 Session 与版本号
+- max_stale 秒内刚校验过的缓存连版本号都不查（默认 0，即每次都校验）；
+  只有同一用户的请求固定落到同一 Worker 时才适合调大，否则可能读到其他 Worker 写入前的旧值
+- 条目数与存活时间都有上限，命中率等统计导出到 /status 与 /metrics
+- 只有真正写入时才递增版本号：没有改动的 Session 由 session_access.py 跳过，不会走到 setex
+
+Flask-Session 只用到 get / setex / delete，其余属性原样转发给底层的 redis 客户端。
+没有版本号的旧 Session（本功能上线前写入）不缓存，下次写入后开始缓存。
+"""
+import os
+import threading
+from collections import OrderedDict
+from time import monotonic
+
+
+class SessionNearCache:
+    def __init__(self, redis_client, max_entries: int = 10000, ttl: float = 300, max_stale: float = 0,
+                 enabled: bool = True):
+        """
+        :param redis_client: redis.Redis 实例
+        :param max_entries: 进程内最多缓存的 Session 数，超出时淘汰最久未用的
+        :param ttl: 缓存条目的存活时间（秒），到期后重新从 Redis 取回
+        :param max_stale: 上次校验后多少秒内不再查询版本号
+        :param enabled: 关闭后所有操作直接访问 Redis（仍然维护版本号，便于随时打开）
+        """
+        self.redis = redis_client
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_stale = max_stale
+        self.enabled = enabled
+
+        self._entries = OrderedDict()   # key -> [数据, 版本号, 缓存时间, 上次校验时间]
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'unchecked_hits': 0, 'stale': 0, 'misses': 0, 'writes': 0, 'evictions': 0}
+
+    @classmethod
+    def from_env(cls, redis_client) -> "SessionNearCache":
+        env = os.environ
+        return cls(
+            redis_client,
+            max_entries=int(env.get('SESSION_CACHE_SIZE', 10000)),
+            ttl=float(env.get('SESSION_CACHE_TTL', 300)),
+            max_stale=float(env.get('SESSION_CACHE_MAX_STALE', 0)),
+            enabled=env.get('SESSION_CACHE_ENABLED', '1').lower() not in ('0', 'false', 'no')
+        )
+
+    @staticmethod
+    def _version_key(name):
+        return f'{name}:ver'
+
+    # ---------------- Flask-Session 使用的接口 ----------------
+    def get(self, name):
+        if not self.enabled:
+            return self.redis.get(name)
+        now = monotonic()
+        with self._lock:
+            entry = self._entries.get(name)
+            if entry is not None and now - entry[2] > self.ttl:
+                del self._entries[name]
+                entry = None
+            if entry is not None:
+                self._entries.move_to_end(name)
+                if now - entry[3] <= self.max_stale:
+                    self._stats['unchecked_hits'] += 1
+                    return entry[0]
+                value, version = entry[0], entry[1]
+
+        if entry is not None:
+            if self.redis.get(self._version_key(name)) == version:
+                with self._lock:
+                    entry[3] = now
+                    self._stats['hits'] += 1
+                return value
+            self._count('stale')
+        else:
+            self._count('misses')
+
+        pipe = self.redis.pipeline(transaction=True)
+        pipe.get(name)
+        pipe.get(self._version_key(name))
+        value, version = pipe.execute()
+        if value is not None and version is not None:
+            self._store(name, value, version, now)
+        else:
+            self._drop(name)
+        return value
+
+    def setex(self, name, time, value):
+        # 参数名与 redis.Redis.setex 一致，Flask-Session 按关键字传参
+        pipe = self.redis.pipeline(transaction=True)
+        pipe.setex(name, time, value)
+        pipe.incr(self._version_key(name))
+        pipe.expire(self._version_key(name), time)
+        _, version, _ = pipe.execute()
+        self._count('writes')
+        if self.enabled:
+            if isinstance(value, str):
+                value = value.encode('utf-8')
+            # redis 返回的版本号是 bytes，保持同样的类型便于比较
+            self._store(name, value, str(version).encode(), monotonic())
+        return True
+
+    def delete(self, *names):
+        self._drop(*names)
+        return self.redis.delete(*names, *[self._version_key(n) for n in names])
+
+    def __getattr__(self, name):
+        return getattr(self.redis, name)
+
+    # ---------------- 内部 ----------------
+    def _store(self, name, value, version, now):
+        with self._lock:
+            self._entries[name] = [value, version, now, now]
+            self._entries.move_to_end(name)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._stats['evictions'] += 1
+
+    def _drop(self, *names):
+        with self._lock:
+            for name in names:
+                self._entries.pop(name, None)
+
+    def _count(self, name):
+        with self._lock:
+            self._stats[name] += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+            stats['size'] = len(self._entries)
+        hits = stats['hits'] + stats['unchecked_hits']
+        lookups = hits + stats['stale'] + stats['misses']
+        stats['hit_rate'] = round(hits / lookups, 4) if lookups else 0.0
+        stats['enabled'] = self.enabled
+        return stats
+
@@ -0,0 +1,125 @@
+"""
+Session 编解码 - 替换 Flask-Session 默认的 pickle：紧凑编码 + 超过阈值时压缩 + 带版本的格式头
+
+Flask-Session 0.5 用 pickle 把整个 Session 字典写进 Redis（food_bot:<sid>），pickle 的协议头、
+类名和 Python 对象结构都占字节，且只能由 Python 读取。这里的格式：
+
+    [0:2]  MAGIC  b'\\xfbS'
+    [2]    格式版本（目前为 1）
+    [3]    压缩方式：0 不压缩 / 1 zlib / 2 zstd
+    [4:]   负载：Flask 的 TaggedJSON（与 Flask 默认的 Cookie Session 相同，支持 bytes、datetime、
+           tuple、UUID 等类型）按 UTF-8 紧凑输出，需要时再压缩
+
+- 负载小于 threshold 字节时不压缩（小 Session 压缩后反而更大）；压缩后没有变小时也保留原文
+- zstd 需要安装 zstandard（可选依赖），未安装时退回 zlib；解码按格式头选择，与当前配置无关
+- 迁移：读到没有 MAGIC 的旧数据时交给 legacy 解码器（默认 pickle.loads），
+  请求结束时 Flask-Session 会用新格式写回，旧 Session 在下次访问时自动完成迁移；
+  迁移完成后可以设置 SESSION_LEGACY_PICKLE=0 关闭 pickle 解码
+
+同样的格式也用于对话存储中的消息（conversation_store.py，消息只含 JSON 类型，不打标签），旧消息按 JSON 读取。
+基准测试见 benchmarks/bench_session_codec.py。
+"""
+import json
+import logging
+import os
+import pickle
+import zlib
+
+from flask.json.tag import TaggedJSONSerializer
+
+try:
+    import zstandard                      # 可选：pip install zstandard
+except ImportError:
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b'\xfbS'
+FORMAT_VERSION = 1
+HEADER_SIZE = len(MAGIC) + 2
+
+RAW, ZLIB, ZSTD = 0, 1, 2
+COMPRESSION_IDS = {'none': RAW, 'zlib': ZLIB, 'zstd': ZSTD}
+
+
+class SessionCodec:
+    def __init__(self, compression: str = 'zlib', threshold: int = 512, level: int = None,
+                 legacy=pickle.loads, tagged: bool = True):
+        """
+        :param compression: 'none' / 'zlib' / 'zstd'
+        :param threshold: 负载达到这个字节数才尝试压缩
+        :param level: 压缩级别，默认 zlib 6、zstd 3
+        :param legacy: 解码旧格式（没有 MAGIC）数据的函数，None 表示不兼容旧数据
+        :param tagged: 是否用 TaggedJSON 保留 JSON 以外的类型；数据只含 JSON 类型时关掉可省去逐层打标签的开销
+        """
+        if compression not in COMPRESSION_IDS:
+            raise ValueError(f'不支持的压缩方式: {compression}')
+        if compression == 'zstd' and zstandard is None:
+            logger.warning("[Session] 未安装 zstandard，改用 zlib 压缩")
+            compression = 'zlib'
+        self.compression = compression
+        self.threshold = threshold
+        self.level = level if level is not None else (3 if compression == 'zstd' else 6)
+        self.legacy = legacy
+        self.tagged = tagged
+        self._tagger = TaggedJSONSerializer()
+        self._zstd_compressor = None
+        self._zstd_decompressor = None
+        if zstandard is not None:
+            self._zstd_decompressor = zstandard.ZstdDecompressor()
+            if compression == 'zstd':
+                self._zstd_compressor = zstandard.ZstdCompressor(level=self.level)
+
+    @classmethod
+    def from_env(cls, legacy=pickle.loads) -> "SessionCodec":
+        env = os.environ
+        level = env.get('SESSION_COMPRESS_LEVEL')
+        return cls(
+            compression=env.get('SESSION_COMPRESSION', 'zlib').lower(),
+            threshold=int(env.get('SESSION_COMPRESS_THRESHOLD', 512)),
+            level=int(level) if level else None,
+            legacy=legacy if env.get('SESSION_LEGACY_PICKLE', '1').lower() not in ('0', 'false', 'no') else None
+        )
+
+    def variant(self, legacy, tagged: bool) -> "SessionCodec":
+        """压缩配置相同、旧格式与标签设置不同的编解码器（对话消息只含 JSON 类型，旧格式是 JSON）"""
+        return SessionCodec(self.compression, self.threshold, self.level, legacy, tagged)
+
+    def dumps(self, value) -> bytes:
+        if self.tagged:
+            value = self._tagger.tag(value)
+        payload = json.dumps(value, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+        method = RAW
+        if self.compression != 'none' and len(payload) >= self.threshold:
+            if self.compression == 'zstd':
+                packed = self._zstd_compressor.compress(payload)
+            else:
+                packed = zlib.compress(payload, self.level)
+            if len(packed) < len(payload):
+                payload, method = packed, COMPRESSION_IDS[self.compression]
+        return MAGIC + bytes((FORMAT_VERSION, method)) + payload
+
+    def loads(self, data):
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        if not data.startswith(MAGIC):
+            if self.legacy is None:
+                raise ValueError('不是 SessionCodec 格式的数据')
+            return self.legacy(data)
+        if len(data) < HEADER_SIZE:
+            raise ValueError('数据不完整')
+        version, method = data[2], data[3]
+        if version != FORMAT_VERSION:
+            raise ValueError(f'不支持的格式版本: {version}')
+        payload = data[HEADER_SIZE:]
+        if method == ZLIB:
+            payload = zlib.decompress(payload)
+        elif method == ZSTD:
+            if self._zstd_decompressor is None:
+                raise ValueError('数据使用 zstd 压缩，但未安装 zstandard')
+            payload = self._zstd_decompressor.decompress(payload)
+        elif method != RAW:
+            raise ValueError(f'未知的压缩方式: {method}')
+        if self.tagged:
+            return json.loads(payload, object_hook=self._tagger.untag)
+        return json.loads(payload)
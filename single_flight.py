@@ -0,0 +1,400 @@
+"""
+请求合并（single-flight）- 相同请求同一时刻只调用一次千帆，其余请求等待并共享结果
+
+热门问题在同一时刻被很多用户提出时，只有第一个请求（leader）真正调用千帆，
+其余请求（follower）挂在它上面等待结果：
+- 进程内：按请求体哈希登记正在进行的调用，follower 用条件变量等待；
+  流式调用时 leader 每收到一块增量就广播给 follower，follower 同样逐块输出
+- 跨 Worker（可选，需 Redis）：leader 用 SET NX 抢占锁，其他 Worker 的请求订阅对应频道，
+  leader 完成后把完整回复 PUBLISH 出去；leader 失败或超时时 follower 自己调用千帆
+
+合并的是千帆返回的原始文本，格式化仍由各请求自己完成。
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+
+import redis
+
+logger = logging.getLogger(__name__)
+
+
+class FlightError(Exception):
+    """等待的相同请求没有给出结果（等待超时或发起者中断）"""
+
+
+class _Call:
+    """一次正在进行的调用"""
+
+    def __init__(self):
+        self.cond = threading.Condition()
+        self.chunks = []      # 流式调用已收到的增量
+        self.done = False
+        self.result = None    # 完整的原始回复
+        self.error = None
+        self.waiters = 0      # 正在等待结果的 follower 数，follower 超时或断开时减一
+
+    def add_waiter(self):
+        with self.cond:
+            self.waiters += 1
+
+    def remove_waiter(self):
+        with self.cond:
+            self.waiters -= 1
+
+    def has_waiters(self) -> bool:
+        with self.cond:
+            return self.waiters > 0
+
+    def push(self, chunk):
+        with self.cond:
+            self.chunks.append(chunk)
+            self.cond.notify_all()
+
+    def finish(self, result=None, error=None):
+        with self.cond:
+            self.result = result
+            self.error = error
+            self.done = True
+            self.cond.notify_all()
+
+
+class SingleFlight:
+    def __init__(self, redis_client=None, prefix: str = 'food_bot:flight:', lock_ttl: int = 90,
+                 wait_timeout: int = 90, enabled: bool = True):
+        """
+        :param redis_client: redis.Redis 实例，传入时跨 Worker 合并，None 时只在进程内合并
+        :param prefix: Redis key / 频道前缀
+        :param lock_ttl: 跨 Worker 锁的过期时间（秒），leader 崩溃时锁会自动释放
+        :param wait_timeout: follower 最长等待时间（秒），超时后自己调用千帆
+        :param enabled: 关闭后每个请求都直接调用
+        """
+        self.redis = redis_client
+        self.prefix = prefix
+        self.lock_ttl = lock_ttl
+        self.wait_timeout = wait_timeout
+        self.enabled = enabled
+
+        self._calls = {}
+        self._lock = threading.Lock()
+        self._stats = {'leaders': 0, 'coalesced': 0, 'remote_coalesced': 0,
+                       'remote_fallbacks': 0, 'timeouts': 0, 'errors': 0}
+
+    @classmethod
+    def from_env(cls, redis_client) -> "SingleFlight":
+        """从环境变量读取配置；SINGLE_FLIGHT_REDIS=1 时开启跨 Worker 合并"""
+        env = os.environ
+        cross_worker = env.get('SINGLE_FLIGHT_REDIS', '0').lower() in ('1', 'true', 'yes')
+        return cls(
+            redis_client if cross_worker else None,
+            lock_ttl=int(env.get('SINGLE_FLIGHT_LOCK_TTL', 90)),
+            wait_timeout=int(env.get('SINGLE_FLIGHT_WAIT_TIMEOUT', 90)),
+            enabled=env.get('SINGLE_FLIGHT_ENABLED', '1').lower() not in ('0', 'false', 'no')
+        )
+
+    @staticmethod
+    def make_key(payload: dict) -> str:
+        """请求体（系统提示词 + 历史 + 当前输入 + 模型参数）的哈希；stream 标志不参与计算"""
+        canonical = {k: v for k, v in payload.items() if k != 'stream'}
+        raw = json.dumps(canonical, ensure_ascii=False, sort_keys=True, separators=(',', ':'))
+        return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+    # ---------------- 对外接口 ----------------
+    def do(self, key: str, fn):
+        """执行 fn() 并返回结果；同一 key 已有调用在进行时等待并共享它的结果"""
+        if not self.enabled:
+            return fn()
+
+        call, leader = self._join(key)
+        if not leader:
+            return self._wait(call)
+
+        try:
+            result = self._lead(key, fn)
+        except Exception as e:
+            self._leave(key, call, error=e)
+            raise
+        self._leave(key, call, result=result)
+        return result
+
+    def stream(self, key: str, fn):
+        """流式版本：fn() 返回增量文本的迭代器，本方法返回的生成器逐块产出增量
+
+        follower 会收到与 leader 相同的增量序列；如果 leader 是非流式调用，follower 在结束时一次收到完整回复。
+        """
+        if not self.enabled:
+            yield from fn()
+            return
+
+        call, leader = self._join(key)
+        if not leader:
+            yield from self._follow(call)
+            return
+
+        chunks = []
+        source = self._lead_stream(key, fn)
+        try:
+            for chunk in source:
+                chunks.append(chunk)
+                call.push(chunk)
+                yield chunk
+        except GeneratorExit:
+            # 发起者断开了连接：还有请求在等就继续把回复读完交给它们，等待的请求都离开后立即停止读取
+            error = None
+            try:
+                while call.has_waiters():
+                    chunk = next(source)
+                    chunks.append(chunk)
+                    call.push(chunk)
+                error = FlightError('发起请求的连接已断开')
+                source.close()
+            except StopIteration:
+                pass
+            except Exception as e:
+                error = e
+            self._leave(key, call, result=None if error else ''.join(chunks), error=error)
+            raise
+        except Exception as e:
+            self._leave(key, call, error=e)
+            raise
+        self._leave(key, call, result=''.join(chunks))
+
+    def stats(self) -> dict:
+        """合并计数"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats['in_flight'] = len(self._calls)
+        stats['enabled'] = self.enabled
+        stats['cross_worker'] = self.redis is not None
+        return stats
+
+    # ---------------- 进程内 ----------------
+    def _join(self, key):
+        """登记调用，返回 (调用, 是否为 leader)"""
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None:
+                call.add_waiter()
+                self._stats['coalesced'] += 1
+                return call, False
+            call = self._calls[key] = _Call()
+            self._stats['leaders'] += 1
+            return call, True
+
+    def _leave(self, key, call, result=None, error=None):
+        with self._lock:
+            if self._calls.get(key) is call:
+                del self._calls[key]
+        call.finish(result, error)
+
+    def _wait(self, call):
+        try:
+            with call.cond:
+                done = call.cond.wait_for(lambda: call.done, timeout=self.wait_timeout)
+        finally:
+            call.remove_waiter()
+        if not done:
+            self._count('timeouts')
+            raise FlightError('等待相同请求的结果超时')
+        if call.error is not None:
+            raise call.error
+        return call.result
+
+    def _follow(self, call):
+        sent = 0
+        deadline = time.monotonic() + self.wait_timeout
+        try:
+            while True:
+                with call.cond:
+                    ready = call.cond.wait_for(lambda: call.done or len(call.chunks) > sent,
+                                               timeout=max(0.0, deadline - time.monotonic()))
+                    new_chunks = call.chunks[sent:]
+                    done, result, error = call.done, call.result, call.error
+                if not ready:
+                    self._count('timeouts')
+                    raise FlightError('等待相同请求的结果超时')
+
+                sent += len(new_chunks)
+                yield from new_chunks
+                if done:
+                    if error is not None:
+                        raise error
+                    if not sent and result:
+                        # leader 是非流式调用，没有增量，直接给出完整回复
+                        yield result
+                    return
+        finally:
+            # 超时、出错或客户端断开（GeneratorExit）时都不再算作等待者，leader 据此决定是否继续读取
+            call.remove_waiter()
+
+    # ---------------- 跨 Worker ----------------
+    def _lead(self, key, fn):
+        if self.redis is None:
+            return fn()
+        token = self._acquire(key)
+        if token is None:
+            shared = self._wait_remote(key)
+            if shared is not None:
+                return shared
+            return fn()
+        return self._run_and_publish(key, token, fn)
+
+    def _lead_stream(self, key, fn):
+        if self.redis is None:
+            yield from fn()
+            return
+        token = self._acquire(key)
+        if token is None:
+            shared = self._wait_remote(key)
+            if shared is not None:
+                yield shared
+                return
+            yield from fn()
+            return
+
+        chunks = []
+        try:
+            for chunk in fn():
+                chunks.append(chunk)
+                yield chunk
+        except BaseException:
+            self._publish(key, token, None)
+            raise
+        self._publish(key, token, ''.join(chunks))
+
+    def _run_and_publish(self, key, token, fn):
+        try:
+            result = fn()
+        except BaseException:
+            self._publish(key, token, None)
+            raise
+        self._publish(key, token, result)
+        return result
+
+    def _acquire(self, key):
+        """抢占跨 Worker 锁，成功返回令牌；已被其他 Worker 持有返回 None；Redis 出错时视为抢到锁"""
+        token = uuid.uuid4().hex
+        try:
+            if self.redis.set(self.prefix + 'lock:' + key, token, nx=True, ex=self.lock_ttl):
+                return token
+            return None
+        except redis.RedisError as e:
+            logger.warning("[请求合并] Redis 加锁失败: %s", e)
+            self._count('errors')
+            return token
+
+    def _publish(self, key, token, result):
+        """发布结果（None 表示失败）并释放锁"""
+        lock_key = self.prefix + 'lock:' + key
+        try:
+            pipe = self.redis.pipeline()
+            pipe.publish(self.prefix + 'done:' + key, b'' if result is None else b'1' + result.encode('utf-8'))
+            pipe.get(lock_key)
+            owner = pipe.execute()[1]
+            if owner == token.encode():
+                # 锁可能已过期并被别人抢到，只删除自己的锁
+                self.redis.delete(lock_key)
+        except redis.RedisError as e:
+            logger.warning("[请求合并] Redis 发布结果失败: %s", e)
+            self._count('errors')
+
+    def _wait_remote(self, key):
+        """等待其他 Worker 上的 leader，返回共享的结果；leader 失败、崩溃或超时返回 None"""
+        lock_key = self.prefix + 'lock:' + key
+        pubsub = self.redis.pubsub(ignore_subscribe_messages=True)
+        try:
+            pubsub.subscribe(self.prefix + 'done:' + key)
+            deadline = time.monotonic() + self.wait_timeout
+            while time.monotonic() < deadline:
+                message = pubsub.get_message(timeout=1.0)
+                if message is not None:
+                    data = message['data']
+                    if data:
+                        self._count('remote_coalesced')
+                        return data[1:].decode('utf-8')
+                    break
+                # 订阅之前 leader 可能已经结束（或崩溃），锁不在了就不再等
+                if not self.redis.exists(lock_key):
+                    break
+            else:
+                self._count('timeouts')
+        except redis.RedisError as e:
+            logger.warning("[请求合并] Redis 订阅失败: %s", e)
+            self._count('errors')
+        finally:
+            try:
+                pubsub.close()
+            except redis.RedisError:
+                pass
+        self._count('remote_fallbacks')
+        return None
+
+    def _count(self, name: str):
+        with self._lock:
+            self._stats[name] += 1
+
+
+class AsyncSingleFlight:
+    """SingleFlight 的 asyncio 版本，只在进程（事件循环）内合并
+
+    ASGI 模式下一个进程即可承载大量并发请求，进程内合并已覆盖绝大多数重复调用。
+    """
+
+    def __init__(self, wait_timeout: int = 90, enabled: bool = True):
+        self.wait_timeout = wait_timeout
+        self.enabled = enabled
+        self._calls = {}
+        self._stats = {'leaders': 0, 'coalesced': 0, 'timeouts': 0}
+
+    @classmethod
+    def from_env(cls) -> "AsyncSingleFlight":
+        env = os.environ
+        return cls(
+            wait_timeout=int(env.get('SINGLE_FLIGHT_WAIT_TIMEOUT', 90)),
+            enabled=env.get('SINGLE_FLIGHT_ENABLED', '1').lower() not in ('0', 'false', 'no')
+        )
+
+    make_key = staticmethod(SingleFlight.make_key)
+
+    async def do(self, key: str, fn):
+        """await fn() 并返回结果；同一 key 已有调用在进行时等待并共享它的结果"""
+        if not self.enabled:
+            return await fn()
+
+        future = self._calls.get(key)
+        if future is not None:
+            self._stats['coalesced'] += 1
+            try:
+                # shield：一个 follower 被取消不影响 leader 和其他 follower
+                return await asyncio.wait_for(asyncio.shield(future), self.wait_timeout)
+            except asyncio.TimeoutError:
+                self._stats['timeouts'] += 1
+                raise FlightError('等待相同请求的结果超时')
+
+        future = self._calls[key] = asyncio.get_running_loop().create_future()
+        self._stats['leaders'] += 1
+        try:
+            result = await fn()
+        except BaseException as e:
+            if not future.done():
+                future.set_exception(e if isinstance(e, Exception) else FlightError('发起请求的协程已取消'))
+                # 没有 follower 时避免 “exception was never retrieved” 警告
+                future.exception()
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            if self._calls.get(key) is future:
+                del self._calls[key]
+
+    def stats(self) -> dict:
+        stats = dict(self._stats)
+        stats['in_flight'] = len(self._calls)
+        stats['enabled'] = self.enabled
+        return stats
@@ -0,0 +1,314 @@
+"""
+静态资源构建与发送 - 内容指纹 + 预压缩（gzip / brotli）+ 长期缓存，视频支持按字节范围请求
+
+原来 /static 直接 send_from_directory：没有指纹，浏览器每次访问都要逐个重新验证；
+style.css、script.js 每次都按原文发送；视频拖动进度条时也没有明确的缓存策略。
+这里增加一个构建步骤，把 static/ 下的文件处理到 static/dist/：
+- 文件名带上内容哈希（css/style.<哈希>.css），内容变了地址就变，响应可以设置
+  Cache-Control: public, max-age=一年, immutable，重复访问时浏览器不再发请求
+- 文本类文件（css、js、svg 等）预先压缩出 .gz 与 .br（brotli 需要安装 brotli，可选依赖），
+  只保留确实变小的版本；请求时按 Accept-Encoding 选择，运行时不再压缩
+- 视频等不压缩的大文件优先用硬链接放进 dist，不额外占用磁盘
+- manifest.json 记录原路径到指纹路径的映射，模板通过 asset_url('css/style.css') 取得地址；
+  不在清单里的文件（或没有构建时）退回原地址，按 ETag 重新验证
+- 发送使用 send_file(conditional=True)：支持 If-None-Match / If-Modified-Since 与 Range（206），
+  文件内容由 WSGI 服务器的 file_wrapper 直接发送，拖动视频进度条时只读取需要的部分
+- 重新构建时保留上一次构建的文件，已经打开的旧页面仍能加载旧地址
+
+构建：python static_assets.py build [static 目录]
+默认在启动时检查清单，源文件有变化（大小或修改时间不同）时自动重新构建（STATIC_BUILD_ON_START）。
+"""
+import argparse
+import gzip
+import hashlib
+import json
+import logging
+import mimetypes
+import os
+import shutil
+import sys
+import time
+
+from flask import send_file, send_from_directory
+
+try:
+    import brotli                         # 可选：pip install brotli
+except ImportError:
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static')
+DIST_DIR = 'dist'
+MANIFEST_NAME = 'manifest.json'
+MANIFEST_VERSION = 1
+
+# 值得预压缩的文本类文件；图片、视频本身已经压缩过
+COMPRESSIBLE = {'.css', '.js', '.mjs', '.html', '.svg', '.json', '.txt', '.map', '.xml'}
+MIN_COMPRESS_SIZE = 1024
+# 压缩后至少比原文小这么多才保留
+MAX_COMPRESS_RATIO = 0.9
+# 按优先顺序排列：客户端都接受时先选 brotli
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+
+
+def file_hash(path, chunk_size=1 << 20) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()[:12]
+
+
+def fingerprint(name: str, digest: str) -> str:
+    """css/style.css -> css/style.<哈希>.css"""
+    stem, ext = os.path.splitext(name)
+    return f'{stem}.{digest}{ext}'
+
+
+def compress(data: bytes, encoding: str, brotli_quality: int = 11) -> bytes:
+    if encoding == 'gzip':
+        # mtime=0：同样的内容每次构建得到同样的字节
+        return gzip.compress(data, compresslevel=9, mtime=0)
+    return brotli.compress(data, quality=brotli_quality)
+
+
+class StaticAssets:
+    def __init__(self, static_dir: str, manifest: dict, max_age: int = IMMUTABLE_MAX_AGE):
+        """
+        :param static_dir: 静态文件目录（即 app.static_folder）
+        :param manifest: 构建清单，{原路径: 条目}，见 build
+        :param max_age: 指纹地址的缓存时间（秒）
+        """
+        self.static_dir = static_dir
+        self.dist_dir = os.path.join(static_dir, DIST_DIR)
+        self.assets = manifest
+        self.max_age = max_age
+        # 请求的是 dist/ 下的指纹路径，反查条目
+        self._by_file = {f"{DIST_DIR}/{entry['file']}": entry for entry in manifest.values()}
+
+    # ---------------- 构建 ----------------
+    @staticmethod
+    def sources(static_dir: str) -> list:
+        """static 目录下需要构建的文件（相对路径，使用 /），不含 dist 与隐藏文件"""
+        names = []
+        for root, dirs, files in os.walk(static_dir):
+            rel_root = os.path.relpath(root, static_dir)
+            if rel_root == '.':
+                dirs[:] = [d for d in dirs if d != DIST_DIR]
+            dirs[:] = [d for d in dirs if not d.startswith('.')]
+            for name in files:
+                if not name.startswith('.'):
+                    names.append(os.path.normpath(os.path.join(rel_root, name)).replace(os.sep, '/'))
+        return sorted(names)
+
+    @staticmethod
+    def manifest_path(static_dir: str) -> str:
+        return os.path.join(static_dir, DIST_DIR, MANIFEST_NAME)
+
+    @classmethod
+    def read_manifest(cls, static_dir: str) -> dict:
+        path = cls.manifest_path(static_dir)
+        if not os.path.exists(path):
+            return {}
+        with open(path, encoding='utf-8') as f:
+            data = json.load(f)
+        if data.get('version') != MANIFEST_VERSION:
+            raise ValueError(f"清单格式版本 {data.get('version')} 与当前版本 {MANIFEST_VERSION} 不符")
+        return data['assets']
+
+    @classmethod
+    def is_stale(cls, static_dir: str, manifest: dict) -> bool:
+        """源文件有增删，或大小、修改时间与清单记录的不同"""
+        names = cls.sources(static_dir)
+        if set(names) != set(manifest):
+            return True
+        for name in names:
+            st = os.stat(os.path.join(static_dir, name))
+            entry = manifest[name]
+            if st.st_size != entry['size'] or st.st_mtime_ns != entry['mtime_ns']:
+                return True
+            if not os.path.exists(os.path.join(static_dir, DIST_DIR, entry['file'])):
+                return True
+        return False
+
+    @classmethod
+    def build(cls, static_dir: str, brotli_quality: int = 11) -> dict:
+        """把 static_dir 下的文件处理到 dist/ 并写入清单，返回清单
+        内容没有变化的文件沿用上次的产物；上一次构建的文件保留，更早的删除
+        """
+        dist_dir = os.path.join(static_dir, DIST_DIR)
+        os.makedirs(dist_dir, exist_ok=True)
+        try:
+            previous = cls.read_manifest(static_dir)
+        except ValueError:
+            previous = {}
+        encodings = [(enc, ext) for enc, ext in ENCODINGS if enc != 'br' or brotli is not None]
+
+        manifest = {}
+        for name in cls.sources(static_dir):
+            source = os.path.join(static_dir, name)
+            st = os.stat(source)
+            digest = file_hash(source)
+            target = fingerprint(name, digest)
+            target_path = os.path.join(dist_dir, target)
+            entry = {'file': target, 'hash': digest, 'size': st.st_size, 'mtime_ns': st.st_mtime_ns,
+                     'type': mimetypes.guess_type(name)[0] or 'application/octet-stream', 'encodings': {}}
+            old = previous.get(name)
+            if old and old['hash'] == digest and os.path.exists(target_path):
+                entry['encodings'] = {enc: size for enc, size in old['encodings'].items()
+                                      if os.path.exists(target_path + dict(ENCODINGS)[enc])}
+                manifest[name] = entry
+                continue
+
+            os.makedirs(os.path.dirname(target_path), exist_ok=True)
+            compressible = os.path.splitext(name)[1].lower() in COMPRESSIBLE
+            cls._place(source, target_path, link=not compressible)
+            if compressible and st.st_size >= MIN_COMPRESS_SIZE:
+                with open(source, 'rb') as f:
+                    data = f.read()
+                for enc, ext in encodings:
+                    packed = compress(data, enc, brotli_quality)
+                    if len(packed) <= len(data) * MAX_COMPRESS_RATIO:
+                        cls._write_atomic(target_path + ext, packed)
+                        entry['encodings'][enc] = len(packed)
+            manifest[name] = entry
+
+        cls._write_atomic(cls.manifest_path(static_dir), json.dumps(
+            {'version': MANIFEST_VERSION, 'built_at': int(time.time()), 'assets': manifest},
+            ensure_ascii=False, indent=2).encode('utf-8'))
+        cls._prune(dist_dir, [manifest, previous])
+        return manifest
+
+    @staticmethod
+    def _place(source, target, link: bool):
+        """复制到 dist；视频等大文件用硬链接（不占额外空间），跨文件系统等情况退回复制
+        文本文件总是复制：编辑器原地修改源文件时，硬链接会让已发布的指纹文件跟着变化
+        """
+        tmp = f'{target}.tmp{os.getpid()}'
+        linked = False
+        if link:
+            try:
+                os.link(source, tmp)
+                linked = True
+            except OSError:
+                pass
+        if not linked:
+            shutil.copyfile(source, tmp)
+        os.replace(tmp, target)
+
+    @staticmethod
+    def _write_atomic(path, data: bytes):
+        # 多个进程同时启动时可能同时构建：写临时文件再替换，读到的总是完整文件
+        tmp = f'{path}.tmp{os.getpid()}'
+        with open(tmp, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, path)
+
+    @staticmethod
+    def _prune(dist_dir, manifests):
+        keep = {MANIFEST_NAME}
+        for manifest in manifests:
+            for entry in manifest.values():
+                keep.add(entry['file'])
+                keep.update(entry['file'] + dict(ENCODINGS)[enc] for enc in entry['encodings'])
+        for root, _, files in os.walk(dist_dir):
+            for name in files:
+                path = os.path.join(root, name)
+                rel = os.path.relpath(path, dist_dir).replace(os.sep, '/')
+                if rel not in keep and '.tmp' not in name:
+                    os.remove(path)
+
+    # ---------------- 加载 ----------------
+    @classmethod
+    def load(cls, static_dir: str, **kwargs) -> "StaticAssets":
+        return cls(static_dir, cls.read_manifest(static_dir), **kwargs)
+
+    @classmethod
+    def from_env(cls, static_dir: str = DEFAULT_STATIC_DIR):
+        """STATIC_ASSETS_ENABLED=0 时不启用，返回 None（所有文件按原地址发送）
+        STATIC_BUILD_ON_START=1（默认）时，清单不存在或源文件有变化就先重新构建
+        """
+        env = os.environ
+        if env.get('STATIC_ASSETS_ENABLED', '1').lower() in ('0', 'false', 'no'):
+            return None
+        build_on_start = env.get('STATIC_BUILD_ON_START', '1').lower() not in ('0', 'false', 'no')
+        max_age = int(env.get('STATIC_MAX_AGE', IMMUTABLE_MAX_AGE))
+        try:
+            if not os.path.isdir(static_dir):
+                logger.info("[静态资源] 目录 %s 不存在，按原地址发送", static_dir)
+                return None
+            manifest = cls.read_manifest(static_dir)
+            if build_on_start and cls.is_stale(static_dir, manifest):
+                start = time.perf_counter()
+                manifest = cls.build(static_dir)
+                logger.info("[静态资源] 已重新构建 %d 个文件，用时 %.0f ms",
+                            len(manifest), (time.perf_counter() - start) * 1000)
+        except (OSError, ValueError) as e:
+            logger.warning("[静态资源] 构建清单加载失败，按原地址发送: %s", e)
+            return None
+        return cls(static_dir, manifest, max_age=max_age)
+
+    def stats(self) -> dict:
+        return {
+            'enabled': True,
+            'assets': len(self.assets),
+            'precompressed': sum(1 for entry in self.assets.values() if entry['encodings']),
+            'brotli': brotli is not None
+        }
+
+    # ---------------- 请求 ----------------
+    def url(self, filename: str):
+        """原路径对应的指纹路径（相对 static 目录），不在清单里时返回 None"""
+        entry = self.assets.get(filename)
+        return f"{DIST_DIR}/{entry['file']}" if entry else None
+
+    def send(self, filename: str, request):
+        """发送 /static/<filename>：指纹路径按 Accept-Encoding 选择预压缩版本并长期缓存，其余按原样发送"""
+        entry = self._by_file.get(filename)
+        if entry is None:
+            response = send_from_directory(self.static_dir, filename)
+            # 地址不带指纹，内容可能变化：每次使用前都要重新验证
+            response.cache_control.no_cache = True
+            return response
+
+        path = os.path.join(self.dist_dir, entry['file'])
+        encoding = None
+        for enc, ext in ENCODINGS:
+            # Accept-Encoding 中 q > 0（含通配符 *）才算接受
+            if enc in entry['encodings'] and request.accept_encodings[enc] > 0:
+                encoding, path = enc, path + ext
+                break
+        response = send_file(path, mimetype=entry['type'], conditional=True, max_age=self.max_age,
+                             etag=f"{entry['hash']}-{encoding or 'identity'}")
+        response.cache_control.immutable = True
+        if entry['encodings']:
+            response.vary.add('Accept-Encoding')
+        if encoding:
+            response.content_encoding = encoding
+        return response
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='静态资源构建：内容指纹 + 预压缩')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    build = subparsers.add_parser('build', help='构建 dist/ 与 manifest.json')
+    build.add_argument('static_dir', nargs='?', default=DEFAULT_STATIC_DIR, help='静态文件目录')
+    build.add_argument('--brotli-quality', type=int, default=11, help='brotli 压缩级别（0-11）')
+    args = parser.parse_args(argv)
+
+    if brotli is None:
+        print("未安装 brotli，只生成 gzip 版本（pip install brotli）")
+    start = time.perf_counter()
+    manifest = StaticAssets.build(args.static_dir, args.brotli_quality)
+    elapsed = (time.perf_counter() - start) * 1000
+    print(f"\n{'文件':<28} {'原始':>10} {'gzip':>10} {'br':>10}  指纹路径")
+    for name, entry in manifest.items():
+        sizes = [entry['encodings'].get(enc, '-') for enc in ('gzip', 'br')]
+        print(f"{name:<28} {entry['size']:>10} {sizes[0]:>10} {sizes[1]:>10}  {DIST_DIR}/{entry['file']}")
+    print(f"\n已构建 {len(manifest)} 个文件，用时 {elapsed:.1f} ms")
+
+
+if __name__ == '__main__':
+    sys.exit(main())
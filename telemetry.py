@@ -0,0 +1,258 @@
+"""
+可观测性 - 分阶段延迟直方图、计数器（Prometheus 文本格式）与分级采样日志
+
+指标：
+- foodbot_stage_seconds{stage}：一轮对话各阶段耗时
+    session_load / session_save  Redis Session 读写
+    knowledge                    查询本地知识库（直接作答或补充资料）
+    history_prep                 读取历史并按 token 预算打包（含生成摘要）
+    upstream_connect             发出请求到收到千帆响应头（含建连、排队）
+    upstream_first_token         流式请求收到第一块增量
+    upstream_total               千帆响应完整读完
+    format                       回复格式化
+    history_save                 把一问一答写回对话存储
+    queue_wait                   等待生成名额的排队时间（只统计排过队的请求）
+    job_queue_wait               任务模式下生成任务从入队到被 Worker 取出的时间
+    turn_total                   /chat、/chat/stream 整轮耗时
+- foodbot_http_request_seconds{route}：所有路由的处理耗时
+- foodbot_upstream_responses_total{status} / foodbot_upstream_timeouts_total
+- foodbot_fallback_replies_total{reason}：返回给用户的兜底提示语
+- foodbot_admission_rejected_total{reason}：被准入控制拒绝（429）的请求
+- foodbot_knowledge_lookups_total{outcome}：本地知识库查询结果（direct 直接作答 / grounded 补充资料 / miss 无资料）
+- foodbot_chat_jobs_total{event}：生成任务的入队、拒绝、完成、重试、租约过期与进入死信次数
+另外在抓取时通过 collector 导出缓存、请求合并与健康检查的状态。
+
+指标按进程统计，多 Worker 部署时由 Prometheus 分别抓取各 Worker 后汇总。
+
+日志：各模块使用 logging.getLogger(__name__)，configure_logging() 按 LOG_LEVEL 设置级别，
+DEBUG 日志按 LOG_DEBUG_SAMPLE_RATE 采样；实际写出由后台线程（QueueListener）完成，不阻塞请求。
+fork 出的子进程（gunicorn 预加载模式下的 Worker）会自动重新启动写日志的线程。
+"""
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labels: dict) -> str:
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{k}="{_escape(v)}"' for k, v in labels.items()) + '}'
+
+
+def _format_value(value) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(self, name: str, documentation: str, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        # 不带标签的计数器从 0 开始导出，便于计算 rate()
+        self._values = {} if self.labelnames else {(): 0}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(str(labels.get(n, '')) for n in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def collect(self):
+        with self._lock:
+            items = list(self._values.items())
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} counter']
+        for key, value in items:
+            lines.append(f'{self.name}{_format_labels(dict(zip(self.labelnames, key)))} {_format_value(value)}')
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, documentation: str, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+        self._series = {}   # 标签 -> [各桶计数, 总和, 次数]
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = tuple(str(labels.get(n, '')) for n in self.labelnames)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][i] += 1
+                    break
+            series[1] += value
+            series[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """统计 with 块的耗时"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def collect(self):
+        with self._lock:
+            items = [(key, list(s[0]), s[1], s[2]) for key, s in self._series.items()]
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} histogram']
+        for key, counts, total, count in items:
+            labels = dict(zip(self.labelnames, key))
+            cumulative = 0
+            for bound, c in zip(self.buckets, counts):
+                cumulative += c
+                lines.append(f'{self.name}_bucket{_format_labels({**labels, "le": _format_value(float(bound))})} '
+                             f'{cumulative}')
+            lines.append(f'{self.name}_sum{_format_labels(labels)} {_format_value(total)}')
+            lines.append(f'{self.name}_count{_format_labels(labels)} {count}')
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+
+    def counter(self, name, documentation, labelnames=()) -> Counter:
+        metric = Counter(name, documentation, labelnames)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS) -> Histogram:
+        metric = Histogram(name, documentation, labelnames, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def add_collector(self, name: str, metric_type: str, documentation: str, collect):
+        """抓取时才计算的指标
+        :param collect: 无参函数，返回 [(标签字典, 数值), ...]
+        """
+        self._collectors.append((name, metric_type, documentation, collect))
+
+    def render(self) -> str:
+        """Prometheus 文本格式（0.0.4）"""
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.collect())
+        for name, metric_type, documentation, collect in self._collectors:
+            try:
+                samples = collect()
+            except Exception as e:
+                logging.getLogger(__name__).warning("采集指标 %s 失败: %s", name, e)
+                continue
+            lines.append(f'# HELP {name} {documentation}')
+            lines.append(f'# TYPE {name} {metric_type}')
+            for labels, value in samples:
+                lines.append(f'{name}{_format_labels(labels)} {_format_value(value)}')
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+STAGE_SECONDS = REGISTRY.histogram(
+    'foodbot_stage_seconds', '一轮对话各阶段的耗时（秒）', ['stage'])
+HTTP_REQUEST_SECONDS = REGISTRY.histogram(
+    'foodbot_http_request_seconds', '各路由的处理耗时（秒）', ['route'])
+UPSTREAM_RESPONSES = REGISTRY.counter(
+    'foodbot_upstream_responses_total', '千帆响应的状态码计数', ['status'])
+UPSTREAM_TIMEOUTS = REGISTRY.counter(
+    'foodbot_upstream_timeouts_total', '千帆请求超时次数')
+FALLBACK_REPLIES = REGISTRY.counter(
+    'foodbot_fallback_replies_total', '返回给用户的兜底提示语次数', ['reason'])
+ADMISSION_REJECTED = REGISTRY.counter(
+    'foodbot_admission_rejected_total', '被准入控制拒绝的请求数', ['reason'])
+KNOWLEDGE_LOOKUPS = REGISTRY.counter(
+    'foodbot_knowledge_lookups_total', '本地知识库查询结果（direct / grounded / miss）', ['outcome'])
+CHAT_JOBS = REGISTRY.counter(
+    'foodbot_chat_jobs_total', '生成任务的入队、拒绝、完成、重试、租约过期与进入死信次数', ['event'])
+
+
+def stage(name: str):
+    """统计一个阶段的耗时：with stage('format'): ..."""
+    return STAGE_SECONDS.time(stage=name)
+
+
+def observe_stage(name: str, seconds: float):
+    STAGE_SECONDS.observe(seconds, stage=name)
+
+
+# ---------------- 日志 ----------------
+class DebugSampler(logging.Filter):
+    """DEBUG 日志按比例采样，INFO 及以上全部保留"""
+
+    def __init__(self, rate: float):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record):
+        return record.levelno > logging.DEBUG or random.random() < self.rate
+
+
+_listener = None
+
+
+def configure_logging():
+    """按环境变量配置根日志（重复调用无副作用）
+    LOG_LEVEL：DEBUG / INFO / WARNING…，默认 INFO
+    LOG_DEBUG_SAMPLE_RATE：DEBUG 日志的采样比例，默认 0.1
+    """
+    global _listener
+    if _listener is not None:
+        return
+    level = getattr(logging, os.getenv('LOG_LEVEL', 'INFO').upper(), logging.INFO)
+    rate = float(os.getenv('LOG_DEBUG_SAMPLE_RATE', 0.1))
+
+    handler = logging.StreamHandler()
+    handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)s [%(name)s] %(message)s'))
+    log_queue = queue.SimpleQueue()
+    queue_handler = logging.handlers.QueueHandler(log_queue)
+    queue_handler.addFilter(DebugSampler(rate))
+
+    root = logging.getLogger()
+    root.setLevel(level)
+    # httpx / urllib3 在 INFO、DEBUG 级别每个请求都会打日志，只在调试时放开
+    for name in ('httpx', 'httpcore', 'urllib3'):
+        logging.getLogger(name).setLevel(level if level <= logging.DEBUG else logging.WARNING)
+    root.addHandler(queue_handler)
+    _listener = logging.handlers.QueueListener(log_queue, handler, respect_handler_level=True)
+    _listener.start()
+    os.register_at_fork(after_in_child=lambda: _restart_listener(queue_handler))
+
+
+def _restart_listener(queue_handler):
+    """fork 后子进程里没有父进程的写日志线程：换一个新队列（父进程队列的锁可能正被占用）重新启动"""
+    global _listener
+    if _listener is None:
+        return
+    log_queue = queue.SimpleQueue()
+    queue_handler.queue = log_queue
+    _listener = logging.handlers.QueueListener(log_queue, *_listener.handlers, respect_handler_level=True)
+    _listener.start()
+
+
+def stop_logging():
+    """进程退出前调用：写完队列中剩余的日志"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
@@ -0,0 +1,49 @@
+"""
+测试夹具 - 本地千帆替身（benchmarks/fake_qianfan.py）与内存中的 Redis（fakeredis）
+
+app.py / asgi.py 在导入时就按环境变量连接 Redis、读取千帆地址，所以要先启动替身、
+把 redis.from_url 换成同一个 fakeredis 服务器，再导入它们。
+"""
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+fakeredis = pytest.importorskip('fakeredis')
+
+
+@pytest.fixture(scope='session')
+def fake_qianfan():
+    """在随机端口上启动千帆替身，QIANFAN_BASE_URL 指向它"""
+    from benchmarks.fake_qianfan import start_server
+
+    server = start_server(port=0, latency='fixed:10', chunk_interval=0)
+    with pytest.MonkeyPatch.context() as patch:
+        patch.setenv('QIANFAN_BASE_URL', 'http://%s:%d' % server.server_address)
+        yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture(scope='session')
+def asgi_module(fake_qianfan):
+    """导入 asgi（连带 app），Flask 与 ASGI 两边共用一个 fakeredis 服务器"""
+    import redis
+    import redis.asyncio
+
+    server = fakeredis.FakeServer()
+    with pytest.MonkeyPatch.context() as patch:
+        for name, value in (('BAIDU_API_KEY', 'bce-test'),
+                            ('KNOWLEDGE_ENABLED', '0'),       # 让问题都走千帆替身
+                            ('ARCHIVE_PATH', ''),
+                            ('STATIC_ASSETS_ENABLED', '0'),
+                            ('CHAT_JOBS_ENABLED', '0')):
+            patch.setenv(name, value)
+        patch.setattr(redis, 'from_url', lambda *args, **kwargs: fakeredis.FakeRedis(server=server))
+        patch.setattr(redis.asyncio, 'from_url', lambda *args, **kwargs: fakeredis.FakeAsyncRedis(server=server))
+        import asgi
+        yield asgi
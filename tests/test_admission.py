@@ -0,0 +1,35 @@
+"""
+限流：用户桶与 IP 桶一起扣减
+"""
+import fakeredis
+import pytest
+
+from admission import Overloaded, RateLimiter
+
+
+def tokens(client, key):
+    return float(client.hget(f'food_bot:rate:{key}', 'tokens'))
+
+
+def test_ip_rejection_keeps_user_tokens():
+    client = fakeredis.FakeRedis()
+    limiter = RateLimiter(client, user_rate=0.001, user_burst=5, ip_rate=0.001, ip_burst=1)
+    limiter.check('u1', '10.0.0.1')
+    assert tokens(client, 'user:u1') == pytest.approx(4, abs=0.01)
+
+    for _ in range(3):
+        with pytest.raises(Overloaded, match='ip_rate'):
+            limiter.check('u1', '10.0.0.1')
+    assert tokens(client, 'user:u1') == pytest.approx(4, abs=0.01)
+
+    limiter.check('u1', '10.0.0.2')
+    assert tokens(client, 'user:u1') == pytest.approx(3, abs=0.01)
+
+
+def test_user_rejection_keeps_ip_tokens():
+    client = fakeredis.FakeRedis()
+    limiter = RateLimiter(client, user_rate=0.001, user_burst=1, ip_rate=0.001, ip_burst=5)
+    limiter.check('u1', '10.0.0.1')
+    with pytest.raises(Overloaded, match='user_rate'):
+        limiter.check('u1', '10.0.0.1')
+    assert tokens(client, 'ip:10.0.0.1') == pytest.approx(4, abs=0.01)
@@ -0,0 +1,335 @@
+"""
+AsyncFoodBot 与 ASGI 入口（asgi.py）对本地千帆替身的端到端测试
+"""
+import asyncio
+import json
+import time
+
+import pytest
+
+from food_bot import AsyncFoodBot, FallbackReply
+from model_router import ModelRouter
+from qianfan_transport import AsyncQianfanTransport
+from response_cache import ResponseCache
+
+
+def make_bot(cache=None):
+    return AsyncFoodBot('bce-test', transport=AsyncQianfanTransport.from_env('bce-test'),
+                        router=ModelRouter(), cache=cache)
+
+
+def run(bot, coro):
+    async def main():
+        try:
+            return await coro
+        finally:
+            await bot.aclose()
+    return asyncio.run(main())
+
+
+def parse_sse(body: str) -> list:
+    """把 SSE 响应体解析成 [(事件名, 数据), ...]"""
+    events = []
+    for block in body.strip().split('\n\n'):
+        fields = dict(line.split(': ', 1) for line in block.splitlines())
+        events.append((fields['event'], json.loads(fields['data'])))
+    return events
+
+
+# ---------------- AsyncFoodBot ----------------
+def test_ask_returns_formatted_reply(fake_qianfan):
+    bot = make_bot()
+    before = fake_qianfan.stats['requests']
+    reply = run(bot, bot.ask('成都火锅推荐', conversation_history=[
+        {'role': 'user', 'content': '你好'}, {'role': 'assistant', 'content': '您好！'}]))
+    assert reply and not isinstance(reply, FallbackReply)
+    assert fake_qianfan.stats['requests'] == before + 1
+
+
+def test_create_forwards_options_and_ping_is_async(fake_qianfan):
+    cache = ResponseCache(None)
+
+    async def main():
+        bot = await AsyncFoodBot.create('bce-test', router=ModelRouter(), cache=cache)
+        try:
+            return bot, await bot.ping()
+        finally:
+            await bot.aclose()
+
+    bot, ok = asyncio.run(main())
+    assert ok is True and bot.cache is cache
+
+
+def test_ask_empty_input_skips_upstream(fake_qianfan):
+    bot = make_bot()
+    before = fake_qianfan.stats['requests']
+    assert run(bot, bot.ask('   ')) == "请输入您想了解的美食问题哦~"
+    assert fake_qianfan.stats['requests'] == before
+
+
+def test_ask_uses_reply_cache_like_sync_bot(fake_qianfan):
+    cache = ResponseCache(None)
+    bot = make_bot(cache)
+
+    async def ask_three_times():
+        first = await bot.ask('北京烤鸭哪家好？')
+        second = await bot.ask('北京烤鸭哪家好')           # 句尾标点不同，命中同一条缓存
+        await bot.ask('北京烤鸭哪家好', use_cache=False)
+        return first, second
+
+    before = fake_qianfan.stats['requests']
+    first, second = run(bot, ask_three_times())
+    assert first == second
+    assert fake_qianfan.stats['requests'] == before + 2
+    assert cache.stats()['l1_hits'] == 1
+
+
+def test_ask_stream_yields_deltas_then_done(fake_qianfan):
+    cache = ResponseCache(None)
+    bot = make_bot(cache)
+
+    async def collect():
+        first = [event async for event in bot.ask_stream('上海有什么必吃的小吃')]
+        again = [event async for event in bot.ask_stream('上海有什么必吃的小吃')]
+        return first, again
+
+    events, cached = run(bot, collect())
+    assert [e['type'] for e in events[:-1]] == ['delta'] * (len(events) - 1) and len(events) > 1
+    assert events[-1]['type'] == 'done' and events[-1]['reply']
+    # 流式回复结束后写入缓存，再问时只有一个 done 事件
+    assert cached == [{'type': 'done', 'reply': events[-1]['reply']}]
+
+
+def test_ask_reports_upstream_errors_as_fallback(fake_qianfan, monkeypatch):
+    monkeypatch.setenv('QIANFAN_MAX_RETRIES', '0')
+    monkeypatch.setitem(fake_qianfan.config, 'error_rate', 1.0)
+    bot = make_bot()
+    reply = run(bot, bot.ask('广州早茶去哪里'))
+    assert isinstance(reply, FallbackReply) and reply.reason == 'http_error'
+
+
+# ---------------- ASGI 路由 ----------------
+@pytest.fixture(scope='module')
+def asgi_client(asgi_module):
+    """整个模块共用一个 TestClient：ASGI 应用的 Redis 连接与准入名额绑定在 lifespan 的事件循环上"""
+    from starlette.testclient import TestClient
+
+    with TestClient(asgi_module.application) as client:
+        yield client
+
+
+@pytest.fixture()
+def client(asgi_client):
+    """每个测试都是一个新访客（没有 Session Cookie）"""
+    asgi_client.cookies.clear()
+    return asgi_client
+
+
+def current_conversation(client):
+    response = client.get('/conversations')
+    assert response.status_code == 200
+    return response.json()
+
+
+def test_asgi_chat_records_turn(client):
+    cid = current_conversation(client)['current_conversation_id']
+
+    response = client.post('/chat', json={'message': '西安有什么好吃的面馆'})
+    data = response.json()
+    assert response.status_code == 200 and data['success'] and data['conversation_id'] == cid
+    assert not data['reply'].startswith('内部错误')
+
+    messages = client.get(f'/conversations/{cid}/messages').json()['messages']
+    assert [m['role'] for m in messages[-2:]] == ['user', 'assistant']
+    assert messages[-2]['content'] == '西安有什么好吃的面馆'
+    assert messages[-1]['content'] == data['reply']
+
+
+def test_asgi_chat_commands_and_validation(client):
+    current_conversation(client)
+    assert client.post('/chat', json={'message': ''}).json() == {'success': False, 'reply': '请输入内容'}
+    reply = client.post('/chat', json={'message': '帮助'}).json()
+    assert reply['success'] and '食探' in reply['reply']
+
+
+def test_asgi_chat_without_session(client):
+    assert client.post('/chat', json={'message': '你好'}).json() == {'success': False, 'reply': '请先创建对话'}
+
+
+def test_asgi_chat_stream(client):
+    cid = current_conversation(client)['current_conversation_id']
+    response = client.post('/chat/stream', json={'message': '长沙米粉哪家最正宗'})
+    assert response.status_code == 200
+    assert response.headers['content-type'].startswith('text/event-stream')
+
+    events = parse_sse(response.text)
+    assert {name for name, _ in events[:-1]} == {'delta'}
+    name, done = events[-1]
+    assert name == 'done' and done['conversation_id'] == cid and done['reply']
+
+
+def test_asgi_conversation_routes(client):
+    first = current_conversation(client)['current_conversation_id']
+
+    created = client.post('/conversations/new', json={}).json()
+    second = created.get('conversation_id') or current_conversation(client)['current_conversation_id']
+    assert second != first
+
+    ids = [c['id'] for c in current_conversation(client)['conversations']]
+    assert {first, second} <= set(ids)
+
+    assert client.post('/conversations/switch', json={'conversation_id': first}).status_code == 200
+    assert current_conversation(client)['current_conversation_id'] == first
+
+    # 布尔值不是合法的 version，退回完整的最后一页
+    switched = client.post('/conversations/switch', json={'conversation_id': first, 'since': True}).json()
+    assert switched['success'] and switched['delta'] is False
+
+    assert client.post('/conversations/delete', json={'conversation_id': second}).status_code == 200
+    assert second not in [c['id'] for c in current_conversation(client)['conversations']]
+
+
+def test_asgi_status(client):
+    cid = current_conversation(client)['current_conversation_id']
+    client.post('/conversations/new', json={})
+
+    data = client.get('/status').json()
+    assert data['success'] and data['status'] in ('active', 'starting')
+    assert data['conversation_count'] == 2
+    assert data['current_conversation_id'] not in ('', cid)
+    assert 'redis' in data['health']['checks']
+    assert data['admission']['active'] == 0
+    assert data['knowledge'] == {'enabled': False}
+    assert data['chat_jobs'] == {'enabled': False}
+
+
+def test_asgi_chat_stream_context_failure_is_sse_error(client, asgi_module, monkeypatch):
+    current_conversation(client)
+
+    async def broken(*args):
+        raise RuntimeError('boom')
+    monkeypatch.setattr(asgi_module, 'pack_context', broken)
+
+    response = client.post('/chat/stream', json={'message': '重庆火锅人均多少钱'})
+    assert response.headers['content-type'].startswith('text/event-stream')
+    assert parse_sse(response.text) == [('error', {'reply': '内部错误：RuntimeError'})]
+    assert asgi_module.upstream_limiter.stats()['active'] == 0
+
+
+def test_ask_stream_reports_unexpected_errors(fake_qianfan, monkeypatch):
+    bot = make_bot()
+
+    def broken(self, delta):
+        raise RuntimeError('formatter bug')
+    monkeypatch.setattr('reply_formatter.StreamingReplyFormatter.feed', broken)
+
+    async def collect():
+        return [event async for event in bot.ask_stream('南京有什么好吃的')]
+
+    events = run(bot, collect())
+    assert events[-1]['type'] == 'error' and events[-1]['reply'].reason == 'internal'
+
+
+def test_sync_ask_stream_reports_unexpected_errors(fake_qianfan, monkeypatch):
+    from food_bot import SimpleFoodBot
+
+    def broken(self, delta):
+        raise RuntimeError('formatter bug')
+    monkeypatch.setattr('reply_formatter.StreamingReplyFormatter.feed', broken)
+
+    bot = SimpleFoodBot('bce-test', router=ModelRouter(), check_connection=False)
+    events = list(bot.ask_stream('南京有什么好吃的'))
+    assert events[-1]['type'] == 'error' and events[-1]['reply'].reason == 'internal'
+
+
+def test_stream_slot_released_when_body_never_sent(asgi_module):
+    released = []
+
+    async def body():
+        yield 'never'
+
+    async def receive():
+        await asyncio.sleep(3600)
+
+    async def disconnected(message):
+        raise OSError('client went away')
+
+    response = asgi_module.SlotStreamingResponse(body(), lambda: released.append(True))
+    with pytest.raises(Exception):
+        asyncio.run(response({'type': 'http'}, receive, disconnected))
+    assert released == [True]
+
+
+# ---------------- 任务模式 ----------------
+@pytest.fixture()
+def job_mode(asgi_module, monkeypatch):
+    """打开任务模式，返回一个在后台线程中处理下一个任务的函数（相当于 python chat_jobs.py worker）"""
+    import threading
+
+    import app
+    from chat_jobs import JobWorker
+
+    monkeypatch.setattr(asgi_module.chat_jobs, 'enabled', True)
+    worker = JobWorker(asgi_module.chat_jobs, app.run_chat_job)
+    threads = []
+
+    def process_next(delay=0.0):
+        def run_one():
+            time.sleep(delay)
+            job = asgi_module.chat_jobs.claim(timeout=5)
+            assert job is not None
+            worker.process(job)
+        thread = threading.Thread(target=run_one, daemon=True)
+        thread.start()
+        threads.append(thread)
+
+    yield process_next
+    for thread in threads:
+        thread.join(10)
+
+
+def test_asgi_chat_stream_relays_job_result(client, job_mode):
+    cid = current_conversation(client)['current_conversation_id']
+    job_mode(delay=0.2)
+
+    response = client.post('/chat/stream', json={'message': '潮汕牛肉火锅怎么吃'})
+    events = parse_sse(response.text)
+    assert events[0][0] == 'job' and events[0][1]['status'] == 'queued'
+    name, done = events[-1]
+    assert name == 'done' and done['job_id'] == events[0][1]['job_id']
+    assert done['conversation_id'] == cid and done['reply'] and done['version']
+
+
+def test_asgi_job_long_poll_wakes_on_completion(client, job_mode):
+    current_conversation(client)
+    job = client.post('/chat', json={'message': '顺德双皮奶哪家好'})
+    assert job.status_code == 202
+
+    job_mode(delay=0.3)
+    start = time.perf_counter()
+    data = client.get(f"{job.json()['poll_url']}?wait=10").json()
+    assert data['status'] == 'done' and data['reply']
+    assert time.perf_counter() - start < 5
+
+
+def test_flask_job_routes_return_immediately(asgi_module, job_mode):
+    flask_client = asgi_module.flask_app.test_client()
+    flask_client.get('/conversations')
+
+    response = flask_client.post('/chat/stream', json={'message': '柳州螺蛳粉推荐'})
+    (name, job), = parse_sse(response.get_data(as_text=True))
+    assert name == 'job' and job['status'] == 'queued'
+
+    # Flask 入口不等待任务：wait 被忽略，事件流只有一条 status 事件
+    start = time.perf_counter()
+    assert flask_client.get(f"{job['poll_url']}?wait=10").get_json()['status'] == 'queued'
+    events = parse_sse(flask_client.get(job['events_url']).get_data(as_text=True))
+    assert [name for name, _ in events] == ['status']
+    assert time.perf_counter() - start < 1
+
+    job_mode()
+    deadline = time.monotonic() + 10
+    while (data := flask_client.get(job['poll_url']).get_json())['status'] != 'done':
+        assert time.monotonic() < deadline
+        time.sleep(0.1)
+    assert data['reply'] and data['conversation_id'] == job['conversation_id']
@@ -0,0 +1,52 @@
+"""
+对话归档：重复写入去重、保留版本号、旧表迁移
+"""
+import sqlite3
+
+from conversation_archive import ConversationArchive
+
+
+def turn(version, question='长沙有什么好吃的', answer='米粉和臭豆腐'):
+    return [{'role': 'user', 'content': question, 'timestamp': 't', 'version': version},
+            {'role': 'assistant', 'content': answer, 'timestamp': 't', 'version': version}]
+
+
+def test_duplicate_messages_are_ignored(tmp_path):
+    archive = ConversationArchive(str(tmp_path / 'archive.sqlite3'))
+    archive.append('u1', 'c1', turn(1))
+    # 补写归档时与本轮写入重叠
+    archive.append('u1', 'c1', turn(1) + turn(2, '武汉呢', '热干面'))
+    archive.append('u1', 'c1', turn(2, '武汉呢', '热干面'))
+
+    messages, cursor = archive.page('u1', 'c1', limit=10)
+    assert cursor is None
+    assert [(m['version'], m['role']) for m in messages] == [(1, 'user'), (1, 'assistant'),
+                                                             (2, 'user'), (2, 'assistant')]
+    # 不同用户的同名对话互不影响
+    archive.append('u2', 'c1', turn(1))
+    assert len(archive.page('u2', 'c1')[0]) == 2
+
+
+def test_messages_without_version(tmp_path):
+    archive = ConversationArchive(str(tmp_path / 'archive.sqlite3'))
+    archive.append('u1', 'c1', [{'role': 'user', 'content': '旧消息'}])
+    messages, _ = archive.page('u1', 'c1')
+    assert messages[0]['content'] == '旧消息' and 'version' not in messages[0]
+
+
+def test_migrates_table_without_version(tmp_path):
+    path = str(tmp_path / 'archive.sqlite3')
+    conn = sqlite3.connect(path)
+    conn.executescript("""
+        CREATE TABLE messages (
+            id INTEGER PRIMARY KEY AUTOINCREMENT, user_id TEXT NOT NULL, conversation_id TEXT NOT NULL,
+            role TEXT NOT NULL, content TEXT NOT NULL, timestamp TEXT, archived_at REAL NOT NULL);
+        INSERT INTO messages (user_id, conversation_id, role, content, archived_at) VALUES ('u1', 'c1', 'user', '旧消息', 0);
+    """)
+    conn.close()
+
+    archive = ConversationArchive(path)
+    archive.append('u1', 'c1', turn(5))
+    archive.append('u1', 'c1', turn(5))
+    messages, _ = archive.page('u1', 'c1')
+    assert [m.get('version') for m in messages] == [None, 5, 5]
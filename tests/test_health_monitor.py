@@ -0,0 +1,50 @@
+"""
+健康监控：连续失败阈值与跨进程共用的探测结果
+"""
+import fakeredis
+
+from health_monitor import HealthMonitor, SharedProbe
+
+
+def probe_sequence(*results):
+    calls = []
+
+    def probe():
+        calls.append(True)
+        return results[min(len(calls), len(results)) - 1]
+    return probe, calls
+
+
+def test_check_turns_unhealthy_only_after_threshold():
+    monitor = HealthMonitor()
+    probe, _ = probe_sequence(True, False, False, False, True)
+    monitor.add_check('qianfan', probe, failure_threshold=3)
+    check = monitor._checks['qianfan']
+
+    states = []
+    for _ in range(5):
+        monitor._probe(check)
+        states.append(monitor.status('qianfan'))
+    assert states == [True, True, True, False, True]
+
+
+def test_shared_probe_runs_once_per_ttl():
+    server = fakeredis.FakeServer()
+    probe, calls = probe_sequence(True)
+    workers = [SharedProbe(fakeredis.FakeRedis(server=server), 'health:qianfan', probe, ttl=60)
+               for _ in range(3)]
+
+    assert all(worker() for worker in workers)
+    assert len(calls) == 1
+
+
+def test_shared_probe_shares_failures_briefly():
+    redis_client = fakeredis.FakeRedis()
+    probe, calls = probe_sequence(False, True)
+    shared = SharedProbe(redis_client, 'health:qianfan', probe, ttl=60, failure_ttl=2)
+
+    assert shared() is False and shared() is False
+    assert len(calls) == 1
+    assert 0 < redis_client.ttl('health:qianfan') <= 2
+    redis_client.delete('health:qianfan')
+    assert shared() is True and len(calls) == 2
@@ -0,0 +1,92 @@
+"""
+模型路由的对冲：主请求保持非流式，输掉的一方立即断开连接、释放名额
+"""
+import asyncio
+import time
+
+import pytest
+
+from benchmarks.fake_qianfan import start_server
+from food_bot import AsyncFoodBot, SimpleFoodBot
+from model_router import CancelToken, HedgeCancelled, ModelRouter
+from qianfan_transport import AsyncQianfanTransport, QianfanTransport
+
+
+@pytest.fixture(scope='module')
+def upstream():
+    server = start_server(port=0, latency='fixed:10', model_latency={'slow': 'fixed:3000', 'quick': 'fixed:20'})
+    yield 'http://%s:%d' % server.server_address
+    server.shutdown()
+    server.server_close()
+
+
+def make_router(**kwargs):
+    return ModelRouter(primary='slow', hedge='quick', hedge_initial_delay=0.2, **kwargs)
+
+
+def payload(model='slow'):
+    return {'model': model, 'messages': [{'role': 'user', 'content': '长沙米粉'}]}
+
+
+def wait_idle(router, timeout=1.0):
+    deadline = time.monotonic() + timeout
+    while router.stats()['pool_busy'] and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return router.stats()
+
+
+def test_sync_hedge_aborts_non_streaming_primary(upstream):
+    router = make_router()
+    transport = QianfanTransport('bce-test', base_url=upstream)
+    bot = SimpleFoodBot('bce-test', transport=transport, router=router, check_connection=False)
+    sent = []
+    post = transport.post
+
+    def spy(data, **kwargs):
+        sent.append((data['model'], data.get('stream', False), kwargs.get('cancel') is not None))
+        return post(data, **kwargs)
+    transport.post = spy
+
+    start = time.perf_counter()
+    reply = router.call(payload(), bot._request_completion)
+    assert reply and time.perf_counter() - start < 1.5
+    assert sorted(sent) == [('quick', False, True), ('slow', False, True)]
+
+    # 主请求的连接在发送后、响应头到达前被断开，不用等上游的 3 秒
+    stats = wait_idle(router)
+    assert stats['pool_busy'] == 0 and stats['hedges_in_flight'] == 0
+    assert stats['hedges_fired'] == stats['hedges_won'] == 1
+    transport.close()
+
+
+def test_sync_cancelled_request_fails_fast(upstream):
+    bot = SimpleFoodBot('bce-test', transport=QianfanTransport('bce-test', base_url=upstream, backoff_factor=5),
+                        router=make_router(), check_connection=False)
+    cancel = CancelToken()
+    cancel.set()
+    start = time.perf_counter()
+    with pytest.raises(HedgeCancelled):
+        bot._request_completion(payload('quick'), cancel)
+    assert time.perf_counter() - start < 1
+
+
+def test_async_hedge_respects_max_hedges(upstream):
+    router = make_router(max_hedges=1)
+    bot = AsyncFoodBot('bce-test', transport=AsyncQianfanTransport('bce-test', base_url=upstream), router=router)
+
+    async def main():
+        try:
+            start = time.perf_counter()
+            replies = await asyncio.gather(router.acall(payload(), bot._request_completion),
+                                           router.acall(payload(), bot._request_completion))
+            return replies, time.perf_counter() - start
+        finally:
+            await bot.aclose()
+
+    replies, elapsed = asyncio.run(main())
+    assert all(replies)
+    stats = router.stats()
+    # 只对冲了一个请求，另一个等主请求返回
+    assert stats['hedges_fired'] == 1 and stats['hedges_skipped'] == 1
+    assert elapsed >= 2.5
+    assert stats['pool_busy'] == 0 and stats['hedges_in_flight'] == 0